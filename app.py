@@ -1,39 +1,126 @@
 import os
+import re
 import sqlite3
 import logging
 import datetime
 import json
 import io
 import csv
-import pandas as pd
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
 import base64
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from flask import Response
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, session, flash, jsonify, make_response, send_file
+from werkzeug.security import generate_password_hash
+from functools import wraps
+from flask import Response, stream_with_context
+from database import backend, begin_write, get_db_connection, open_db_connection, init_app as init_db_app
+from migrations import migrate
+from postgres import STUDENT_SEARCH_VECTOR, create_schema as create_postgres_schema
+from export_jobs import ExportJobs, JOB_FORMATS
+from rollups import record_check_in, record_check_ins, record_checkout, record_checkouts, rebuild_rollups_command
+from cache import app_cache, data_stamps
+from auto_checkout import auto_checkout, expire_sessions_command, sweeper_metrics
+from reservations import reservation_conflicts
+from roster import import_roster, import_roster_command, text_stream
+from pagination import paginate, page_url
+from conditional import conditional
+from assets import init_app as init_assets
+from passwords import HasherBusy, password_hasher
+from live import change_feed, latest_event_id
+from metrics import metrics
+from slow_queries import slow_query_log, slow_query_summary
+from archive import ArchiveError, sit_ins_source, init_app as init_archive
+from timestamps import format_epoch, now_epoch, to_epoch
+from charts import CHART_FORMATS, CHARTS, chart_cache, chart_key, render_chart
+
+# pandas is imported inside the export code paths only; loading it at module
+# level costs every worker hundreds of milliseconds and tens of MB at boot.
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "development_secret_key")
+# Routes are collected on a blueprint and attached by create_app()
+bp = Blueprint('main', __name__)
 
-# Database connection helper
-def get_db_connection():
-    conn = sqlite3.connect('sitin_system.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+export_jobs = ExportJobs()
+
+# Application factory
+def create_app(config=None):
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "development_secret_key")
+    
+    app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+    app.config['SSE_POLL_SECONDS'] = int(os.environ.get('SSE_POLL_SECONDS', 5))
+    
+    if config:
+        app.config.update(config)
+    
+    # Pooled, request-scoped database connections
+    init_db_app(app)
+    
+    export_jobs.init_app(app, run_export_job)
+    auto_checkout.init_app(app)
+    password_hasher.init_app(app)
+    
+    # Request and SQL timings on /metrics
+    metrics.init_app(app)
+    slow_query_log.init_app(app)
+    
+    # Fingerprinted static files from 'flask build-assets'
+    init_assets(app)
+    
+    # Old semesters moved to attached archive files
+    init_archive(app)
+    chart_cache.init_app(app)
+    
+    app.register_blueprint(bp)
+    app.add_template_global(page_url)
+    app.add_template_filter(format_epoch, 'timestamp')
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(import_roster_command)
+    app.cli.add_command(expire_sessions_command)
+    
+    return app
 
 # Initialize database tables
-def init_db():
-    conn = get_db_connection()
+def init_db(app=None):
+    conn = open_db_connection((app or current_app).config['DATABASE'])
+    
+    # PostgreSQL gets the current schema in its own dialect; SQLite databases
+    # get the original tables and are brought up to date by migrate() below
+    if backend(conn) == 'postgresql':
+        create_postgres_schema(conn)
+    else:
+        create_tables(conn)
+    
+    # Insert default admin user if not exists
+    admin_exists = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()
     
-    # Create tables
+    if not admin_exists:
+        method = (app or current_app).config['PASSWORD_HASH_METHOD']
+        conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                     ('admin', generate_password_hash('admin123', method), 'admin'))
+    
+    # Insert sample laboratory data if not exists
+    labs_exist = conn.execute("SELECT id FROM laboratories").fetchone()
+    
+    if not labs_exist:
+        lab_data = [
+            (524, 'Laboratory 524', 30, 'General Programming Lab'),
+            (526, 'Laboratory 526', 25, 'C# Programming Lab'),
+            (528, 'Laboratory 528', 30, 'Web Development Lab'),
+            (530, 'Laboratory 530', 35, 'Java Programming Lab'),
+            (542, 'Laboratory 542', 25, 'Mobile Development Lab')
+        ]
+        
+        conn.executemany("INSERT INTO laboratories (id, name, capacity, description) VALUES (?, ?, ?, ?)", lab_data)
+    
+    conn.commit()
+    
+    # Bring indexes and later schema changes up to date
+    migrate(conn)
+    conn.close()
+
+# Tables of the original SQLite schema
+def create_tables(conn):
     conn.execute('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -114,30 +201,103 @@ def init_db():
         FOREIGN KEY (lab_id) REFERENCES laboratories (id)
     )
     ''')
+
+# Half-open [start, end) bounds covering the calendar days date_from..date_to.
+# Comparing the raw timestamp column against these keeps date filters sargable,
+# where DATE(column) would force a full scan.
+def day_bounds(date_from, date_to=None):
+    try:
+        start = datetime.date.fromisoformat(date_from)
+        end = datetime.date.fromisoformat(date_to or date_from) + datetime.timedelta(days=1)
+    except (TypeError, ValueError):
+        # Unparseable dates match nothing, as DATE() comparisons did
+        return date_from, date_from
+    return start.isoformat(), end.isoformat()
+
+# day_bounds() as epoch seconds, for the sit_ins time columns
+def epoch_bounds(date_from, date_to=None):
+    try:
+        start = datetime.date.fromisoformat(date_from)
+        end = datetime.date.fromisoformat(date_to or date_from) + datetime.timedelta(days=1)
+    except (TypeError, ValueError):
+        return 0, 0
+    return to_epoch(start), to_epoch(end)
+
+# Turn free text into an FTS5 query where every word has to prefix-match a
+# token in the student's ID, name or program
+def fts_prefix_query(text):
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', text))
+
+# The same prefix query for PostgreSQL's full-text search
+def tsquery_prefix_query(text):
+    return ' & '.join('%s:*' % word for word in re.findall(r'[^\W_]+', text))
+
+# Ranked student search. An all-digit query is tried against the primary key
+# first so exact ID lookups never depend on the full-text index.
+def search_students(conn, text, limit=5, program=None, year_level=None):
+    filters = ''
+    filter_params = []
+    
+    if program:
+        filters += ' AND st.program = ?'
+        filter_params.append(program)
+    
+    if year_level:
+        filters += ' AND st.year_level = ?'
+        filter_params.append(year_level)
+    
+    text = text.strip()
+    results = []
+    
+    if text.isdigit():
+        exact = conn.execute('SELECT st.* FROM students st WHERE st.id = ?' + filters,
+                             [int(text)] + filter_params).fetchone()
+        if exact:
+            results.append(exact)
+    
+    if backend(conn) == 'postgresql':
+        match = tsquery_prefix_query(text)
+        ranked_query = '''
+            SELECT st.*
+            FROM students st
+            WHERE ''' + STUDENT_SEARCH_VECTOR + ''' @@ to_tsquery('simple', ?)''' + filters + '''
+            ORDER BY ts_rank(''' + STUDENT_SEARCH_VECTOR + ''', to_tsquery('simple', ?), 2) DESC, st.id
+            LIMIT ?
+        '''
+        ranked_params = [match] + filter_params + [match, limit + len(results)]
+    else:
+        match = fts_prefix_query(text)
+        ranked_query = '''
+            SELECT st.*
+            FROM students_fts
+            JOIN students st ON st.id = students_fts.rowid
+            WHERE students_fts MATCH ?''' + filters + '''
+            ORDER BY bm25(students_fts, 10.0, 5.0, 1.0)
+            LIMIT ?
+        '''
+        ranked_params = [match] + filter_params + [limit + len(results)]
     
-    # Insert default admin user if not exists
-    admin_exists = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()
-    
-    if not admin_exists:
-        conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                     ('admin', generate_password_hash('admin123'), 'admin'))
-    
-    # Insert sample laboratory data if not exists
-    labs_exist = conn.execute("SELECT id FROM laboratories").fetchone()
-    
-    if not labs_exist:
-        lab_data = [
-            (524, 'Laboratory 524', 30, 'General Programming Lab'),
-            (526, 'Laboratory 526', 25, 'C# Programming Lab'),
-            (528, 'Laboratory 528', 30, 'Web Development Lab'),
-            (530, 'Laboratory 530', 35, 'Java Programming Lab'),
-            (542, 'Laboratory 542', 25, 'Mobile Development Lab')
-        ]
+    if match and len(results) < limit:
+        ranked = conn.execute(ranked_query, ranked_params).fetchall()
         
-        conn.executemany("INSERT INTO laboratories (id, name, capacity, description) VALUES (?, ?, ?, ?)", lab_data)
+        seen = {row['id'] for row in results}
+        results.extend(row for row in ranked if row['id'] not in seen)
     
-    conn.commit()
-    conn.close()
+    return results[:limit]
+
+# Laboratories change only through maintenance, so every route shares one
+# cached copy per worker
+def get_laboratories(conn):
+    return app_cache.get(conn, 'laboratories',
+                         lambda: conn.execute('SELECT * FROM laboratories ORDER BY id').fetchall())
+
+def get_recent_announcements(conn):
+    return app_cache.get(conn, 'announcements', lambda: conn.execute('''
+        SELECT id, content, posted_by, date_posted 
+        FROM announcements 
+        ORDER BY date_posted DESC, id DESC
+        LIMIT 10
+    ''').fetchall())
 
 # Login required decorator
 def login_required(f):
@@ -145,7 +305,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please login first', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -155,18 +315,25 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_role' not in session or session['user_role'] != 'admin':
             flash('Admin access required', 'error')
-            return redirect(url_for('home'))
+            return redirect(url_for('main.home'))
         return f(*args, **kwargs)
     return decorated_function
 
+# Shed sign-in load while the password hashing pool is saturated
+def busy_response(template):
+    flash('Too many sign-ins right now, please try again in a few seconds', 'error')
+    response = make_response(render_template(template), 503)
+    response.headers['Retry-After'] = '5'
+    return response
+
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('home'))
-    return redirect(url_for('login'))
+        return redirect(url_for('main.home'))
+    return redirect(url_for('main.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -174,19 +341,28 @@ def login():
         
         conn = get_db_connection()
         user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
         
-        if user and check_password_hash(user['password'], password):
+        try:
+            valid, new_hash = password_hasher.verify(user['password'], password) if user else (False, None)
+        except HasherBusy:
+            return busy_response('login.html')
+        
+        if valid:
+            # Hashed with outdated cost parameters; store the upgraded hash
+            if new_hash:
+                conn.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user['id']))
+                conn.commit()
+            
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['user_role'] = user['role']
-            return redirect(url_for('home'))
+            return redirect(url_for('main.home'))
         else:
             flash('Invalid credentials', 'error')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -203,27 +379,30 @@ def register():
         existing_user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
         
         if existing_user:
-            conn.close()
             flash('Username already exists', 'error')
             return render_template('register.html')
         
+        try:
+            password_hash = password_hasher.hash(password)
+        except HasherBusy:
+            return busy_response('register.html')
+        
         # Insert new user
         conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
-                    (username, generate_password_hash(password), 'user'))
+                    (username, password_hash, 'user'))
         conn.commit()
-        conn.close()
         
         flash('Registration successful! Please login.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/home')
+@bp.route('/home')
 @login_required
 def home():
     conn = get_db_connection()
@@ -231,24 +410,18 @@ def home():
     # Get statistics
     students_registered = conn.execute('SELECT COUNT(*) as count FROM students').fetchone()['count']
     currently_sit_in = conn.execute('SELECT COUNT(*) as count FROM sit_ins WHERE status = "active"').fetchone()['count']
-    total_sit_in = conn.execute('SELECT COUNT(*) as count FROM sit_ins').fetchone()['count']
+    total_sit_in = conn.execute('SELECT COALESCE(SUM(sit_in_count), 0) as count FROM usage_rollups').fetchone()['count']
     
     # Get programming languages statistics
     programming_stats = conn.execute('''
-        SELECT purpose, COUNT(*) as count 
-        FROM sit_ins 
+        SELECT purpose, SUM(sit_in_count) as count 
+        FROM usage_rollups 
         GROUP BY purpose
+        ORDER BY purpose
     ''').fetchall()
     
     # Get announcements
-    announcements = conn.execute('''
-        SELECT content, posted_by, date_posted 
-        FROM announcements 
-        ORDER BY date_posted DESC 
-        LIMIT 10
-    ''').fetchall()
-    
-    conn.close()
+    announcements = get_recent_announcements(conn)
     
     # Prepare programming stats for chart
     prog_labels = [row['purpose'] for row in programming_stats]
@@ -262,13 +435,13 @@ def home():
                           prog_counts=json.dumps(prog_counts),
                           announcements=announcements)
 
-@app.route('/search', methods=['GET', 'POST'])
+@bp.route('/search', methods=['GET', 'POST'])
 @login_required
 def search():
     # Get data for dropdowns
     conn = get_db_connection()
     programs = conn.execute('SELECT DISTINCT program FROM students ORDER BY program').fetchall()
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
+    laboratories = get_laboratories(conn)
     
     student = None
     recent_activity = []
@@ -282,7 +455,7 @@ def search():
                 SELECT purpose, lab_id, login_time, logout_time 
                 FROM sit_ins 
                 WHERE student_id = ? 
-                ORDER BY login_time DESC LIMIT 5
+                ORDER BY login_time DESC, id DESC LIMIT 5
             ''', (student_id_param,)).fetchall()
     
     # Handle POST search
@@ -293,51 +466,49 @@ def search():
         
         if not student_id and not program and not year_level:
             flash('Please enter search criteria', 'error')
-            conn.close()
-            return redirect(url_for('search'))
-        
-        # Build query dynamically based on parameters
-        query = 'SELECT * FROM students WHERE 1=1'
-        params = []
+            return redirect(url_for('main.search'))
         
         if student_id:
-            # Try both exact ID match and name/program contains search
-            query += ' AND (id = ? OR name LIKE ? OR program LIKE ?)'
-            params.extend([student_id, f'%{student_id}%', f'%{student_id}%'])
-        
-        if program:
-            query += ' AND program = ?'
-            params.append(program)
-        
-        if year_level:
-            query += ' AND year_level = ?'
-            params.append(year_level)
-        
-        # Limit to first result if there are multiple matches
-        query += ' LIMIT 1'
-        
-        student = conn.execute(query, params).fetchone()
+            # Exact ID match first, then the best ranked name/program match
+            matches = search_students(conn, student_id, 1, program, year_level)
+            student = matches[0] if matches else None
+        else:
+            # Build query dynamically based on parameters
+            query = 'SELECT * FROM students WHERE 1=1'
+            params = []
+            
+            if program:
+                query += ' AND program = ?'
+                params.append(program)
+            
+            if year_level:
+                query += ' AND year_level = ?'
+                params.append(year_level)
+            
+            # Limit to first result if there are multiple matches
+            query += ' LIMIT 1'
+            
+            student = conn.execute(query, params).fetchone()
         
         if student:
             recent_activity = conn.execute('''
                 SELECT purpose, lab_id, login_time, logout_time 
                 FROM sit_ins 
                 WHERE student_id = ? 
-                ORDER BY login_time DESC LIMIT 5
+                ORDER BY login_time DESC, id DESC LIMIT 5
             ''', (student['id'],)).fetchall()
         else:
             flash('No matching student found', 'error')
     
-    conn.close()
-    
     return render_template('search.html', 
                           student=student, 
                           programs=programs,
                           laboratories=laboratories,
                           recent_activity=recent_activity)
 
-@app.route('/api/search-students', methods=['GET'])
+@bp.route('/api/search-students', methods=['GET'])
 @login_required
+@conditional('students', max_age=30, renders_flashes=False)
 def api_search_students():
     query = request.args.get('query', '')
     
@@ -346,13 +517,8 @@ def api_search_students():
     
     conn = get_db_connection()
     
-    # Search by ID, name, and program with LIKE
-    students = conn.execute('''
-        SELECT id, name, program, year_level
-        FROM students
-        WHERE id LIKE ? OR name LIKE ? OR program LIKE ?
-        LIMIT 5
-    ''', (f'%{query}%', f'%{query}%', f'%{query}%')).fetchall()
+    # Search by ID, name, and program through the full-text index
+    students = search_students(conn, query, 5)
     
     # Convert row objects to dictionaries
     result = []
@@ -364,16 +530,14 @@ def api_search_students():
             'year_level': student['year_level']
         })
     
-    conn.close()
-    
     return jsonify({'students': result})
 
-@app.route('/student/<int:student_id>')
+@bp.route('/student/<int:student_id>')
 @login_required
+@conditional('students', max_age=30, renders_flashes=False)
 def get_student(student_id):
     conn = get_db_connection()
     student = conn.execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
-    conn.close()
     
     if student:
         return jsonify({
@@ -384,7 +548,33 @@ def get_student(student_id):
     else:
         return jsonify({'error': 'Student not found'}), 404
 
-@app.route('/sit-in', methods=['GET', 'POST'])
+# Import an enrollment roster. Takes a multipart upload ("roster") or a raw
+# text/csv body; JSON clients get the counts back, the form gets a flash message.
+@bp.route('/students/import', methods=['POST'])
+@admin_required
+def import_students():
+    upload = request.files.get('roster')
+    stream = upload.stream if upload else request.stream
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    
+    conn = get_db_connection()
+    try:
+        result = import_roster(conn, text_stream(stream))
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('main.search'))
+    
+    if wants_json:
+        return jsonify(result)
+    
+    flash(f"Roster imported: {result['inserted']} added, {result['updated']} updated, "
+          f"{result['unchanged']} unchanged, {result['rejected']} rejected",
+          'error' if result['rejected'] else 'success')
+    return redirect(url_for('main.search'))
+
+@bp.route('/sit-in', methods=['GET', 'POST'])
 @login_required
 def sit_in():
     if request.method == 'POST':
@@ -392,44 +582,46 @@ def sit_in():
         student_name = request.form.get('student_name')
         purpose = request.form.get('purpose')
         lab_id = request.form.get('lab')
-        remaining_session = request.form.get('remaining_session', 30)
-        
-        # Check if student exists
-        conn = get_db_connection()
-        student = conn.execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
-        
-        # If student doesn't exist, add them
-        if not student:
-            conn.execute('INSERT INTO students (id, name, program, year_level) VALUES (?, ?, ?, ?)',
-                        (student_id, student_name, purpose.split(' ')[0], 1))
+        remaining_session = session_minutes(request.form.get('remaining_session', '30'))
         
-        # Check if student already has an active sit-in
-        active_sit_in = conn.execute('''
-            SELECT * FROM sit_ins 
-            WHERE student_id = ? AND status = "active"
-        ''', (student_id,)).fetchone()
+        # An empty or non-numeric session would be overdue at once
+        if remaining_session is None:
+            flash('Remaining session must be a positive number of minutes', 'error')
+            return redirect(url_for('main.sit_in'))
         
-        if active_sit_in:
-            conn.close()
-            flash('Student already has an active sit-in session', 'error')
-            return redirect(url_for('sit_in'))
+        conn = get_db_connection()
         
-        # Create new sit-in record
-        now = datetime.datetime.now()
+        # Add the student if they are not registered yet
         conn.execute('''
+            INSERT INTO students (id, name, program, year_level) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO NOTHING
+        ''', (student_id, student_name, purpose.split(' ')[0], 1))
+        
+        # Create new sit-in record; the partial unique index on active sit-ins
+        # turns a second active session for the student into a no-op, even
+        # when two check-ins race
+        now = now_epoch()
+        cursor = conn.execute('''
             INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, status, session_remaining)
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (student_id) WHERE status = 'active' DO NOTHING
         ''', (student_id, purpose, lab_id, now, 'active', remaining_session))
         
+        if cursor.rowcount == 0:
+            conn.rollback()
+            flash('Student already has an active sit-in session', 'error')
+            return redirect(url_for('main.sit_in'))
+        
+        record_check_in(conn, lab_id, purpose, now)
+        
         conn.commit()
-        conn.close()
         
         flash('Student successfully checked in', 'success')
-        return redirect(url_for('view_sit_in'))
+        return redirect(url_for('main.view_sit_in'))
     
     # GET method - display form
     conn = get_db_connection()
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
+    laboratories = get_laboratories(conn)
     current_sit_ins = conn.execute('''
         SELECT s.id, s.student_id, st.name, s.purpose, s.lab_id, l.name as lab_name, 
                s.login_time, s.status, s.session_remaining
@@ -437,33 +629,217 @@ def sit_in():
         JOIN students st ON s.student_id = st.id
         JOIN laboratories l ON s.lab_id = l.id
         WHERE s.status = "active"
-        ORDER BY s.login_time DESC
+        ORDER BY s.login_time DESC, s.id DESC
     ''').fetchall()
-    conn.close()
     
-    return render_template('sit_in.html', laboratories=laboratories, current_sit_ins=current_sit_ins)
+    last_event_id = latest_event_id(conn)
+    
+    return render_template('sit_in.html', laboratories=laboratories, current_sit_ins=current_sit_ins,
+                           last_event_id=last_event_id)
 
-@app.route('/checkout/<int:sit_in_id>')
+@bp.route('/checkout/<int:sit_in_id>')
 @login_required
 def checkout(sit_in_id):
     conn = get_db_connection()
     
-    # Update sit-in status and logout time
-    now = datetime.datetime.now()
-    conn.execute('''
+    # Update sit-in status and logout time, counting it in the daily rollup.
+    # The write lock is taken first so a double click or the auto-checkout
+    # sweeper cannot count the same session twice.
+    begin_write(conn)
+    now = now_epoch()
+    if record_checkout(conn, sit_in_id, now):
+        conn.execute('''
+            UPDATE sit_ins 
+            SET status = "completed", logout_time = ?, duration_seconds = ? - login_time 
+            WHERE id = ? AND status = "active"
+        ''', (now, now, sit_in_id))
+    
+    conn.commit()
+    
+    flash('Student successfully checked out', 'success')
+    return redirect(url_for('main.view_sit_in'))
+
+# Largest number of items accepted by one batch request
+BATCH_LIMIT = 500
+
+# Session length in minutes from a request value: a positive integer, given as
+# a number or a string of digits, or None
+def session_minutes(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    return value if isinstance(value, int) and value > 0 else None
+
+# Check in a whole class at once. Body: {"check_ins": [{"student_id", "student_name",
+# "purpose", "lab", "remaining_session"}, ...]}. Items are validated together and
+# the valid ones applied in one transaction; the response has one result per item.
+@bp.route('/api/sit-ins/batch-check-in', methods=['POST'])
+@login_required
+def batch_check_in():
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('check_ins')
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'check_ins must be a non-empty list'}), 400
+    
+    if len(items) > BATCH_LIMIT:
+        return jsonify({'error': f'At most {BATCH_LIMIT} check-ins per batch'}), 400
+    
+    conn = get_db_connection()
+    lab_ids = {lab['id'] for lab in get_laboratories(conn)}
+    
+    results = [None] * len(items)
+    valid = []
+    seen = set()
+    
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'index': index, 'status': 'error', 'error': 'Each check-in must be an object'}
+            continue
+        
+        student_id = str(item.get('student_id', '')).strip()
+        purpose = item.get('purpose')
+        lab_id = str(item.get('lab', item.get('lab_id', ''))).strip()
+        remaining = session_minutes(item.get('remaining_session', 30))
+        
+        if not student_id.isdigit() or not isinstance(purpose, str) or not purpose.strip() or not lab_id.isdigit():
+            results[index] = {'index': index, 'status': 'error', 'error': 'student_id, purpose and lab are required'}
+        elif remaining is None:
+            results[index] = {'index': index, 'status': 'error',
+                              'error': 'remaining_session must be a positive number of minutes'}
+        elif int(lab_id) not in lab_ids:
+            results[index] = {'index': index, 'status': 'error', 'error': 'Unknown laboratory'}
+        elif int(student_id) in seen:
+            results[index] = {'index': index, 'status': 'error', 'error': 'Student appears twice in this batch'}
+        else:
+            seen.add(int(student_id))
+            valid.append((index, int(student_id), str(item.get('student_name') or 'Unknown'), purpose.strip(),
+                          int(lab_id), remaining))
+    
+    # Take the write lock up front so validation and inserts see the same data
+    begin_write(conn, ['student:%d' % entry[1] for entry in valid])
+    
+    # One query for every student that already has an active sit-in
+    if valid:
+        active = {row['student_id'] for row in conn.execute(
+            'SELECT student_id FROM sit_ins WHERE status = "active" AND student_id IN (%s)'
+            % ', '.join('?' * len(valid)), [entry[1] for entry in valid])}
+        
+        for entry in [entry for entry in valid if entry[1] in active]:
+            results[entry[0]] = {'index': entry[0], 'status': 'error',
+                                 'error': 'Student already has an active sit-in session'}
+            valid.remove(entry)
+    
+    if valid:
+        now = now_epoch()
+        
+        # Students not registered yet are added like the single check-in does
+        conn.executemany('''
+            INSERT INTO students (id, name, program, year_level) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO NOTHING
+        ''', [(student_id, name, purpose.split(' ')[0], 1)
+              for index, student_id, name, purpose, lab_id, remaining in valid])
+        conn.executemany('''
+            INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, status, session_remaining)
+            VALUES (?, ?, ?, ?, 'active', ?)
+        ''', [(student_id, purpose, lab_id, now, remaining)
+              for index, student_id, name, purpose, lab_id, remaining in valid])
+        record_check_ins(conn, [(lab_id, purpose, now) for index, student_id, name, purpose, lab_id, remaining in valid])
+        
+        sit_in_ids = {row['student_id']: row['id'] for row in conn.execute(
+            'SELECT id, student_id FROM sit_ins WHERE status = "active" AND student_id IN (%s)'
+            % ', '.join('?' * len(valid)), [entry[1] for entry in valid])}
+        
+        for index, student_id, name, purpose, lab_id, remaining in valid:
+            results[index] = {'index': index, 'status': 'ok', 'student_id': student_id,
+                              'sit_in_id': sit_in_ids.get(student_id)}
+    
+    conn.commit()
+    
+    return jsonify({'checked_in': len(valid), 'results': results})
+
+# Check out many sit-ins at once. Body: {"sit_in_ids": [...]}
+@bp.route('/api/sit-ins/batch-checkout', methods=['POST'])
+@login_required
+def batch_checkout():
+    payload = request.get_json(silent=True) or {}
+    sit_in_ids = payload.get('sit_in_ids')
+    
+    if not isinstance(sit_in_ids, list) or not sit_in_ids:
+        return jsonify({'error': 'sit_in_ids must be a non-empty list'}), 400
+    
+    if len(sit_in_ids) > BATCH_LIMIT:
+        return jsonify({'error': f'At most {BATCH_LIMIT} checkouts per batch'}), 400
+    
+    ids = [int(value) for value in sit_in_ids if str(value).isdigit()]
+    
+    conn = get_db_connection()
+    begin_write(conn)
+    
+    now = now_epoch()
+    checked_out = set(record_checkouts(conn, ids, now)) if ids else set()
+    conn.executemany('''
         UPDATE sit_ins 
-        SET status = "completed", logout_time = ? 
+        SET status = "completed", logout_time = ?, duration_seconds = ? - login_time 
         WHERE id = ?
-    ''', (now, sit_in_id))
+    ''', [(now, now, sit_in_id) for sit_in_id in checked_out])
     
     conn.commit()
-    conn.close()
     
-    flash('Student successfully checked out', 'success')
-    return redirect(url_for('view_sit_in'))
+    results = []
+    for index, value in enumerate(sit_in_ids):
+        if str(value).isdigit() and int(value) in checked_out:
+            results.append({'index': index, 'status': 'ok', 'sit_in_id': int(value)})
+            checked_out.discard(int(value))
+        else:
+            results.append({'index': index, 'status': 'error', 'sit_in_id': value,
+                            'error': 'Sit-in not found or not active'})
+    
+    return jsonify({'checked_out': sum(1 for result in results if result['status'] == 'ok'), 'results': results})
 
-@app.route('/view-sit-in')
+# Counters of the auto-checkout sweeper, shared by all workers
+@bp.route('/api/auto-checkout/metrics')
+@admin_required
+def auto_checkout_metrics():
+    conn = get_db_connection()
+    return jsonify(sweeper_metrics(conn))
+
+# The same counters for /metrics; they live in the database, so every worker
+# reports the server-wide totals
+@metrics.collector
+def auto_checkout_metric_lines():
+    values = sweeper_metrics(get_db_connection())
+    if not values:
+        return []
+    return [
+        '# HELP sitin_auto_checkout_runs_total Sweeps of the auto-checkout task',
+        '# TYPE sitin_auto_checkout_runs_total counter',
+        'sitin_auto_checkout_runs_total %d' % values['runs'],
+        '# HELP sitin_auto_checkout_sessions_closed_total Sit-ins ended by the auto-checkout task',
+        '# TYPE sitin_auto_checkout_sessions_closed_total counter',
+        'sitin_auto_checkout_sessions_closed_total %d' % values['sessions_closed_total'],
+    ]
+
+# Statement shapes from the slow-query log, scans of sit_ins first
+@bp.route('/admin/slow-queries')
+@admin_required
+def slow_queries():
+    since = request.args.get('since', '')
+    try:
+        datetime.datetime.strptime(since, '%Y-%m-%d')
+    except ValueError:
+        since = ''
+    
+    conn = get_db_connection()
+    summary = slow_query_summary(conn, since or None, limit=100)
+    
+    return render_template('slow_queries.html', summary=summary, since=since,
+                           threshold=current_app.config['SLOW_QUERY_MS'])
+
+@bp.route('/view-sit-in')
 @login_required
+@conditional('sit_ins', 'students', 'laboratories')
 def view_sit_in():
     conn = get_db_connection()
     current_sit_ins = conn.execute('''
@@ -473,14 +849,35 @@ def view_sit_in():
         JOIN students st ON s.student_id = st.id
         JOIN laboratories l ON s.lab_id = l.id
         WHERE s.status = "active"
-        ORDER BY s.login_time DESC
+        ORDER BY s.login_time DESC, s.id DESC
     ''').fetchall()
-    conn.close()
     
-    return render_template('sit_in.html', current_sit_ins=current_sit_ins)
+    last_event_id = latest_event_id(conn)
+    
+    return render_template('sit_in.html', current_sit_ins=current_sit_ins, last_event_id=last_event_id)
 
-@app.route('/sit-in-records')
+# Server-Sent Events stream of check-ins, checkouts and per-lab occupancy for
+# the live sit-in board. The browser resumes from Last-Event-ID on reconnect.
+# A server without threads (gunicorn's sync worker) would be blocked by an open
+# stream, so there the response ends at once and the browser polls every
+# SSE_POLL_SECONDS; gunicorn.conf.py runs threaded workers instead.
+@bp.route('/sit-in/events')
 @login_required
+def sit_in_events():
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(since) if since and since.isdigit() else None
+    
+    if request.environ.get('wsgi.multithread'):
+        stream = change_feed.stream(current_app.config['DATABASE'], since,
+                                    current_app.config['SSE_MAX_STREAM_SECONDS'])
+    else:
+        stream = change_feed.poll(current_app.config['DATABASE'], since, current_app.config['SSE_POLL_SECONDS'])
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/sit-in-records')
+@login_required
+@conditional('sit_ins', 'students', 'laboratories')
 def sit_in_records():
     # Get filter parameters
     date_filter = request.args.get('date', datetime.date.today().strftime('%Y-%m-%d'))
@@ -496,9 +893,10 @@ def sit_in_records():
         FROM sit_ins s
         JOIN students st ON s.student_id = st.id
         JOIN laboratories l ON s.lab_id = l.id
-        WHERE DATE(s.login_time) = ?
+        WHERE s.login_time >= ? AND s.login_time < ?
     '''
-    params = [date_filter]
+    params = list(epoch_bounds(date_filter))
+    day_start = day_bounds(date_filter)[0]
     
     if lab_filter != 'all':
         query += ' AND s.lab_id = ?'
@@ -508,30 +906,30 @@ def sit_in_records():
         query += ' AND s.purpose LIKE ?'
         params.append(f'%{purpose_filter}%')
     
-    query += ' ORDER BY s.login_time DESC'
+    query += ' ORDER BY s.login_time DESC, s.id DESC'
     
     records = conn.execute(query, params).fetchall()
     
     # Get programming language statistics
     programming_stats = conn.execute('''
-        SELECT purpose, COUNT(*) as count 
-        FROM sit_ins 
-        WHERE DATE(login_time) = ?
+        SELECT purpose, SUM(sit_in_count) as count 
+        FROM usage_rollups 
+        WHERE day = ?
         GROUP BY purpose
-    ''', (date_filter,)).fetchall()
+        ORDER BY purpose
+    ''', (day_start,)).fetchall()
     
     # Get laboratory usage statistics
     lab_stats = conn.execute('''
-        SELECT l.id, l.name, COUNT(*) as count 
-        FROM sit_ins s
-        JOIN laboratories l ON s.lab_id = l.id
-        WHERE DATE(s.login_time) = ?
-        GROUP BY s.lab_id
-    ''', (date_filter,)).fetchall()
+        SELECT l.id, l.name, SUM(r.sit_in_count) as count 
+        FROM usage_rollups r
+        JOIN laboratories l ON r.lab_id = l.id
+        WHERE r.day = ?
+        GROUP BY l.id, l.name
+        ORDER BY l.id
+    ''', (day_start,)).fetchall()
     
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
-    
-    conn.close()
+    laboratories = get_laboratories(conn)
     
     # Prepare programming stats for chart
     prog_labels = [row['purpose'] for row in programming_stats]
@@ -552,8 +950,9 @@ def sit_in_records():
                           lab_labels=json.dumps(lab_labels),
                           lab_counts=json.dumps(lab_counts))
 
-@app.route('/sit-in-reports')
+@bp.route('/sit-in-reports')
 @login_required
+@conditional('sit_ins', 'students', 'laboratories')
 def sit_in_reports():
     # Get filter parameters
     date_from = request.args.get('date_from', (datetime.date.today() - datetime.timedelta(days=30)).strftime('%Y-%m-%d'))
@@ -563,17 +962,24 @@ def sit_in_reports():
     purpose_filter = request.args.get('purpose', 'all')
     
     conn = get_db_connection()
+    params = list(epoch_bounds(date_from, date_to))
+    
+    # Ranges reaching into archived semesters read their files as well
+    try:
+        source = sit_ins_source(conn, *params)
+    except ArchiveError as e:
+        flash('%s. Showing sit-ins that are not archived.' % e, 'error')
+        source = 'sit_ins'
     
     # Build query based on filters
     query = '''
         SELECT s.id, s.student_id, st.name, s.purpose, s.lab_id, l.name as lab_name, 
                s.login_time, s.logout_time, s.status
-        FROM sit_ins s
+        FROM ''' + source + ''' s
         JOIN students st ON s.student_id = st.id
         JOIN laboratories l ON s.lab_id = l.id
-        WHERE DATE(s.login_time) BETWEEN ? AND ?
+        WHERE s.login_time >= ? AND s.login_time < ?
     '''
-    params = [date_from, date_to]
     
     if lab_filter != 'all':
         query += ' AND s.lab_id = ?'
@@ -584,18 +990,34 @@ def sit_in_reports():
         params.append(f'%{purpose_filter}%')
     
     if student_filter:
-        query += ' AND (st.id LIKE ? OR st.name LIKE ?)'
+        query += ' AND (CAST(st.id AS TEXT) LIKE ? OR st.name LIKE ?)'
         params.extend([f'%{student_filter}%', f'%{student_filter}%'])
     
-    query += ' ORDER BY s.login_time DESC'
-    
-    reports = conn.execute(query, params).fetchall()
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
+    # Count matches from the daily rollups unless the student filter needs the
+    # joined rows
+    if student_filter:
+        total = conn.execute('SELECT COUNT(*) FROM (' + query + ') AS matches', params).fetchone()[0]
+    else:
+        count_query = 'SELECT COALESCE(SUM(sit_in_count), 0) FROM usage_rollups WHERE day >= ? AND day < ?'
+        count_params = list(day_bounds(date_from, date_to))
+        
+        if lab_filter != 'all':
+            count_query += ' AND lab_id = ?'
+            count_params.append(lab_filter)
+        
+        if purpose_filter != 'all':
+            count_query += ' AND purpose LIKE ?'
+            count_params.append(f'%{purpose_filter}%')
+        
+        total = conn.execute(count_query, count_params).fetchone()[0]
     
-    conn.close()
+    page = paginate(conn, query, params, [('s.login_time', 'login_time'), ('s.id', 'id')],
+                    descending=True, total=total)
+    laboratories = get_laboratories(conn)
     
     return render_template('sit_in_reports.html', 
-                          reports=reports,
+                          reports=page.rows,
+                          page=page,
                           laboratories=laboratories,
                           date_from=date_from,
                           date_to=date_to,
@@ -603,124 +1025,290 @@ def sit_in_reports():
                           student_filter=student_filter,
                           purpose_filter=purpose_filter)
 
-@app.route('/export-report')
-@login_required
-def export_report():
-    format_type = request.args.get('format', 'csv')
-    
-    # Get filter parameters
-    date_from = request.args.get('date_from', (datetime.date.today() - datetime.timedelta(days=30)).strftime('%Y-%m-%d'))
-    date_to = request.args.get('date_to', datetime.date.today().strftime('%Y-%m-%d'))
-    lab_filter = request.args.get('lab', 'all')
-    student_filter = request.args.get('student', '')
-    purpose_filter = request.args.get('purpose', 'all')
-    
-    conn = get_db_connection()
-    
-    # Build query based on filters
+# Columns of the exported sit-in report
+EXPORT_COLUMNS = ['ID Number', 'Name', 'Purpose', 'Laboratory', 'Login', 'Logout', 'Duration (min)']
+
+# Rows fetched and written per chunk of a streamed CSV export
+EXPORT_CHUNK_ROWS = 500
+
+def export_row(row):
+    return [row['student_id'], row['name'], row['purpose'], row['lab_name'],
+            format_epoch(row['login_time']), format_epoch(row['logout_time']),
+            row['duration_minutes']]
+
+# Report filters from the query string, shared by exports and export jobs
+def report_filters(args):
+    return {
+        'date_from': args.get('date_from', (datetime.date.today() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')),
+        'date_to': args.get('date_to', datetime.date.today().strftime('%Y-%m-%d')),
+        'lab': args.get('lab', 'all'),
+        'student': args.get('student', ''),
+        'purpose': args.get('purpose', 'all'),
+    }
+
+# Build the export query based on filters, attaching the archived semesters
+# the date range reaches into (raises ArchiveError if one is unreadable)
+def build_report_query(conn, filters):
+    params = list(epoch_bounds(filters['date_from'], filters['date_to']))
     query = '''
         SELECT s.id, s.student_id, st.name, s.purpose, l.name as lab_name, 
                s.login_time, s.logout_time, 
-               CASE 
-                   WHEN s.logout_time IS NOT NULL THEN 
-                       (strftime('%s', s.logout_time) - strftime('%s', s.login_time)) / 60 
-                   ELSE 0 
-               END as duration_minutes
-        FROM sit_ins s
+               COALESCE(s.duration_seconds / 60, 0) as duration_minutes
+        FROM ''' + sit_ins_source(conn, *params) + ''' s
         JOIN students st ON s.student_id = st.id
         JOIN laboratories l ON s.lab_id = l.id
-        WHERE DATE(s.login_time) BETWEEN ? AND ?
+        WHERE s.login_time >= ? AND s.login_time < ?
     '''
-    params = [date_from, date_to]
     
-    if lab_filter != 'all':
+    if filters['lab'] != 'all':
         query += ' AND s.lab_id = ?'
-        params.append(lab_filter)
+        params.append(filters['lab'])
     
-    if purpose_filter != 'all':
+    if filters['purpose'] != 'all':
         query += ' AND s.purpose LIKE ?'
-        params.append(f'%{purpose_filter}%')
+        params.append(f"%{filters['purpose']}%")
     
-    if student_filter:
-        query += ' AND (st.id LIKE ? OR st.name LIKE ?)'
-        params.extend([f'%{student_filter}%', f'%{student_filter}%'])
+    if filters['student']:
+        query += ' AND (CAST(st.id AS TEXT) LIKE ? OR st.name LIKE ?)'
+        params.extend([f"%{filters['student']}%", f"%{filters['student']}%"])
     
-    query += ' ORDER BY s.login_time DESC'
+    query += ' ORDER BY s.login_time DESC, s.id DESC'
     
-    reports = conn.execute(query, params).fetchall()
-    conn.close()
+    return query, params
+
+# Label and grouping of each report chart; s is sit_ins or usage_rollups
+CHART_GROUPS = {'purpose': ('s.purpose', 's.purpose'), 'lab': ('l.name', 'l.id, l.name')}
+
+# (label, count) rows of a report chart: sit-ins per purpose or laboratory
+# under the report filters, from the daily rollups unless the student filter
+# needs the joined rows (which may raise ArchiveError)
+def report_chart_rows(conn, kind, filters):
+    label, group = CHART_GROUPS[kind]
+    
+    if filters['student']:
+        params = list(epoch_bounds(filters['date_from'], filters['date_to']))
+        query = '''
+            SELECT %s AS label, COUNT(*) AS count
+            FROM ''' % label + sit_ins_source(conn, *params) + ''' s
+            JOIN students st ON s.student_id = st.id
+            JOIN laboratories l ON s.lab_id = l.id
+            WHERE s.login_time >= ? AND s.login_time < ?
+              AND (CAST(st.id AS TEXT) LIKE ? OR st.name LIKE ?)
+        '''
+        params.extend([f"%{filters['student']}%", f"%{filters['student']}%"])
+    else:
+        params = list(day_bounds(filters['date_from'], filters['date_to']))
+        query = '''
+            SELECT %s AS label, SUM(s.sit_in_count) AS count
+            FROM usage_rollups s
+            JOIN laboratories l ON s.lab_id = l.id
+            WHERE s.day >= ? AND s.day < ?
+        ''' % label
+    
+    if filters['lab'] != 'all':
+        query += ' AND s.lab_id = ?'
+        params.append(filters['lab'])
     
-    # Convert to pandas DataFrame
-    data = []
-    for row in reports:
-        login_time = datetime.datetime.strptime(row['login_time'], '%Y-%m-%d %H:%M:%S.%f')
-        logout_time = None if row['logout_time'] is None else datetime.datetime.strptime(row['logout_time'], '%Y-%m-%d %H:%M:%S.%f')
-        
-        data.append({
-            'ID Number': row['student_id'],
-            'Name': row['name'],
-            'Purpose': row['purpose'],
-            'Laboratory': row['lab_name'],
-            'Login': login_time.strftime('%Y-%m-%d %H:%M:%S'),
-            'Logout': '' if logout_time is None else logout_time.strftime('%Y-%m-%d %H:%M:%S'),
-            'Duration (min)': row['duration_minutes']
-        })
+    if filters['purpose'] != 'all':
+        query += ' AND s.purpose LIKE ?'
+        params.append(f"%{filters['purpose']}%")
     
-    df = pd.DataFrame(data)
+    query += ' GROUP BY %s ORDER BY %s' % (group, group)
     
-    # Export based on format
-    if format_type == 'csv':
-        output = io.StringIO()
-        df.to_csv(output, index=False)
-        response = make_response(output.getvalue())
-        response.headers["Content-Disposition"] = "attachment; filename=sit_in_report.csv"
-        response.headers["Content-type"] = "text/csv"
-        return response
+    return [(row['label'], row['count']) for row in conn.execute(query, params)]
+
+# Rendered report chart, cached under the filters and the version stamps of
+# the tables behind it
+def report_chart_image(conn, kind, fmt, filters):
+    tables = ['laboratories', 'sit_ins'] + (['students'] if filters['student'] else [])
+    versions, updated_at = data_stamps(conn, tables)
+    key = chart_key(kind, fmt, filters, versions)
+    return chart_cache.get(key, lambda: render_chart(kind, report_chart_rows(conn, kind, filters), fmt))
+
+# Purpose or laboratory usage chart for the report filters, as PNG or SVG
+@bp.route('/charts/<kind>.<fmt>')
+@login_required
+@conditional('sit_ins', 'students', 'laboratories', renders_flashes=False)
+def report_chart(kind, fmt):
+    if kind not in CHARTS or fmt not in CHART_FORMATS:
+        return jsonify({'error': 'Unknown chart'}), 404
+    
+    conn = get_db_connection()
+    try:
+        image = report_chart_image(conn, kind, fmt, report_filters(request.args))
+    except ArchiveError as e:
+        return jsonify({'error': str(e)}), 404
     
-    elif format_type == 'excel':
+    return Response(image, mimetype=CHART_FORMATS[fmt])
+
+# Render an Excel or HTML ("pdf") report from a DataFrame of export rows
+def render_report(df, format_type, filters):
+    if format_type == 'excel':
         output = io.BytesIO()
         df.to_excel(output, index=False)
-        response = make_response(output.getvalue())
-        response.headers["Content-Disposition"] = "attachment; filename=sit_in_report.xlsx"
-        response.headers["Content-type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        return response
+        return output.getvalue()
     
-    elif format_type == 'pdf':
-        # Simple PDF export using HTML rendering
-        html = df.to_html(classes='table table-striped', index=False)
-        
-        # Add CSS styling
-        styled_html = f'''
-        <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; }}
-                    .table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
-                    .table th {{ background-color: #004080; color: white; text-align: left; padding: 8px; }}
-                    .table td {{ border: 1px solid #ddd; padding: 8px; }}
-                    .table-striped tr:nth-child(even) {{ background-color: #f2f2f2; }}
-                    h1 {{ color: #004080; }}
-                </style>
-            </head>
-            <body>
-                <h1>Sit-In Report</h1>
-                <p>From: {date_from} To: {date_to}</p>
-                {html}
-            </body>
-        </html>
-        '''
+    # Simple PDF export using HTML rendering
+    html = df.to_html(classes='table table-striped', index=False)
+    
+    # Usage charts embedded as SVG, so the file stands alone and prints sharp
+    conn = get_db_connection()
+    charts = ''.join(
+        '<img class="chart" alt="%s" src="data:image/svg+xml;base64,%s">'
+        % (CHARTS[kind][0], base64.b64encode(report_chart_image(conn, kind, 'svg', filters)).decode('ascii'))
+        for kind in CHARTS)
+    
+    # Add CSS styling
+    styled_html = f'''
+    <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; }}
+                .table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
+                .table th {{ background-color: #004080; color: white; text-align: left; padding: 8px; }}
+                .table td {{ border: 1px solid #ddd; padding: 8px; }}
+                .table-striped tr:nth-child(even) {{ background-color: #f2f2f2; }}
+                h1 {{ color: #004080; }}
+                .chart {{ width: 48%; }}
+            </style>
+        </head>
+        <body>
+            <h1>Sit-In Report</h1>
+            <p>From: {filters['date_from']} To: {filters['date_to']}</p>
+            <div>{charts}</div>
+            {html}
+        </body>
+    </html>
+    '''
+    return styled_html.encode('utf-8')
+
+# Runs inside the export job pool, within its own app context: fetch in
+# chunks, reporting progress, then write the rendered report to path
+def run_export_job(format_type, filters, path, progress):
+    import pandas as pd
+    
+    conn = get_db_connection()
+    query, params = build_report_query(conn, filters)
+    total = conn.execute('SELECT COUNT(*) FROM (' + query + ') AS matches', params).fetchone()[0]
+    
+    cursor = conn.execute(query, params)
+    rows = []
+    while True:
+        chunk = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+        if not chunk:
+            break
+        rows.extend(export_row(row) for row in chunk)
+        progress(len(rows), total)
+    
+    df = pd.DataFrame(rows, columns=EXPORT_COLUMNS)
+    with open(path, 'wb') as f:
+        f.write(render_report(df, format_type, filters))
+
+@bp.route('/export-report')
+@login_required
+def export_report():
+    format_type = request.args.get('format', 'csv')
+    
+    # Get filter parameters
+    filters = report_filters(request.args)
+    
+    conn = get_db_connection()
+    try:
+        query, params = build_report_query(conn, filters)
+    except ArchiveError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.sit_in_reports', **request.args))
+    cursor = conn.execute(query, params)
+    
+    # CSV is streamed straight off the cursor, so memory stays flat however
+    # large the date range is
+    if format_type == 'csv':
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(EXPORT_COLUMNS)
+            
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                writer.writerows(export_row(row) for row in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            
+            # Header only when nothing matched
+            if buffer.tell():
+                yield buffer.getvalue()
         
-        # Return HTML content with PDF headers
-        response = make_response(styled_html)
-        response.headers["Content-Disposition"] = "attachment; filename=sit_in_report.html"
-        response.headers["Content-type"] = "text/html"
+        response = Response(stream_with_context(generate()), mimetype='text/csv')
+        response.headers["Content-Disposition"] = "attachment; filename=sit_in_report.csv"
         return response
     
-    else:
+    if format_type not in JOB_FORMATS:
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    # Convert to pandas DataFrame
+    import pandas as pd
+    df = pd.DataFrame([export_row(row) for row in cursor], columns=EXPORT_COLUMNS)
+    
+    extension, mimetype = JOB_FORMATS[format_type]
+    response = make_response(render_report(df, format_type, filters))
+    response.headers["Content-Disposition"] = f"attachment; filename=sit_in_report.{extension}"
+    response.headers["Content-type"] = mimetype
+    return response
+
+def export_job_json(job):
+    return {
+        'id': job['id'],
+        'format': job['format'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'status_url': url_for('main.export_job_status', job_id=job['id']),
+        'download_url': url_for('main.export_job_download', job_id=job['id']) if job['status'] == 'done' else None
+    }
+
+# Queue an Excel/HTML export in the background; identical filters share a job
+@bp.route('/export-jobs', methods=['POST'])
+@login_required
+def submit_export_job():
+    format_type = request.values.get('format', 'excel')
+    
+    if format_type not in JOB_FORMATS:
         return jsonify({'error': 'Unsupported format'}), 400
+    
+    # The version stamps of the exported tables keep a finished job from being
+    # handed out after the data changed
+    versions, updated_at = data_stamps(get_db_connection(), ['laboratories', 'sit_ins', 'students'])
+    job = export_jobs.submit(format_type, report_filters(request.values), versions)
+    return jsonify(export_job_json(job)), 202
+
+@bp.route('/export-jobs/<job_id>')
+@login_required
+def export_job_status(job_id):
+    job = export_jobs.status(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    
+    return jsonify(export_job_json(job))
+
+@bp.route('/export-jobs/<job_id>/download')
+@login_required
+def export_job_download(job_id):
+    job = export_jobs.status(job_id)
+    
+    if not job or job['status'] != 'done':
+        return jsonify({'error': 'Export is not ready'}), 404
+    
+    extension, mimetype = JOB_FORMATS[job['format']]
+    return send_file(export_jobs.artifact_path(job), mimetype=mimetype,
+                     as_attachment=True, download_name=f'sit_in_report.{extension}')
 
-@app.route('/feedback-reports')
+@bp.route('/feedback-reports')
 @login_required
+@conditional('feedback', 'students', 'laboratories')
 def feedback_reports():
     # Get filter parameters
     lab_filter = request.args.get('lab', 'all')
@@ -744,23 +1332,22 @@ def feedback_reports():
         params.append(lab_filter)
     
     if date_filter != 'all':
-        query += ' AND DATE(f.date_submitted) = ?'
-        params.append(date_filter)
+        query += ' AND f.date_submitted >= ? AND f.date_submitted < ?'
+        params.extend(day_bounds(date_filter))
     
-    query += ' ORDER BY f.date_submitted DESC'
-    
-    feedbacks = conn.execute(query, params).fetchall()
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
-    
-    conn.close()
+    total = conn.execute('SELECT COUNT(*) FROM (' + query + ') AS matches', params).fetchone()[0]
+    page = paginate(conn, query, params, [('f.date_submitted', 'date_submitted'), ('f.id', 'id')],
+                    descending=True, total=total)
+    laboratories = get_laboratories(conn)
     
     return render_template('feedback_reports.html', 
-                          feedbacks=feedbacks,
+                          feedbacks=page.rows,
+                          page=page,
                           laboratories=laboratories,
                           lab_filter=lab_filter,
                           date_filter=date_filter)
 
-@app.route('/add-feedback', methods=['POST'])
+@bp.route('/add-feedback', methods=['POST'])
 @login_required
 def add_feedback():
     student_id = request.form.get('student_id')
@@ -773,9 +1360,8 @@ def add_feedback():
     student = conn.execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
     
     if not student:
-        conn.close()
         flash('Student not found', 'error')
-        return redirect(url_for('feedback_reports'))
+        return redirect(url_for('main.feedback_reports'))
     
     # Add feedback
     conn.execute('''
@@ -784,13 +1370,27 @@ def add_feedback():
     ''', (student_id, lab_id, message))
     
     conn.commit()
-    conn.close()
     
     flash('Feedback successfully added', 'success')
-    return redirect(url_for('feedback_reports'))
+    return redirect(url_for('main.feedback_reports'))
+
+# One page of reservations in (date, start_time, id) order
+def reservations_page(conn):
+    query = '''
+        SELECT r.id, r.student_id, st.name, r.lab_id, l.name as lab_name, 
+               r.purpose, r.date, r.start_time, r.end_time, r.status, r.date_created
+        FROM reservations r
+        JOIN students st ON r.student_id = st.id
+        JOIN laboratories l ON r.lab_id = l.id
+        WHERE 1=1
+    '''
+    total = conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0]
+    return paginate(conn, query, [], [('r.date', 'date'), ('r.start_time', 'start_time'), ('r.id', 'id')],
+                    total=total)
 
-@app.route('/reservation', methods=['GET', 'POST'])
+@bp.route('/reservation', methods=['GET', 'POST'])
 @login_required
+@conditional('reservations', 'students', 'laboratories')
 def reservation():
     if request.method == 'POST':
         student_id = request.form.get('student_id')
@@ -803,10 +1403,31 @@ def reservation():
         # Validate the data
         if not all([student_id, lab_id, purpose, date, start_time, end_time]):
             flash('All fields are required', 'error')
-            return redirect(url_for('reservation'))
+            return redirect(url_for('main.reservation'))
+        
+        if not re.match(r'^\d{4}-\d{2}-\d{2}$', date) or not re.match(r'^\d{2}:\d{2}', start_time) \
+                or not re.match(r'^\d{2}:\d{2}', end_time):
+            flash('Invalid date or time', 'error')
+            return redirect(url_for('main.reservation'))
+        start_time, end_time = start_time[:5], end_time[:5]
         
-        # Check if the laboratory is available at the requested time
         conn = get_db_connection()
+        lab = next((lab for lab in get_laboratories(conn) if str(lab['id']) == lab_id), None)
+        
+        if not lab:
+            flash('Unknown laboratory', 'error')
+            return redirect(url_for('main.reservation'))
+        
+        # Check if the laboratory is available at the requested time; the write
+        # lock keeps a concurrent booking from taking the last seat in between
+        begin_write(conn, ['lab:%s:%s' % (lab_id, date), 'student:%s:%s' % (student_id, date)])
+        conflicts = reservation_conflicts(conn, lab, student_id, date, start_time, end_time)
+        
+        if conflicts:
+            conn.rollback()
+            for conflict in conflicts:
+                flash(conflict, 'error')
+            return redirect(url_for('main.reservation'))
         
         # Check if student exists
         student = conn.execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
@@ -826,58 +1447,37 @@ def reservation():
         
         conn.commit()
         
-        # Get all reservations
-        reservations = conn.execute('''
-            SELECT r.id, r.student_id, st.name, r.lab_id, l.name as lab_name, 
-                   r.purpose, r.date, r.start_time, r.end_time, r.status, r.date_created
-            FROM reservations r
-            JOIN students st ON r.student_id = st.id
-            JOIN laboratories l ON r.lab_id = l.id
-            ORDER BY r.date, r.start_time
-        ''').fetchall()
-        
-        laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
-        
-        conn.close()
+        # Get the first page of reservations
+        page = reservations_page(conn)
+        laboratories = get_laboratories(conn)
         
         flash('Reservation successfully added', 'success')
-        return render_template('reservation.html', reservations=reservations, laboratories=laboratories)
+        return render_template('reservation.html', reservations=page.rows, page=page, laboratories=laboratories)
     
     # GET method - display form
     conn = get_db_connection()
     
-    reservations = conn.execute('''
-        SELECT r.id, r.student_id, st.name, r.lab_id, l.name as lab_name, 
-               r.purpose, r.date, r.start_time, r.end_time, r.status, r.date_created
-        FROM reservations r
-        JOIN students st ON r.student_id = st.id
-        JOIN laboratories l ON r.lab_id = l.id
-        ORDER BY r.date, r.start_time
-    ''').fetchall()
-    
-    laboratories = conn.execute('SELECT * FROM laboratories').fetchall()
+    page = reservations_page(conn)
+    laboratories = get_laboratories(conn)
     
-    conn.close()
-    
-    return render_template('reservation.html', reservations=reservations, laboratories=laboratories)
+    return render_template('reservation.html', reservations=page.rows, page=page, laboratories=laboratories)
 
-@app.route('/update-reservation-status/<int:reservation_id>/<status>')
+@bp.route('/update-reservation-status/<int:reservation_id>/<status>')
 @login_required
 @admin_required
 def update_reservation_status(reservation_id, status):
     if status not in ['approved', 'rejected', 'completed']:
         flash('Invalid status', 'error')
-        return redirect(url_for('reservation'))
+        return redirect(url_for('main.reservation'))
     
     conn = get_db_connection()
     conn.execute('UPDATE reservations SET status = ? WHERE id = ?', (status, reservation_id))
     conn.commit()
-    conn.close()
     
     flash(f'Reservation {status}', 'success')
-    return redirect(url_for('reservation'))
+    return redirect(url_for('main.reservation'))
 
-@app.route('/add-announcement', methods=['POST'])
+@bp.route('/add-announcement', methods=['POST'])
 @login_required
 @admin_required
 def add_announcement():
@@ -885,7 +1485,7 @@ def add_announcement():
     
     if not content:
         flash('Announcement content cannot be empty', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     
     conn = get_db_connection()
     
@@ -897,19 +1497,19 @@ def add_announcement():
     ''', (content, 'CCS Admin', current_date))
     
     conn.commit()
-    conn.close()
+    app_cache.invalidate('announcements')
     
     flash('Announcement successfully added', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
-@app.route('/edit-announcement/<int:announcement_id>', methods=['POST'])
+@bp.route('/edit-announcement/<int:announcement_id>', methods=['POST'])
 @admin_required
 def edit_announcement(announcement_id):
     content = request.form.get('content')
     
     if not content:
         flash('Announcement content cannot be empty', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     
     conn = get_db_connection()
     
@@ -921,12 +1521,12 @@ def edit_announcement(announcement_id):
     ''', (content, announcement_id))
     
     conn.commit()
-    conn.close()
+    app_cache.invalidate('announcements')
     
     flash('Announcement successfully updated', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
-@app.route('/delete-announcement/<int:announcement_id>')
+@bp.route('/delete-announcement/<int:announcement_id>')
 @admin_required
 def delete_announcement(announcement_id):
     conn = get_db_connection()
@@ -935,15 +1535,17 @@ def delete_announcement(announcement_id):
     conn.execute('DELETE FROM announcements WHERE id = ?', (announcement_id,))
     
     conn.commit()
-    conn.close()
+    app_cache.invalidate('announcements')
     
     flash('Announcement successfully deleted', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 # Main entry point
 if __name__ == '__main__':
+    app = create_app()
+    
     # Initialize database
-    init_db()
+    init_db(app)
     
     # Run the app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,470 @@
+import datetime
+import hashlib
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from database import backend, get_db_connection
+from timestamps import EPOCH_CONVERSION, format_epoch, from_epoch, to_epoch
+
+# Semester archival. Completed sit-ins of semesters that ended before the
+# cutoff (the start of the semester ARCHIVE_AFTER_DAYS ago) move out of
+# sit_ins into one SQLite file per semester in ARCHIVE_DIR, so the hot table
+# and its indexes only cover recent history. The archived_semesters manifest
+# records each file with its totals and a checksum, and archived_rollups keeps
+# the semester's daily rollups so rebuild-rollups still counts it. Reports and
+# exports whose date range reaches into an archived semester ATTACH its file
+# and read sit_ins through a UNION ALL. Times are epoch seconds, as in sit_ins
+# (see timestamps.py).
+
+ARCHIVED_SEMESTERS_DDL = '''
+CREATE TABLE IF NOT EXISTS archived_semesters (
+    semester TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    first_login TIMESTAMP NOT NULL,
+    last_login TIMESTAMP NOT NULL,
+    sit_in_count INTEGER NOT NULL,
+    total_minutes INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    verified_at TIMESTAMP
+)
+'''
+
+ARCHIVED_ROLLUPS_DDL = '''
+CREATE TABLE IF NOT EXISTS archived_rollups (
+    semester TEXT NOT NULL,
+    day DATE NOT NULL,
+    lab_id INTEGER NOT NULL,
+    purpose TEXT NOT NULL,
+    sit_in_count INTEGER NOT NULL,
+    completed_count INTEGER NOT NULL,
+    total_minutes INTEGER NOT NULL,
+    PRIMARY KEY (semester, day, lab_id, purpose)
+)
+'''
+
+# Tables of an archive file, created through the schema it is attached as.
+# daily_summaries has the shape of usage_rollups; student_summaries holds
+# each student's totals for the semester.
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS %(db)s.sit_ins (
+           id INTEGER PRIMARY KEY,
+           student_id INTEGER NOT NULL,
+           purpose TEXT NOT NULL,
+           lab_id INTEGER NOT NULL,
+           login_time TIMESTAMP NOT NULL,
+           logout_time TIMESTAMP,
+           status TEXT,
+           session_remaining INTEGER,
+           duration_seconds INTEGER
+       )''',
+    'CREATE INDEX IF NOT EXISTS %(db)s.idx_sit_ins_login ON sit_ins (login_time)',
+    'CREATE INDEX IF NOT EXISTS %(db)s.idx_sit_ins_student_login ON sit_ins (student_id, login_time)',
+    '''CREATE TABLE IF NOT EXISTS %(db)s.daily_summaries (
+           day DATE NOT NULL,
+           lab_id INTEGER NOT NULL,
+           purpose TEXT NOT NULL,
+           sit_in_count INTEGER NOT NULL,
+           completed_count INTEGER NOT NULL,
+           total_minutes INTEGER NOT NULL,
+           PRIMARY KEY (day, lab_id, purpose)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS %(db)s.student_summaries (
+           student_id INTEGER PRIMARY KEY,
+           sit_in_count INTEGER NOT NULL,
+           total_minutes INTEGER NOT NULL,
+           first_login TIMESTAMP NOT NULL,
+           last_login TIMESTAMP NOT NULL
+       )''',
+]
+
+SIT_IN_COLUMNS = ('id, student_id, purpose, lab_id, login_time, logout_time, status, session_remaining, '
+                  'duration_seconds')
+
+# PRAGMA user_version of archive files in the current format; files written
+# before sit-in times became epoch seconds are at 0 and upgraded on attach
+ARCHIVE_FORMAT = 1
+
+# Archived rows: completed sessions that started within [start, end)
+ARCHIVABLE = "status = 'completed' AND login_time >= ? AND login_time < ?"
+
+# Minutes of a session; substituted into the queries below as a value
+MINUTES = 'duration_seconds / 60'
+
+# Daily rollup rows of the sit_ins table of a schema, as rebuild_rollups()
+# computes them
+DAILY_SUMMARY_QUERY = '''
+    SELECT date(login_time, 'unixepoch') AS day, lab_id, purpose,
+           COUNT(*) AS sit_in_count,
+           SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) AS completed_count,
+           COALESCE(SUM(CASE WHEN status = 'completed' THEN %(minutes)s END), 0) AS total_minutes
+    FROM %(db)s.sit_ins
+    GROUP BY date(login_time, 'unixepoch'), lab_id, purpose
+'''
+
+# SQLite's default limit of attached databases per connection
+MAX_ATTACHED = 10
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# First semester runs from August to December, second from January to July
+# (summer classes included); two files a year keep a long report range within
+# the attach limit. Returns (name, first day, day after the last).
+def semester_of(day):
+    if day.month >= 8:
+        return '%d-%d-1' % (day.year, day.year + 1), datetime.date(day.year, 8, 1), datetime.date(day.year + 1, 1, 1)
+    return '%d-%d-2' % (day.year - 1, day.year), datetime.date(day.year, 1, 1), datetime.date(day.year, 8, 1)
+
+
+# Start of the semester holding the day after_days ago: that semester and all
+# later ones stay in sit_ins
+def archive_cutoff(today, after_days):
+    return semester_of(today - datetime.timedelta(days=after_days))[1]
+
+
+def schema_name(semester):
+    return 'archive_' + semester.replace('-', '_')
+
+
+def archive_filename(semester):
+    return 'sit_ins_%s.db' % semester
+
+
+def archive_path(semester):
+    return os.path.join(current_app.config['ARCHIVE_DIR'], archive_filename(semester))
+
+
+# Semesters before cutoff holding completed sit-ins, oldest first. Semesters
+# in between without any (a term the labs were closed) get no archive file,
+# as the manifest cannot describe an empty one.
+def semesters_to_archive(conn, cutoff):
+    first = conn.execute("SELECT MIN(login_time) FROM sit_ins WHERE status = 'completed' AND login_time < ?",
+                         (to_epoch(cutoff),)).fetchone()[0]
+    if first is None:
+        return []
+
+    semesters = []
+    semester = semester_of(from_epoch(first).date())
+    while semester[1] < cutoff:
+        if conn.execute('SELECT 1 FROM sit_ins WHERE %s LIMIT 1' % ARCHIVABLE,
+                        (to_epoch(semester[1]), to_epoch(semester[2]))).fetchone():
+            semesters.append(semester)
+        semester = semester_of(semester[2])
+    return semesters
+
+
+# Attach the files of the given semesters to conn, reusing those an earlier
+# request attached to this pooled connection and detaching the rest, since
+# only a few databases can be attached at once. Returns their schema names.
+# ATTACH and DETACH fail inside a transaction.
+def attach_archives(conn, semesters, create=False):
+    if len(semesters) > MAX_ATTACHED:
+        raise ArchiveError('The date range covers %d archived semesters; at most %d can be read at once'
+                           % (len(semesters), MAX_ATTACHED))
+
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    wanted = [schema_name(semester) for semester in semesters]
+    for schema in attached:
+        if schema.startswith('archive_') and schema not in wanted:
+            conn.execute('DETACH DATABASE %s' % schema)
+
+    for semester, schema in zip(semesters, wanted):
+        if schema in attached:
+            continue
+        path = archive_path(semester)
+        if not create and not os.path.exists(path):
+            raise ArchiveError('Archive file %s is missing; run flask verify-archives' % path)
+        conn.execute('ATTACH DATABASE ? AS %s' % schema, (path,))
+        if conn.execute('PRAGMA %s.user_version' % schema).fetchone()[0] < ARCHIVE_FORMAT:
+            upgrade_archive(conn, semester, schema)
+    return wanted
+
+
+# Create the tables of a new archive file, or convert one written before
+# schema version 13 (text times, no duration_seconds) in place; a converted
+# semester is recorded again, as its checksum covers the rows
+def upgrade_archive(conn, semester, schema):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        old = conn.execute("SELECT COUNT(*) FROM %s.sqlite_master WHERE name = 'sit_ins'" % schema).fetchone()[0]
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement % {'db': schema})
+        if old:
+            conn.execute('ALTER TABLE %s.sit_ins ADD COLUMN duration_seconds INTEGER' % schema)
+            conn.execute(EPOCH_CONVERSION % {'table': schema + '.sit_ins'})
+            write_summaries(conn, schema)
+            if conn.execute('SELECT 1 FROM archived_semesters WHERE semester = ?', (semester,)).fetchone():
+                record_archive(conn, semester, schema)
+        conn.execute('PRAGMA %s.user_version = %d' % (schema, ARCHIVE_FORMAT))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def detach_archives(conn):
+    for row in conn.execute('PRAGMA database_list').fetchall():
+        if row[1].startswith('archive_'):
+            conn.execute('DETACH DATABASE %s' % row[1])
+
+
+# The row source a sit-in query over [start, end) should read instead of
+# sit_ins: the hot table alone, or its UNION ALL with the archived semesters
+# the range reaches into
+def sit_ins_source(conn, start, end):
+    if backend(conn) != 'sqlite':
+        return 'sit_ins'
+
+    semesters = [row[0] for row in conn.execute('''
+        SELECT semester FROM archived_semesters
+        WHERE first_login < ? AND last_login >= ?
+        ORDER BY semester
+    ''', (end, start))]
+    if not semesters:
+        return 'sit_ins'
+
+    schemas = ['main'] + attach_archives(conn, semesters)
+    return '(%s)' % ' UNION ALL '.join('SELECT %s FROM %s.sit_ins' % (SIT_IN_COLUMNS, schema) for schema in schemas)
+
+
+def archive_checksum(conn, schema):
+    digest = hashlib.sha256()
+    for row in conn.execute('SELECT %s FROM %s.sit_ins ORDER BY id' % (SIT_IN_COLUMNS, schema)):
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_summaries(conn, schema):
+    conn.execute('DELETE FROM %s.daily_summaries' % schema)
+    conn.execute('INSERT INTO %s.daily_summaries (day, lab_id, purpose, sit_in_count, completed_count, total_minutes) '
+                 % schema + DAILY_SUMMARY_QUERY % {'db': schema, 'minutes': MINUTES})
+    conn.execute('DELETE FROM %s.student_summaries' % schema)
+    conn.execute(('''
+        INSERT INTO %(db)s.student_summaries (student_id, sit_in_count, total_minutes, first_login, last_login)
+        SELECT student_id, COUNT(*), COALESCE(SUM(%(minutes)s), 0), MIN(login_time), MAX(login_time)
+        FROM %(db)s.sit_ins
+        GROUP BY student_id
+    ''') % {'db': schema, 'minutes': MINUTES})
+
+
+# Move the completed sit-ins of one semester into its archive file and return
+# how many were moved. Rows are copied and committed first; the originals are
+# deleted in a second transaction, together with the manifest update, and only
+# those whose copy matches them column for column. A crash in between leaves
+# rows in both places with the manifest unchanged, so reports keep reading the
+# hot copies, and the next run finishes the move.
+def archive_semester(conn, semester, start, end):
+    bounds = (to_epoch(start), to_epoch(end))
+    schema = attach_archives(conn, [semester], create=True)[0]
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('INSERT OR REPLACE INTO %s.sit_ins (%s) SELECT %s FROM main.sit_ins WHERE %s'
+                     % (schema, SIT_IN_COLUMNS, SIT_IN_COLUMNS, ARCHIVABLE), bounds)
+        write_summaries(conn, schema)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Rows changed since they were copied keep their hot copy; rows added
+        # since are simply left for the next run
+        differing = conn.execute('''
+            SELECT COUNT(*) FROM main.sit_ins h
+            JOIN %s.sit_ins a ON a.id = h.id
+            WHERE h.status = 'completed' AND h.login_time >= ? AND h.login_time < ?
+              AND NOT (a.student_id IS h.student_id AND a.purpose IS h.purpose AND a.lab_id IS h.lab_id
+                       AND a.login_time IS h.login_time AND a.logout_time IS h.logout_time
+                       AND a.status IS h.status AND a.session_remaining IS h.session_remaining
+                       AND a.duration_seconds IS h.duration_seconds)
+        ''' % schema, bounds).fetchone()[0]
+        if differing:
+            raise ArchiveError('%d sit-ins of %s changed while being archived; nothing was deleted, run again'
+                               % (differing, semester))
+
+        moved = conn.execute('DELETE FROM main.sit_ins WHERE %s AND id IN (SELECT id FROM %s.sit_ins)'
+                             % (ARCHIVABLE, schema), bounds).rowcount
+        record_archive(conn, semester, schema)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    detach_archives(conn)
+    return moved
+
+
+# Point the manifest and archived_rollups at the current contents of an
+# attached archive
+def record_archive(conn, semester, schema):
+    count, first, last = conn.execute('SELECT COUNT(*), MIN(login_time), MAX(login_time) FROM %s.sit_ins'
+                                      % schema).fetchone()
+    minutes = conn.execute('SELECT COALESCE(SUM(total_minutes), 0) FROM %s.daily_summaries' % schema).fetchone()[0]
+    conn.execute('''
+        INSERT INTO archived_semesters (semester, filename, first_login, last_login, sit_in_count, total_minutes,
+                                        checksum, archived_at, verified_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, NULL)
+        ON CONFLICT (semester) DO UPDATE SET
+            filename = excluded.filename, first_login = excluded.first_login, last_login = excluded.last_login,
+            sit_in_count = excluded.sit_in_count, total_minutes = excluded.total_minutes,
+            checksum = excluded.checksum, archived_at = excluded.archived_at, verified_at = NULL
+    ''', (semester, archive_filename(semester), first, last, count, minutes, archive_checksum(conn, schema)))
+    conn.execute('DELETE FROM archived_rollups WHERE semester = ?', (semester,))
+    conn.execute('''
+        INSERT INTO archived_rollups (semester, day, lab_id, purpose, sit_in_count, completed_count, total_minutes)
+        SELECT ?, day, lab_id, purpose, sit_in_count, completed_count, total_minutes
+        FROM %s.daily_summaries
+    ''' % schema, (semester,))
+
+
+# Problems with one archived semester: a missing or damaged file, rows that
+# no longer match the manifest's totals and checksum, summaries that do not
+# match the rows, or archived rows still present in sit_ins
+def verify_archive(conn, entry):
+    semester = entry['semester']
+    path = archive_path(semester)
+    if not os.path.exists(path):
+        return ['file %s is missing' % path]
+
+    schema = attach_archives(conn, [semester])[0]
+    check = conn.execute('PRAGMA %s.quick_check' % schema).fetchone()[0]
+    if check != 'ok':
+        return ['quick_check: %s' % check]
+
+    problems = []
+    count, first, last = conn.execute('SELECT COUNT(*), MIN(login_time), MAX(login_time) FROM %s.sit_ins'
+                                      % schema).fetchone()
+    if (count, first, last) != (entry['sit_in_count'], entry['first_login'], entry['last_login']):
+        problems.append('%d sit-ins from %s to %s, the manifest says %d from %s to %s' % (
+            count, format_epoch(first), format_epoch(last), entry['sit_in_count'],
+            format_epoch(entry['first_login']), format_epoch(entry['last_login'])))
+    if archive_checksum(conn, schema) != entry['checksum']:
+        problems.append('rows do not match the checksum in the manifest')
+
+    daily = [tuple(row) for row in conn.execute(
+        (DAILY_SUMMARY_QUERY + ' ORDER BY 1, 2, 3') % {'db': schema, 'minutes': MINUTES})]
+    if daily != [tuple(row) for row in conn.execute(
+            'SELECT * FROM %s.daily_summaries ORDER BY day, lab_id, purpose' % schema)]:
+        problems.append('daily_summaries do not match the archived rows')
+    if daily != [tuple(row) for row in conn.execute('''
+            SELECT day, lab_id, purpose, sit_in_count, completed_count, total_minutes
+            FROM archived_rollups WHERE semester = ? ORDER BY day, lab_id, purpose''', (semester,))]:
+        problems.append('archived_rollups do not match the archived rows')
+    if sum(row[5] for row in daily) != entry['total_minutes']:
+        problems.append('total minutes do not match the manifest')
+
+    students = conn.execute('SELECT COUNT(*), COALESCE(SUM(sit_in_count), 0) FROM %s.student_summaries'
+                            % schema).fetchone()
+    distinct = conn.execute('SELECT COUNT(DISTINCT student_id) FROM %s.sit_ins' % schema).fetchone()[0]
+    if tuple(students) != (distinct, count):
+        problems.append('student_summaries do not match the archived rows')
+
+    overlap = conn.execute('SELECT COUNT(*) FROM main.sit_ins WHERE id IN (SELECT id FROM %s.sit_ins)'
+                           % schema).fetchone()[0]
+    if overlap:
+        problems.append('%d archived sit-ins are still in sit_ins' % overlap)
+    return problems
+
+
+# Verify every archive, stamping verified_at on those that pass; returns
+# {semester: problems}
+def verify_archives(conn):
+    results = {}
+    for entry in conn.execute('SELECT * FROM archived_semesters ORDER BY semester').fetchall():
+        results[entry['semester']] = problems = verify_archive(conn, entry)
+        if not problems:
+            conn.execute('UPDATE archived_semesters SET verified_at = CURRENT_TIMESTAMP WHERE semester = ?',
+                         (entry['semester'],))
+            conn.commit()
+    detach_archives(conn)
+    return results
+
+
+# ARCHIVE_DIR holds the semester files; sessions stay in sit_ins until their
+# whole semester is older than ARCHIVE_AFTER_DAYS
+def init_app(app):
+    app.config.setdefault('ARCHIVE_DIR', os.environ.get('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive')))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.environ.get('ARCHIVE_AFTER_DAYS', 365)))
+    app.cli.add_command(archive_sit_ins_command)
+    app.cli.add_command(verify_archives_command)
+
+
+def sqlite_connection():
+    conn = get_db_connection()
+    if backend(conn) != 'sqlite':
+        raise click.ClickException('Archive files are SQLite databases; archival needs the SQLite backend')
+    return conn
+
+
+@click.command('archive-sit-ins')
+@click.option('--after-days', type=int, help='archive semesters older than this (default ARCHIVE_AFTER_DAYS)')
+@click.option('--dry-run', is_flag=True, help='list the semesters that would be archived')
+@click.option('--vacuum', is_flag=True, help='compact the database file afterwards')
+@with_appcontext
+def archive_sit_ins_command(after_days, dry_run, vacuum):
+    """Move completed sit-ins of old semesters into per-semester archive files."""
+    conn = sqlite_connection()
+    after_days = after_days if after_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = archive_cutoff(datetime.date.today(), after_days)
+    semesters = semesters_to_archive(conn, cutoff)
+    if not semesters:
+        click.echo('Nothing to archive before %s' % cutoff)
+        return
+
+    os.makedirs(current_app.config['ARCHIVE_DIR'], exist_ok=True)
+    for semester, start, end in semesters:
+        if dry_run:
+            count = conn.execute('SELECT COUNT(*) FROM sit_ins WHERE ' + ARCHIVABLE,
+                                 (to_epoch(start), to_epoch(end))).fetchone()[0]
+            click.echo('%s: %d sit-ins from %s to %s' % (semester, count, start, end))
+            continue
+        try:
+            moved = archive_semester(conn, semester, start, end)
+        except ArchiveError as e:
+            raise click.ClickException(str(e))
+        click.echo('%s: moved %d sit-ins to %s' % (semester, moved, archive_path(semester)))
+
+    if dry_run:
+        return
+
+    failed = {semester: problems for semester, problems in verify_archives(conn).items() if problems}
+    for semester, problems in failed.items():
+        click.echo('%s: %s' % (semester, '; '.join(problems)), err=True)
+    if failed:
+        raise click.ClickException('%d archives failed verification' % len(failed))
+
+    if vacuum:
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    click.echo('Archived and verified; sit_ins now holds %d rows'
+               % conn.execute('SELECT COUNT(*) FROM sit_ins').fetchone()[0])
+
+
+@click.command('verify-archives')
+@with_appcontext
+def verify_archives_command():
+    """Check every archive file against the manifest and the live sit_ins table."""
+    conn = sqlite_connection()
+    entries = {row['semester']: row for row in conn.execute('SELECT * FROM archived_semesters')}
+    results = verify_archives(conn)
+    if not results:
+        click.echo('No archived semesters')
+        return
+
+    for semester, problems in results.items():
+        entry = entries[semester]
+        click.echo('%s  %8d sit-ins  %9d min  %s .. %s  %s' % (
+            semester, entry['sit_in_count'], entry['total_minutes'], format_epoch(entry['first_login'], '%Y-%m-%d'),
+            format_epoch(entry['last_login'], '%Y-%m-%d'), 'ok' if not problems else 'FAILED'))
+        for problem in problems:
+            click.echo('    %s' % problem)
+    if any(results.values()):
+        raise click.ClickException('%d archives failed verification' % sum(1 for p in results.values() if p))
@@ -0,0 +1,200 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+# Static asset pipeline. 'flask build-assets' writes minified copies of the
+# stylesheets and scripts, plus resized icon variants, to static/dist under
+# content-hashed names, each with .gz (and .br when brotli is installed)
+# siblings, and records them in static/dist/manifest.json. asset_url() maps a
+# source name to its hashed file; those are served precompressed with a
+# one-year immutable Cache-Control, since a changed file gets a new name.
+# Without a build asset_url() falls back to the plain static files; the icon
+# variants exist only in a build, so pages link them only when has_asset().
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Minified and hashed as they are
+BUNDLED = ['css/style.css', 'js/main.js', 'js/chart.js']
+
+# Icon variants cut from the 1024px generated-icon.png: (name, pixels)
+ICON_SOURCE = 'generated-icon.png'
+ICON_VARIANTS = [
+    ('img/favicon-32.png', 32),
+    ('img/apple-touch-icon.png', 180),
+    ('img/icon-192.png', 192),
+]
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def minify_css(text):
+    try:
+        import rcssmin
+        return rcssmin.cssmin(text)
+    except ImportError:
+        pass
+
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    # Spaces before a colon are kept: ".nav :hover" is not ".nav:hover"
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    try:
+        import rjsmin
+        return rjsmin.jsmin(text)
+    except ImportError:
+        pass
+
+    # Without a real minifier only comment lines, indentation and blank lines
+    # go; lines are never joined, so automatic semicolon insertion is unaffected
+    text = re.sub(r'^\s*/\*.*?\*/\s*$', '', text, flags=re.S | re.M)
+    lines = [line.strip() for line in text.splitlines()]
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def hashed_name(name, data):
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:10], ext)
+
+
+def compress(path, data):
+    if len(data) < MIN_COMPRESS_BYTES:
+        return
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def icon_variants(source):
+    try:
+        from PIL import Image
+    except ImportError:
+        return []
+
+    variants = []
+    with Image.open(source) as image:
+        for name, size in ICON_VARIANTS:
+            resized = image.convert('RGB').resize((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, 'PNG', optimize=True)
+            variants.append((name, out.getvalue()))
+    return variants
+
+
+# Build static/dist; returns the manifest. Earlier builds are left in place
+# for pages still cached with their names.
+def build_assets(static_folder, root_path):
+    dist = os.path.join(static_folder, DIST_DIR)
+
+    outputs = []
+    for name in BUNDLED:
+        with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+            text = f.read()
+        text = minify_css(text) if name.endswith('.css') else minify_js(text)
+        outputs.append((name, text.encode('utf-8')))
+
+    icon = os.path.join(root_path, ICON_SOURCE)
+    if os.path.exists(icon):
+        outputs.extend(icon_variants(icon))
+
+    manifest = {}
+    for name, data in outputs:
+        target = hashed_name(name, data)
+        path = os.path.join(dist, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # Images are already compressed
+        if not name.startswith('img/'):
+            compress(path, data)
+        manifest[name] = target
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# URL of a static asset: its fingerprinted build when there is one
+def asset_url(filename):
+    manifest = current_app.extensions['assets']
+    if filename in manifest:
+        return url_for('serve_asset', filename=manifest[filename])
+    return url_for('static', filename=filename)
+
+
+# Whether filename can be linked: it was built, or is a plain static file
+def has_asset(filename):
+    return (filename in current_app.extensions['assets']
+            or os.path.isfile(os.path.join(current_app.static_folder, filename)))
+
+
+# Hashed files never change, so they are cached for a year without
+# revalidation; the smallest precompressed copy the client accepts is sent
+def serve_asset(filename):
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in request.accept_encodings and os.path.exists(os.path.join(dist, filename + suffix)):
+            encoding = candidate
+            filename += suffix
+            break
+
+    response = send_from_directory(dist, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    app.add_url_rule(app.static_url_path + '/' + DIST_DIR + '/<path:filename>', 'serve_asset', serve_asset)
+    app.add_template_global(asset_url)
+    app.add_template_global(has_asset)
+    app.cli.add_command(build_assets_command)
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Write minified, fingerprinted and precompressed assets to static/dist."""
+    manifest = build_assets(current_app.static_folder, current_app.root_path)
+    current_app.extensions['assets'] = manifest
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    for name, target in sorted(manifest.items()):
+        sizes = [os.path.getsize(os.path.join(dist, target + suffix))
+                 for suffix in ('', '.gz', '.br') if os.path.exists(os.path.join(dist, target + suffix))]
+        click.echo('%-26s -> %s  (%s bytes)' % (name, target, ' / '.join(str(size) for size in sizes)))
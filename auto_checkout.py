@@ -0,0 +1,191 @@
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from database import begin_write, get_db_connection, open_db_connection
+from rollups import record_checkouts
+from timestamps import format_epoch, to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Auto-checkout. A sit-in is overdue once session_remaining minutes have passed
+# since login_time; the sweeper closes overdue sessions with logout_time set to
+# the end of their allotted time. Every gunicorn worker runs a sweeper thread,
+# but a lease row in background_tasks lets only one of them sweep at a time.
+# The same row carries the run counters served by /api/auto-checkout/metrics;
+# last_run_at is in epoch seconds like the sit-in times (see timestamps.py).
+
+TASK_NAME = 'auto_checkout'
+
+# Sessions closed per transaction
+BATCH_SIZE = 500
+
+BACKGROUND_TASKS_DDL = [
+    '''CREATE TABLE IF NOT EXISTS background_tasks (
+           name TEXT PRIMARY KEY,
+           lease_owner TEXT,
+           lease_expires REAL NOT NULL DEFAULT 0,
+           runs INTEGER NOT NULL DEFAULT 0,
+           items_total INTEGER NOT NULL DEFAULT 0,
+           last_items INTEGER NOT NULL DEFAULT 0,
+           last_run_at TIMESTAMP
+       )''',
+    "INSERT OR IGNORE INTO background_tasks (name) VALUES ('%s')" % TASK_NAME,
+]
+
+
+def lease_owner():
+    return '%s:%d:%d' % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+# Take or renew the task lease for seconds; False while another worker holds it
+def acquire_lease(conn, owner, seconds, name=TASK_NAME):
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE background_tasks
+        SET lease_owner = ?, lease_expires = ?
+        WHERE name = ? AND (lease_expires < ? OR lease_owner = ?)
+    ''', (owner, now + seconds, name, now, owner))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def release_lease(conn, owner, name=TASK_NAME):
+    conn.execute('UPDATE background_tasks SET lease_expires = 0 WHERE name = ? AND lease_owner = ?',
+                 (name, owner))
+    conn.commit()
+
+
+# Close one batch of overdue sessions; returns how many were closed
+def expire_batch(conn, now, limit=BATCH_SIZE):
+    begin_write(conn)
+    try:
+        # The (status, login_time) index narrows this to active sessions
+        overdue = [row['id'] for row in conn.execute('''
+            SELECT id FROM sit_ins
+            WHERE status = 'active' AND session_remaining IS NOT NULL
+              AND login_time + session_remaining * 60 <= ?
+            ORDER BY login_time
+            LIMIT ?
+        ''', (to_epoch(now), limit))]
+
+        closed = record_checkouts(conn, overdue, None) if overdue else []
+        if closed:
+            conn.execute('''
+                UPDATE sit_ins
+                SET status = 'completed',
+                    logout_time = login_time + session_remaining * 60,
+                    duration_seconds = session_remaining * 60
+                WHERE id IN (%s)
+            ''' % ', '.join('?' * len(closed)), closed)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(closed)
+
+
+# Close every overdue session in batches and record the run; returns the count
+def expire_overdue_sessions(conn, now=None):
+    now = now or datetime.datetime.now()
+    closed = 0
+    while True:
+        batch = expire_batch(conn, now)
+        closed += batch
+        if batch < BATCH_SIZE:
+            break
+
+    conn.execute('''
+        UPDATE background_tasks
+        SET runs = runs + 1, items_total = items_total + ?, last_items = ?, last_run_at = ?
+        WHERE name = ?
+    ''', (closed, closed, to_epoch(now), TASK_NAME))
+    conn.commit()
+    return closed
+
+
+def sweeper_metrics(conn):
+    row = conn.execute('''
+        SELECT runs, items_total, last_items, last_run_at, lease_owner, lease_expires
+        FROM background_tasks WHERE name = ?
+    ''', (TASK_NAME,)).fetchone()
+    if row is None:
+        return {}
+    return {
+        'runs': row['runs'],
+        'sessions_closed_total': row['items_total'],
+        'sessions_closed_last_run': row['last_items'],
+        'last_run_at': format_epoch(row['last_run_at']) if row['last_run_at'] is not None else None,
+        'lease_owner': row['lease_owner'] if row['lease_expires'] > time.time() else None,
+    }
+
+
+class AutoCheckout:
+    def __init__(self):
+        self.database = None
+        self.interval = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # AUTO_CHECKOUT_INTERVAL is the seconds between sweeps; 0 turns the
+    # background thread off (the expire-sessions command still works)
+    def init_app(self, app):
+        app.config.setdefault('AUTO_CHECKOUT_INTERVAL',
+                              int(os.environ.get('AUTO_CHECKOUT_INTERVAL', 0 if app.testing else 60)))
+        app.extensions['auto_checkout'] = self
+        app.before_request(self._ensure_started)
+        self.database = app.config['DATABASE']
+        self.interval = app.config['AUTO_CHECKOUT_INTERVAL']
+
+    # Threads do not survive a fork, so each worker starts its own on its
+    # first request
+    def _ensure_started(self):
+        if not self.interval or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='auto-checkout', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        owner = lease_owner()
+        while True:
+            # Jitter keeps workers started together from polling in lockstep
+            time.sleep(self.interval * random.uniform(0.8, 1.2))
+            conn = open_db_connection(self.database)
+            try:
+                if acquire_lease(conn, owner, self.interval * 2):
+                    closed = expire_overdue_sessions(conn)
+                    if closed:
+                        logger.info('Auto-checkout closed %d overdue sit-ins', closed)
+            except Exception:
+                logger.exception('Auto-checkout sweep failed')
+            finally:
+                conn.close()
+
+
+auto_checkout = AutoCheckout()
+
+
+@click.command('expire-sessions')
+@with_appcontext
+def expire_sessions_command():
+    """Check out every sit-in that has run past its session time."""
+    conn = get_db_connection()
+    owner = lease_owner()
+    if not acquire_lease(conn, owner, 300):
+        raise click.ClickException('Another worker is sweeping; try again shortly')
+    try:
+        closed = expire_overdue_sessions(conn)
+    finally:
+        release_lease(conn, owner)
+    click.echo('Closed %d overdue sit-ins' % closed)
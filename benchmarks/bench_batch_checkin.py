@@ -0,0 +1,104 @@
+"""Compare check-in/checkout throughput of the batch JSON API against the
+single-item form routes, the way a 30-seat class arrives and leaves.
+
+    python benchmarks/bench_batch_checkin.py --students 3000 --batch-size 30
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db  # noqa: E402
+
+LAB_IDS = [524, 526, 528, 530, 542]
+
+
+def make_app(path):
+    app = create_app({'DATABASE': path, 'TESTING': True})
+    init_db(app)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['user_role'] = 'admin'
+    return app, client
+
+
+def active_ids(path):
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM sit_ins WHERE status = 'active' ORDER BY id")]
+    conn.close()
+    return ids
+
+
+def single(path, students):
+    app, client = make_app(path)
+
+    started = time.perf_counter()
+    for i in range(students):
+        client.post('/sit-in', data={
+            'student_id': 1000 + i,
+            'student_name': 'Student %d' % i,
+            'purpose': 'C Programming',
+            'lab': LAB_IDS[i % len(LAB_IDS)],
+            'remaining_session': 30,
+        })
+    check_in = time.perf_counter() - started
+
+    ids = active_ids(path)
+    started = time.perf_counter()
+    for sit_in_id in ids:
+        client.get('/checkout/%d' % sit_in_id)
+    checkout = time.perf_counter() - started
+
+    return check_in, checkout
+
+
+def batched(path, students, batch_size):
+    app, client = make_app(path)
+
+    started = time.perf_counter()
+    for offset in range(0, students, batch_size):
+        client.post('/api/sit-ins/batch-check-in', json={'check_ins': [{
+            'student_id': 1000 + i,
+            'student_name': 'Student %d' % i,
+            'purpose': 'C Programming',
+            'lab': LAB_IDS[i % len(LAB_IDS)],
+            'remaining_session': 30,
+        } for i in range(offset, min(offset + batch_size, students))]})
+    check_in = time.perf_counter() - started
+
+    ids = active_ids(path)
+    started = time.perf_counter()
+    for offset in range(0, len(ids), batch_size):
+        client.post('/api/sit-ins/batch-checkout', json={'sit_in_ids': ids[offset:offset + batch_size]})
+    checkout = time.perf_counter() - started
+
+    return check_in, checkout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=3000)
+    parser.add_argument('--batch-size', type=int, default=30)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single_in, single_out = single(os.path.join(tmp, 'single.db'), args.students)
+        batch_in, batch_out = batched(os.path.join(tmp, 'batch.db'), args.students, args.batch_size)
+
+    for label, single_time, batch_time in (('check-in', single_in, batch_in), ('checkout', single_out, batch_out)):
+        print('%-9s single %8.1f items/s   batch(%d) %8.1f items/s   %.1fx' % (
+            label, args.students / single_time, args.batch_size, args.students / batch_time,
+            single_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
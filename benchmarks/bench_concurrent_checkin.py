@@ -0,0 +1,108 @@
+"""Hammer POST /sit-in from several processes at once, every process checking
+in the same students, and confirm each student ends up with exactly one
+active sit-in. Reports check-in throughput under that contention.
+
+    python benchmarks/bench_concurrent_checkin.py --processes 8 --students 500
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db  # noqa: E402
+
+LAB_IDS = [524, 526, 528, 530, 542]
+
+
+def worker(path, students, seed, start, results):
+    logging.disable(logging.INFO)
+    app = create_app({'DATABASE': path, 'TESTING': True})
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['user_role'] = 'admin'
+
+    order = list(range(students))
+    random.Random(seed).shuffle(order)
+
+    start.wait()
+    accepted = rejected = errors = 0
+    for i in order:
+        try:
+            response = client.post('/sit-in', data={
+                'student_id': 1000 + i,
+                'student_name': 'Student %d' % i,
+                'purpose': 'C Programming',
+                'lab': LAB_IDS[i % len(LAB_IDS)],
+                'remaining_session': 30,
+            })
+        except Exception:
+            # Testing apps re-raise, e.g. IntegrityError or "database is locked"
+            errors += 1
+            continue
+        if response.headers['Location'].endswith('/view-sit-in'):
+            accepted += 1
+        else:
+            rejected += 1
+    results.put((accepted, rejected, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--students', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        init_db(create_app({'DATABASE': path}))
+
+        start = multiprocessing.Barrier(args.processes + 1)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(path, args.students, seed, start, results))
+                     for seed in range(args.processes)]
+        for process in processes:
+            process.start()
+
+        start.wait()
+        started = time.perf_counter()
+        counts = [results.get() for process in processes]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+        conn = sqlite3.connect(path)
+        active = conn.execute("SELECT COUNT(*) FROM sit_ins WHERE status = 'active'").fetchone()[0]
+        duplicates = conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT student_id FROM sit_ins WHERE status = 'active'
+                GROUP BY student_id HAVING COUNT(*) > 1
+            )
+        ''').fetchone()[0]
+        conn.close()
+
+    accepted = sum(count[0] for count in counts)
+    rejected = sum(count[1] for count in counts)
+    errors = sum(count[2] for count in counts)
+    attempts = accepted + rejected + errors
+    print('%d check-in attempts from %d processes in %.2fs (%.1f requests/s)' % (
+        attempts, args.processes, elapsed, attempts / elapsed))
+    print('accepted %d, rejected as already active %d, failed %d' % (accepted, rejected, errors))
+    print('active sit-ins %d, students with more than one %d' % (active, duplicates))
+
+    if errors or accepted != args.students or active != args.students or duplicates:
+        sys.exit('FAIL: expected exactly one active sit-in per student')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Compare requests/sec of pooled, tuned SQLite connections against the old
+connect-per-call behaviour (default rollback journal, fresh connection).
+
+    python benchmarks/bench_db_connections.py --requests 2000 --threads 4
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from app import create_app, init_db  # noqa: E402
+
+app = create_app()
+
+LAB_IDS = [524, 526, 528, 530, 542]
+
+
+def legacy_connection(*args, **kwargs):
+    # The original get_db_connection(): no pragmas, no statement cache tuning
+    conn = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def prepare_database(path, students):
+    app.config['DATABASE'] = path
+    init_db(app)
+
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO students (id, name, program, year_level) VALUES (?, ?, ?, ?)',
+                     [(1000 + i, 'Student %d' % i, 'BSIT', 1 + i % 4) for i in range(students)])
+    conn.commit()
+    conn.close()
+
+
+def login(client):
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'admin'
+        sess['user_role'] = 'admin'
+
+
+def worker(count, students, results):
+    client = app.test_client()
+    login(client)
+    for _ in range(count):
+        student_id = 1000 + random.randrange(students)
+        roll = random.random()
+        if roll < 0.4:
+            client.get('/home')
+        elif roll < 0.7:
+            client.get('/sit-in')
+        else:
+            client.post('/sit-in', data={
+                'student_id': student_id,
+                'student_name': 'Student',
+                'purpose': 'C Programming',
+                'lab': random.choice(LAB_IDS),
+                'remaining_session': 30,
+            })
+    results.append(count)
+
+
+def run(label, total, threads, students):
+    results = []
+    per_thread = total // threads
+    pool = [threading.Thread(target=worker, args=(per_thread, students, results)) for _ in range(threads)]
+
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    done = sum(results)
+    print('%-8s %6d requests in %6.2fs  %8.1f req/s' % (label, done, elapsed, done / elapsed))
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--students', type=int, default=500)
+    args = parser.parse_args()
+
+    app.config['TESTING'] = True
+    tuned_open = database.open_db_connection
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Old behaviour: rollback journal and a new connection for every request
+        prepare_database(os.path.join(tmp, 'legacy.db'), args.students)
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+        database.open_db_connection = legacy_connection
+        app.config['SQLITE_POOL_SIZE'] = 0
+        app.extensions.pop('sqlite_pool', None)
+        legacy = run('legacy', args.requests, args.threads, args.students)
+
+        # New behaviour: WAL, tuned pragmas and pooled connections
+        prepare_database(os.path.join(tmp, 'pooled.db'), args.students)
+        database.open_db_connection = tuned_open
+        app.config['SQLITE_POOL_SIZE'] = database.DEFAULT_POOL_SIZE
+        app.extensions.pop('sqlite_pool', None)
+        pooled = run('pooled', args.requests, args.threads, args.students)
+
+    print('speedup  %.2fx' % (pooled / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Login storm: many threads POST /login at once while another thread keeps
+loading the sit-in board. Reports login throughput and latency, how many
+logins were shed with 503, and the board's latency during the storm.
+
+    python benchmarks/bench_login.py --threads 16 --logins 20 --hash-workers 2 --queue 16
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=20, help='logins per thread')
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=16)
+    parser.add_argument('--method', default='scrypt:32768:8:1')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'DATABASE': os.path.join(tmp, 'bench.db'),
+            'TESTING': True,
+            'PASSWORD_HASH_METHOD': args.method,
+            'PASSWORD_HASH_WORKERS': args.hash_workers,
+            'PASSWORD_HASH_QUEUE': args.queue,
+        })
+        init_db(app)
+
+        latencies, statuses = [], {}
+        board_latencies = []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def storm():
+            client = app.test_client()
+            for _ in range(args.logins):
+                started = time.perf_counter()
+                response = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        def board():
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['user_role'] = 'admin'
+            while not done.is_set():
+                started = time.perf_counter()
+                client.get('/view-sit-in')
+                board_latencies.append(time.perf_counter() - started)
+
+        watcher = threading.Thread(target=board)
+        watcher.start()
+
+        threads = [threading.Thread(target=storm) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        watcher.join()
+
+    ok = statuses.get(302, 0)
+    print('%d login attempts in %.2fs: %.1f successful logins/s' % (len(latencies), elapsed, ok / elapsed))
+    print('status counts %s' % dict(sorted(statuses.items())))
+    print('login latency   p50 %6.1f ms  p95 %6.1f ms  max %6.1f ms' % (
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, max(latencies) * 1000))
+    print('board latency   p50 %6.1f ms  p95 %6.1f ms  (%d loads, mean %.1f ms)' % (
+        percentile(board_latencies, 50) * 1000, percentile(board_latencies, 95) * 1000,
+        len(board_latencies), statistics.mean(board_latencies) * 1000 if board_latencies else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""Drive every route of the app and report latency percentiles and throughput
+per endpoint. Runs in-process through the Flask test client, or against a
+running server (e.g. gunicorn) with --url. Write endpoints really write, so
+point it at a copy made with generate_data.py, not at real data.
+
+    python benchmarks/generate_data.py /tmp/sitin_large.db
+    python benchmarks/bench_routes.py /tmp/sitin_large.db --requests 100 --json run.json
+    python benchmarks/bench_routes.py /tmp/sitin_large.db --url http://127.0.0.1:8000 --concurrency 8 \\
+        --json gunicorn.json --compare run.json
+"""
+import argparse
+import datetime
+import http.cookiejar
+import io
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+
+ADMIN = {'username': 'admin', 'password': 'admin123'}
+
+# Endpoints that get a tenth of the requests: password hashing is slow by
+# design, and a server only notices a closed event stream at its next
+# keep-alive, so each probe holds a server thread for up to 15 seconds
+FEW = {'POST /login', 'POST /register', 'GET /sit-in/events (first event)'}
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self):
+        self.client.post('/login', data=ADMIN)
+
+    def request(self, method, path, data=None, json_body=None, first_chunk=False):
+        if first_chunk:
+            response = self.client.open(path, method=method, buffered=False)
+            next(iter(response.response), None)
+            response.close()
+            return response.status_code
+        return self.fetch(method, path, data, json_body)[0]
+
+    def fetch(self, method, path, data=None, json_body=None):
+        response = self.client.open(path, method=method, data=data, json=json_body)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpDriver:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect())
+
+    def login(self):
+        self.request('POST', '/login', data=ADMIN)
+
+    def request(self, method, path, data=None, json_body=None, first_chunk=False):
+        return self.fetch(method, path, data, json_body, first_chunk)[0]
+
+    def fetch(self, method, path, data=None, json_body=None, first_chunk=False):
+        body, headers = None, {}
+        if json_body is not None:
+            body, headers = json.dumps(json_body).encode('utf-8'), {'Content-Type': 'application/json'}
+        elif isinstance(data, dict) and any(isinstance(value, tuple) for value in data.values()):
+            body, headers = multipart(data)
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode('utf-8')
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.readline() if first_chunk else response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def multipart(fields):
+    boundary = 'benchboundary%d' % random.randint(0, 1 << 30)
+    parts = []
+    for name, value in fields.items():
+        stream, filename = value
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                      'Content-Type: text/csv\r\n\r\n' % (boundary, name, filename)).encode('utf-8')
+                     + stream.read() + b'\r\n')
+    body = b''.join(parts) + ('--%s--\r\n' % boundary).encode('utf-8')
+    return body, {'Content-Type': 'multipart/form-data; boundary=' + boundary}
+
+
+class Context:
+    """IDs and cursors the endpoint builders draw from."""
+
+    def __init__(self, database, seed):
+        self.database = database
+        self.rng = random.Random(seed)
+        conn = self.connect()
+        self.student_ids = [row[0] for row in conn.execute('SELECT id FROM students ORDER BY random() LIMIT 5000')]
+        self.lab_ids = [row[0] for row in conn.execute('SELECT id FROM laboratories')]
+        self.reservation_ids = [row[0] for row in conn.execute('SELECT id FROM reservations ORDER BY random() LIMIT 1000')]
+        self.rows = {table: conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+                     for table in ('users', 'students', 'laboratories', 'sit_ins', 'announcements', 'feedback',
+                                   'reservations')}
+        conn.close()
+        active = set(self.active_sit_ins().values())
+        # Students free to check in, consumed by the check-in endpoints
+        self.free = [student_id for student_id in self.student_ids if student_id not in active]
+        self.checked_in = []
+        self.job_ids = []
+        self.after_cursor = None
+
+    def connect(self):
+        return sqlite3.connect(self.database, timeout=30)
+
+    def active_sit_ins(self, student_ids=None):
+        conn = self.connect()
+        rows = conn.execute("SELECT student_id, id FROM sit_ins WHERE status = 'active'").fetchall()
+        conn.close()
+        return {student_id: sit_in_id for student_id, sit_in_id in rows
+                if student_ids is None or student_id in student_ids}
+
+    def take_students(self, n):
+        taken, self.free = self.free[:n], self.free[n:]
+        self.checked_in.extend(taken)
+        return taken
+
+
+def month_range():
+    today = datetime.date.today()
+    return (today - datetime.timedelta(days=30)).isoformat(), today.isoformat()
+
+
+def check_in_form(student_id, ctx):
+    return {'student_id': student_id, 'student_name': 'Bench %d' % student_id, 'purpose': 'Java Programming',
+            'lab': ctx.rng.choice(ctx.lab_ids), 'remaining_session': 60}
+
+
+# Each builder returns n requests as (method, path, options) tuples. Builders
+# run right before their endpoint, so they can use what earlier ones created.
+def build_endpoints():
+    date_from, date_to = month_range()
+    endpoints = []
+
+    def get(name, path_fn):
+        endpoints.append((name, lambda ctx, n: [('GET', path_fn(ctx), {}) for _ in range(n)]))
+
+    def add(name, builder):
+        endpoints.append((name, builder))
+
+    get('GET /', lambda ctx: '/')
+    get('GET /login', lambda ctx: '/login')
+    add('POST /login', lambda ctx, n: [('POST', '/login', {'data': ADMIN})] * n)
+    get('GET /register', lambda ctx: '/register')
+    add('POST /register', lambda ctx, n: [
+        ('POST', '/register', {'data': {'username': 'bench%d' % ctx.rng.getrandbits(40), 'password': 'x1',
+                                        'confirm_password': 'x1'}}) for _ in range(n)])
+    get('GET /home', lambda ctx: '/home')
+    get('GET /search', lambda ctx: '/search')
+    add('POST /search', lambda ctx, n: [
+        ('POST', '/search', {'data': {'student_id': str(ctx.rng.choice(ctx.student_ids))}}) for _ in range(n)])
+    add('GET /api/search-students', lambda ctx, n: [
+        ('GET', '/api/search-students?query=' + ctx.rng.choice(['san', 'mar', 'jo', 'cruz', 'kris', '22']), {})
+        for _ in range(n)])
+    add('GET /student/<id>', lambda ctx, n: [
+        ('GET', '/student/%d' % ctx.rng.choice(ctx.student_ids), {}) for _ in range(n)])
+    add('POST /students/import', lambda ctx, n: [
+        ('POST', '/students/import', {'data': {'roster': roster_upload(ctx)}}) for _ in range(n)])
+    get('GET /sit-in', lambda ctx: '/sit-in')
+    add('POST /sit-in', lambda ctx, n: [
+        ('POST', '/sit-in', {'data': check_in_form(student_id, ctx)}) for student_id in ctx.take_students(n)])
+    add('GET /checkout/<id>', lambda ctx, n: [
+        ('GET', '/checkout/%d' % sit_in_id, {})
+        for sit_in_id in list(ctx.active_sit_ins(set(ctx.checked_in)).values())[:n]])
+    add('POST /api/sit-ins/batch-check-in', lambda ctx, n: [
+        ('POST', '/api/sit-ins/batch-check-in',
+         {'json_body': {'check_ins': [check_in_form(student_id, ctx) for student_id in ctx.take_students(30)]}})
+        for _ in range(n)])
+    add('POST /api/sit-ins/batch-checkout', lambda ctx, n: batch_checkouts(ctx, n))
+    get('GET /api/auto-checkout/metrics', lambda ctx: '/api/auto-checkout/metrics')
+    get('GET /view-sit-in', lambda ctx: '/view-sit-in')
+    get('GET /sit-in-records', lambda ctx: '/sit-in-records')
+    get('GET /sit-in-reports', lambda ctx: '/sit-in-reports?date_from=%s&date_to=%s' % (date_from, date_to))
+    add('GET /sit-in-reports (next page)', lambda ctx, n: [
+        ('GET', '/sit-in-reports?date_from=%s&date_to=%s&after=%s' % (date_from, date_to, ctx.after_cursor), {})
+    ] * n if ctx.after_cursor else [])
+    get('GET /charts/purpose.png (1 month)',
+        lambda ctx: '/charts/purpose.png?date_from=%s&date_to=%s' % (date_from, date_to))
+    get('GET /export-report (csv, 1 month)',
+        lambda ctx: '/export-report?format=csv&date_from=%s&date_to=%s' % (date_from, date_to))
+    add('POST /export-jobs', lambda ctx, n: [
+        ('POST', '/export-jobs', {'data': {'format': 'pdf', 'date_from': date_from, 'date_to': date_to,
+                                           'lab': str(ctx.rng.choice(ctx.lab_ids))}}) for _ in range(n)])
+    add('GET /export-jobs/<id>', lambda ctx, n: [
+        ('GET', '/export-jobs/%s' % ctx.rng.choice(ctx.job_ids), {}) for _ in range(n)] if ctx.job_ids else [])
+    add('GET /export-jobs/<id>/download', lambda ctx, n: [
+        ('GET', '/export-jobs/%s/download' % ctx.rng.choice(ctx.job_ids), {}) for _ in range(n)]
+        if ctx.job_ids else [])
+    get('GET /feedback-reports', lambda ctx: '/feedback-reports')
+    add('POST /add-feedback', lambda ctx, n: [
+        ('POST', '/add-feedback', {'data': {'student_id': ctx.rng.choice(ctx.student_ids),
+                                            'lab_id': ctx.rng.choice(ctx.lab_ids), 'message': 'Benchmark feedback'}})
+        for _ in range(n)])
+    get('GET /reservation', lambda ctx: '/reservation')
+    add('POST /reservation', lambda ctx, n: [('POST', '/reservation', {'data': reservation_form(ctx)})
+                                             for _ in range(n)])
+    add('GET /update-reservation-status', lambda ctx, n: [
+        ('GET', '/update-reservation-status/%d/approved' % ctx.rng.choice(ctx.reservation_ids), {})
+        for _ in range(n)])
+    add('POST /add-announcement', lambda ctx, n: [
+        ('POST', '/add-announcement', {'data': {'content': 'Benchmark announcement %d' % i}}) for i in range(n)])
+    add('POST /edit-announcement/<id>', lambda ctx, n: [
+        ('POST', '/edit-announcement/%d' % announcement_id, {'data': {'content': 'Edited'}})
+        for announcement_id in bench_announcements(ctx)[:n]])
+    add('GET /delete-announcement/<id>', lambda ctx, n: [
+        ('GET', '/delete-announcement/%d' % announcement_id, {}) for announcement_id in bench_announcements(ctx)[:n]])
+    get('GET /logout', lambda ctx: '/logout')
+    # Last, so streams still held open on a server do not slow other endpoints
+    add('GET /sit-in/events (first event)', lambda ctx, n: [('GET', '/sit-in/events', {'first_chunk': True})] * n)
+    return endpoints
+
+
+def roster_upload(ctx):
+    rows = ['id,name,program,year_level'] + ['%d,Student %d,BSIT,2' % (student_id, student_id)
+                                             for student_id in ctx.student_ids[:100]]
+    return io.BytesIO('\n'.join(rows).encode('utf-8')), 'roster.csv'
+
+
+def batch_checkouts(ctx, n):
+    ids = list(ctx.active_sit_ins(set(ctx.checked_in)).values())
+    return [('POST', '/api/sit-ins/batch-checkout', {'json_body': {'sit_in_ids': ids[i * 30:(i + 1) * 30]}})
+            for i in range(n) if ids[i * 30:(i + 1) * 30]]
+
+
+def reservation_form(ctx):
+    day = datetime.date.today() + datetime.timedelta(days=ctx.rng.randint(1, 14))
+    start = ctx.rng.randint(16, 34) * 30
+    return {'student_id': ctx.rng.choice(ctx.student_ids), 'lab_id': ctx.rng.choice(ctx.lab_ids),
+            'purpose': 'Research', 'date': day.isoformat(), 'start_time': '%02d:%02d' % divmod(start, 60),
+            'end_time': '%02d:%02d' % divmod(start + 60, 60)}
+
+
+def bench_announcements(ctx):
+    conn = ctx.connect()
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM announcements WHERE content LIKE 'Benchmark announcement%' OR content = 'Edited'")]
+    conn.close()
+    return ids
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+
+def run_endpoint(make_driver, requests, concurrency):
+    work = queue.Queue()
+    for item in requests:
+        work.put(item)
+    latencies, statuses, lock = [], {}, threading.Lock()
+
+    def worker():
+        driver = make_driver()
+        while True:
+            try:
+                method, path, options = work.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                status = driver.request(method, path, **options)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, len(requests)))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': statuses,
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='database the app uses (read for IDs, written by the app)')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process test client')
+    parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', help='regular expression selecting endpoints by name')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--compare', help='earlier --json output to compare p50/p95 against')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    ctx = Context(args.database, args.seed)
+
+    if args.url:
+        base_driver = HttpDriver
+        target = args.url
+    else:
+        app = create_app({'DATABASE': args.database})
+        base_driver = lambda: TestClientDriver(app)  # noqa: E731
+        target = 'test client'
+
+    def make_driver():
+        driver = base_driver(args.url) if args.url else base_driver()
+        driver.login()
+        return driver
+
+    # Page 2 of the reports and the export job IDs come from real responses
+    setup = make_driver()
+    date_from, date_to = month_range()
+    status, page = setup.fetch('GET', '/sit-in-reports?date_from=%s&date_to=%s' % (date_from, date_to))
+    match = re.search(r'after=([A-Za-z0-9_-]+)', page.decode('utf-8'))
+    ctx.after_cursor = match.group(1) if match else None
+
+    results = {}
+    print('%-40s %6s %7s %9s %9s %9s %9s' % ('endpoint', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, builder in build_endpoints():
+        if args.only and not re.search(args.only, name):
+            continue
+        n = max(1, args.requests // 10) if name in FEW else args.requests
+        requests = builder(ctx, n)
+        if not requests:
+            print('%-40s skipped (nothing to request)' % name)
+            continue
+        stats = run_endpoint(make_driver, requests, args.concurrency)
+        results[name] = stats
+        print('%-40s %6d %7d %9.1f %9.1f %9.1f %9.1f' % (
+            name, stats['requests'], stats['errors'], stats['throughput_rps'],
+            stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+
+        if name == 'POST /export-jobs':
+            job_ids = set()
+            for method, path, options in requests[:5]:
+                status, body = setup.fetch(method, path, options['data'])
+                job_ids.add(json.loads(body)['id'])
+            ctx.job_ids = sorted(job_ids)
+            time.sleep(2)
+
+    output = {
+        'meta': {
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'target': target,
+            'database': os.path.abspath(args.database),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rows': ctx.rows,
+        },
+        'endpoints': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)['endpoints']
+        print('\n%-40s %17s %17s' % ('compared with ' + os.path.basename(args.compare), 'p50 ms', 'p95 ms'))
+        for name, stats in results.items():
+            if name in before:
+                print('%-40s %8.1f -> %6.1f %8.1f -> %6.1f' % (
+                    name, before[name]['p50_ms'], stats['p50_ms'], before[name]['p95_ms'], stats['p95_ms']))
+
+
+if __name__ == '__main__':
+    main()
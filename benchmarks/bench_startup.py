@@ -0,0 +1,72 @@
+"""Measure what a fresh worker pays before serving its first page: import time
+of app.py, create_app() time and peak RSS after the first /login request.
+
+    python benchmarks/bench_startup.py --runs 5 --max-import-ms 600 --max-rss-mb 80
+
+Prints JSON. With thresholds set, exits non-zero when the median import time
+or RSS goes over them so regressions can fail a CI job.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a clean interpreter so nothing is already imported
+PROBE = '''
+import json, logging, resource, sys, time
+logging.disable(logging.CRITICAL)
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+flask_app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy_modules': sorted(m for m in ('pandas', 'matplotlib', 'numpy') if m in sys.modules),
+}))
+'''
+
+
+def probe():
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=ROOT, stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.runs)]
+    report = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'rss_mb')
+    }
+    report['heavy_modules'] = runs[-1]['heavy_modules']
+    report['runs'] = len(runs)
+    print(json.dumps(report, indent=2))
+
+    failed = []
+    if args.max_import_ms is not None and report['import_ms'] > args.max_import_ms:
+        failed.append('import_ms %.1f > %.1f' % (report['import_ms'], args.max_import_ms))
+    if args.max_rss_mb is not None and report['rss_mb'] > args.max_rss_mb:
+        failed.append('rss_mb %.1f > %.1f' % (report['rss_mb'], args.max_rss_mb))
+
+    if failed:
+        print('Startup regression: ' + '; '.join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
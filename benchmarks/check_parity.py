@@ -0,0 +1,188 @@
+"""Check that the app behaves the same on SQLite and PostgreSQL: load one
+fixture into a fresh database of each, drive the same requests through both
+apps (check-ins, checkouts, reservations, announcements, roster import,
+searches, reports, CSV export) and compare status codes, redirects and
+bodies. Clock times are masked, as the two runs are seconds apart. Needs
+psycopg2 and a PostgreSQL user allowed to create databases; a scratch
+database is created next to the one in the URL and dropped afterwards.
+
+    python benchmarks/check_parity.py postgresql://postgres@127.0.0.1:5432/postgres
+"""
+import argparse
+import datetime
+import difflib
+import io
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db  # noqa: E402
+from database import open_db_connection  # noqa: E402
+from generate_data import (EXTRA_LABS, PURPOSE_WEIGHTS, PURPOSES, SESSION_LENGTHS, feedback_rows,  # noqa: E402
+                           reservation_rows, semester_days, sit_in_rows, student_rows)
+from rollups import rebuild_rollups  # noqa: E402
+from timestamps import to_epoch  # noqa: E402
+
+ADMIN = {'username': 'admin', 'password': 'admin123'}
+
+# Dates and clock times, which differ between the two runs
+CLOCK = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?|\b\d{1,2}:\d{2}(?::\d{2})?(?:\s?[AP]M)?\b')
+
+
+def load_fixture(database, seed, students, sit_ins):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    conn = open_db_connection(database)
+    conn.executemany('INSERT OR IGNORE INTO laboratories (id, name, capacity, description) VALUES (?, ?, ?, ?)',
+                     EXTRA_LABS)
+    conn.executemany('INSERT INTO students (id, name, program, year_level, date_registered) VALUES (?, ?, ?, ?, ?)',
+                     list(student_rows(rng, students)))
+    conn.commit()
+    student_ids = [row[0] for row in conn.execute('SELECT id FROM students ORDER BY id')]
+    lab_ids = [row[0] for row in conn.execute('SELECT id FROM laboratories ORDER BY id')]
+
+    days = semester_days(1, today)
+    conn.executemany('''INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, logout_time, status,
+                                             session_remaining, duration_seconds)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', list(sit_in_rows(rng, days, sit_ins, student_ids, lab_ids)))
+    now = datetime.datetime.now().replace(microsecond=0)
+    conn.executemany('''INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, status, session_remaining)
+                        VALUES (?, ?, ?, ?, 'active', ?)''',
+                     [(student_id, rng.choices(PURPOSES, PURPOSE_WEIGHTS)[0], rng.choice(lab_ids),
+                       to_epoch(now - datetime.timedelta(minutes=rng.randint(0, 25))), rng.choice(SESSION_LENGTHS))
+                      for student_id in rng.sample(student_ids, 20)])
+    conn.executemany('''INSERT INTO reservations (student_id, lab_id, purpose, date, start_time, end_time, status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     list(reservation_rows(rng, days, sit_ins // 10, student_ids, lab_ids, today)))
+    conn.executemany('INSERT INTO feedback (student_id, lab_id, message, date_submitted) VALUES (?, ?, ?, ?)',
+                     list(feedback_rows(rng, days, sit_ins // 20, student_ids, lab_ids)))
+    conn.executemany('INSERT INTO announcements (content, posted_by, date_posted) VALUES (?, ?, ?)',
+                     [('Laboratory schedule update #%d' % i, 'CCS Admin', str(rng.choice(days))) for i in range(20)])
+    conn.commit()
+
+    conn.execute('BEGIN IMMEDIATE')
+    rebuild_rollups(conn)
+    conn.commit()
+    conn.close()
+    return student_ids, lab_ids
+
+
+# The same requests for both apps; IDs are taken from the fixture, which
+# assigns identical row IDs on both databases
+def scenario(student_ids, lab_ids, seed):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    month_ago = (today - datetime.timedelta(days=30)).isoformat()
+    free = rng.sample(student_ids, 40)
+    roster = 'id,name,program,year_level\n' + '\n'.join(
+        '%d,Imported %d,BSCS,3' % (student_id, student_id) for student_id in student_ids[:10] + [99000001, 99000002])
+
+    steps = [
+        ('POST', '/login', {'data': ADMIN}),
+        ('POST', '/sit-in', {'data': {'student_id': free[0], 'student_name': 'Parity One', 'purpose': 'Research',
+                                      'lab': lab_ids[0], 'remaining_session': 60}}),
+        ('POST', '/sit-in', {'data': {'student_id': 99000000, 'student_name': 'New Student',
+                                      'purpose': 'Web Development', 'lab': lab_ids[1], 'remaining_session': 30}}),
+        ('POST', '/api/sit-ins/batch-check-in', {'json': {'check_ins': [
+            {'student_id': student_id, 'student_name': 'Batch %d' % student_id, 'purpose': 'Java Programming',
+             'lab': rng.choice(lab_ids), 'remaining_session': 60} for student_id in free[1:21] + [free[1]]]}}),
+        # PostgreSQL sequences also advance on a conflicting insert, so the
+        # duplicate check-in comes after the last new sit-in to keep IDs equal
+        ('POST', '/sit-in', {'data': {'student_id': free[0], 'student_name': 'Parity One', 'purpose': 'Research',
+                                      'lab': lab_ids[0], 'remaining_session': 60}}),
+        ('POST', '/api/sit-ins/batch-checkout', {'json': {'sit_in_ids': [1, 2, 3]}}),
+        ('GET', '/checkout/4', {}),
+        ('POST', '/reservation', {'data': {'student_id': free[30], 'lab_id': lab_ids[2], 'purpose': 'Research',
+                                           'date': (today + datetime.timedelta(days=3)).isoformat(),
+                                           'start_time': '09:00', 'end_time': '10:30'}}),
+        ('GET', '/update-reservation-status/1/approved', {}),
+        ('POST', '/add-announcement', {'data': {'content': '100% of PCs in lab 524 are "up"'}}),
+        ('POST', '/edit-announcement/1', {'data': {'content': 'Edited announcement'}}),
+        ('GET', '/delete-announcement/2', {}),
+        ('POST', '/add-feedback', {'data': {'student_id': free[31], 'lab_id': lab_ids[0], 'message': 'Parity'}}),
+        ('POST', '/students/import', {'data': {'roster': (io.BytesIO(roster.encode('utf-8')), 'roster.csv')}}),
+        ('POST', '/search', {'data': {'student_id': str(student_ids[5])}}),
+        ('POST', '/search', {'data': {'program': 'BSIT', 'year_level': '2'}}),
+    ]
+    for query in ['san', 'mar', 'jo', 'cruz', '22', str(student_ids[7])[:4], 'bsit', 'zz']:
+        steps.append(('GET', '/api/search-students?query=' + urllib.parse.quote(query), {}))
+    for path in ['/home', '/search', '/search?student_id=%d' % student_ids[3], '/student/%d' % student_ids[3],
+                 '/sit-in', '/view-sit-in', '/sit-in-records', '/api/auto-checkout/metrics',
+                 '/sit-in-reports', '/sit-in-reports?date_from=%s&date_to=%s' % (month_ago, today),
+                 '/sit-in-reports?student=%s&purpose=Research' % str(student_ids[0])[:3],
+                 '/sit-in-reports?lab=%d&status=completed' % lab_ids[1],
+                 '/export-report?format=csv&date_from=%s&date_to=%s' % (month_ago, today),
+                 '/feedback-reports', '/reservation']:
+        steps.append(('GET', path, {}))
+    return steps
+
+
+def run(database, seed, students, sit_ins, export_dir):
+    app = create_app({'DATABASE': database, 'TESTING': True, 'METRICS_ENABLED': False, 'SLOW_QUERY_MS': -1,
+                      'EXPORT_RESULTS_DIR': export_dir})
+    init_db(app)
+    student_ids, lab_ids = load_fixture(database, seed, students, sit_ins)
+    client = app.test_client()
+    results = []
+    for method, path, options in scenario(student_ids, lab_ids, seed):
+        response = client.open(path, method=method, **options)
+        body = CLOCK.sub('<time>', response.get_data(as_text=True))
+        results.append(('%s %s' % (method, path), response.status_code, response.headers.get('Location'), body))
+        response.close()
+    return results
+
+
+def scratch_database(url):
+    import psycopg2
+
+    parts = urllib.parse.urlsplit(url)
+    name = 'sitin_parity_%d' % os.getpid()
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    admin.cursor().execute('CREATE DATABASE %s' % name)
+    return admin, name, urllib.parse.urlunsplit(parts._replace(path='/' + name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('postgres_url', help='PostgreSQL server to create the scratch database on')
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--sit-ins', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    tmp = tempfile.mkdtemp(prefix='sitin-parity-')
+    admin, name, postgres_url = scratch_database(args.postgres_url)
+    try:
+        expected = run(os.path.join(tmp, 'parity.db'), args.seed, args.students, args.sit_ins,
+                       os.path.join(tmp, 'exports-sqlite'))
+        actual = run(postgres_url, args.seed, args.students, args.sit_ins, os.path.join(tmp, 'exports-postgres'))
+    finally:
+        admin.cursor().execute('DROP DATABASE IF EXISTS %s WITH (FORCE)' % name)
+        admin.close()
+
+    mismatches = 0
+    for (label, status, location, body), (_, pg_status, pg_location, pg_body) in zip(expected, actual):
+        if (status, location, body) == (pg_status, pg_location, pg_body):
+            print('ok        %s' % label)
+            continue
+        mismatches += 1
+        print('MISMATCH  %s  sqlite %s %s  postgresql %s %s' % (label, status, location or '', pg_status,
+                                                               pg_location or ''))
+        for line in list(difflib.unified_diff(body.splitlines(), pg_body.splitlines(), 'sqlite', 'postgresql',
+                                              lineterm='', n=1))[:40]:
+            print('    ' + line)
+
+    print('\n%d of %d requests differ' % (mismatches, len(expected)))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
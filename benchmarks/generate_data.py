@@ -0,0 +1,215 @@
+"""Fill a fresh database with realistic volumes for benchmarking: students,
+staff users, laboratories, years of semester sit-ins, reservations,
+feedback and announcements, plus a board of currently active sit-ins.
+
+    python benchmarks/generate_data.py /tmp/sitin_large.db --students 50000 --sit-ins 2000000
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_db  # noqa: E402
+from cache import stamp_triggers  # noqa: E402
+from database import open_db_connection  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from timestamps import to_epoch  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+PURPOSES = ['C Programming', 'C# Programming', 'Java Programming', 'Php Programming', 'ASP.Net Programming',
+            'Database Management', 'Web Development', 'Network Administration', 'Mobile Development', 'Research']
+# Relative popularity of the purposes above
+PURPOSE_WEIGHTS = [20, 8, 18, 6, 4, 12, 14, 6, 8, 4]
+PROGRAMS = ['BSIT', 'BSCS', 'BSIS', 'ACT', 'BSEMC']
+FIRST_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Kristine', 'John', 'Angel', 'Carlo', 'Jasmine', 'Paolo',
+               'Nicole', 'Miguel', 'Patricia', 'Rafael', 'Camille', 'Joshua', 'Bea', 'Christian', 'Sofia', 'Clint',
+               'Kris', 'Andrea', 'Gabriel', 'Trisha', 'Vincent', 'Erika', 'Kevin', 'Lorraine', 'Adrian']
+LAST_NAMES = ['Santos', 'Reyes', 'Cruz', 'Bautista', 'Ocampo', 'Garcia', 'Mendoza', 'Torres', 'Tomas', 'Andrada',
+              'Castillo', 'Flores', 'Villanueva', 'Ramos', 'Castro', 'Rivera', 'Aquino', 'Navarro', 'Salazar',
+              'Mercado', 'Aguilar', 'Dela Cruz', 'Gonzales', 'Lim', 'Tan', 'Uy', 'Go', 'Sy', 'Chua', 'Abella']
+FEEDBACK = ['PC {n} keyboard is not working', 'Aircon too cold today', 'Internet was slow during the session',
+            'Thank you for extending lab hours', 'Mouse at station {n} is broken', 'Monitor flickers at PC {n}',
+            'Please install the latest JDK', 'Lab was clean and quiet', 'Projector cable missing', 'Great lab assistant']
+SESSION_LENGTHS = [30, 60, 90, 120, 180]
+
+# Extra laboratories beyond the five seeded by init_db()
+EXTRA_LABS = [(544, 'Laboratory 544', 40, 'Networking Lab'), (546, 'Laboratory 546', 30, 'Database Lab'),
+              (548, 'Laboratory 548', 35, 'Multimedia Lab'), (550, 'Laboratory 550', 45, 'Open Lab')]
+
+BATCH = 50000
+
+
+def semester_days(years, today):
+    # Two semesters a year, mid-August to mid-December and early January to
+    # late May, weekdays only
+    days = []
+    day = today - datetime.timedelta(days=365 * years)
+    while day < today:
+        in_term = (day.month >= 8 and not (day.month == 8 and day.day < 12)
+                   and not (day.month == 12 and day.day > 15)) or \
+                  (day.month <= 5 and not (day.month == 1 and day.day < 6) and not (day.month == 5 and day.day > 25))
+        if in_term and day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def student_rows(rng, count):
+    ids = set()
+    while len(ids) < count:
+        ids.add(int('%02d%06d' % (rng.randint(18, 26), rng.randint(0, 999999))))
+    for student_id in sorted(ids):
+        name = '%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        yield (student_id, name, rng.choice(PROGRAMS), rng.randint(1, 4),
+               '20%02d-08-01 08:00:00' % (student_id // 1000000))
+
+
+def sit_in_rows(rng, days, total, student_ids, lab_ids):
+    # Fridays are quieter
+    weights = [0.8 if day.weekday() == 4 else 1.0 for day in days]
+    per_day = total / sum(weights)
+    for day, weight in zip(days, weights):
+        count = int(round(rng.gauss(per_day, per_day * 0.15) * weight))
+        logins = sorted(rng.randint(7 * 3600 + 1800, 19 * 3600) for _ in range(max(count, 0)))
+        midnight = datetime.datetime.combine(day, datetime.time())
+        for seconds in logins:
+            login = midnight + datetime.timedelta(seconds=seconds)
+            allotted = rng.choice(SESSION_LENGTHS)
+            logout = login + datetime.timedelta(minutes=rng.randint(10, allotted))
+            yield (rng.choice(student_ids), rng.choices(PURPOSES, PURPOSE_WEIGHTS)[0], rng.choice(lab_ids),
+                   to_epoch(login), to_epoch(logout), 'completed', allotted, to_epoch(logout) - to_epoch(login))
+
+
+def reservation_rows(rng, days, total, student_ids, lab_ids, today):
+    future = [today + datetime.timedelta(days=offset) for offset in range(1, 15)]
+    for _ in range(total):
+        day = rng.choice(future) if rng.random() < 0.05 else rng.choice(days)
+        start = rng.randint(15, 36) * 30
+        status = rng.choice(['pending', 'approved']) if day > today else \
+            rng.choices(['completed', 'approved', 'rejected'], [70, 20, 10])[0]
+        yield (rng.choice(student_ids), rng.choice(lab_ids), rng.choices(PURPOSES, PURPOSE_WEIGHTS)[0], str(day),
+               '%02d:%02d' % divmod(start, 60), '%02d:%02d' % divmod(start + rng.choice([60, 90, 120]), 60), status)
+
+
+def feedback_rows(rng, days, total, student_ids, lab_ids):
+    for _ in range(total):
+        day = rng.choice(days)
+        submitted = datetime.datetime.combine(day, datetime.time(rng.randint(8, 19), rng.randint(0, 59)))
+        yield (rng.choice(student_ids), rng.choice(lab_ids), rng.choice(FEEDBACK).format(n=rng.randint(1, 40)),
+               str(submitted))
+
+
+def insert(conn, query, rows, label):
+    started = time.perf_counter()
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            conn.executemany(query, batch)
+            conn.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(query, batch)
+        conn.commit()
+        count += len(batch)
+    print('%-14s %9d rows in %6.1fs' % (label, count, time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--sit-ins', type=int, default=2000000)
+    parser.add_argument('--years', type=int, default=4)
+    parser.add_argument('--reservations', type=int, default=200000)
+    parser.add_argument('--feedback', type=int, default=50000)
+    parser.add_argument('--announcements', type=int, default=400)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--active', type=int, default=150, help='sit-ins currently active')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='replace an existing database')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            sys.exit('%s exists; pass --force to replace it' % args.database)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+
+    logging.disable(logging.INFO)
+    rng = random.Random(args.seed)
+    today = datetime.date.today()
+
+    app = create_app({'DATABASE': args.database})
+    init_db(app)
+
+    conn = open_db_connection(args.database)
+    conn.execute('PRAGMA synchronous = OFF')
+
+    # Per-row stamp triggers would rewrite the sit_ins version row millions of
+    # times; they are put back (and the stamp bumped) once the load is done
+    for op in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute('DROP TRIGGER IF EXISTS sit_ins_cache_%s' % op)
+
+    conn.executemany('INSERT OR IGNORE INTO laboratories (id, name, capacity, description) VALUES (?, ?, ?, ?)',
+                     EXTRA_LABS)
+    conn.commit()
+    lab_ids = [row[0] for row in conn.execute('SELECT id FROM laboratories')]
+
+    # One hash for every staff account; computing thousands of scrypt hashes
+    # would dominate the run
+    password = generate_password_hash('password', app.config['PASSWORD_HASH_METHOD'])
+    insert(conn, 'INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+           (('staff%03d' % i, password, 'admin' if i < 5 else 'user') for i in range(args.users)), 'users')
+
+    insert(conn, 'INSERT INTO students (id, name, program, year_level, date_registered) VALUES (?, ?, ?, ?, ?)',
+           student_rows(rng, args.students), 'students')
+    student_ids = [row[0] for row in conn.execute('SELECT id FROM students')]
+
+    days = semester_days(args.years, today)
+    insert(conn, '''INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, logout_time, status, session_remaining,
+                                         duration_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+           sit_in_rows(rng, days, args.sit_ins, student_ids, lab_ids), 'sit_ins')
+
+    now = datetime.datetime.now().replace(microsecond=0)
+    insert(conn, '''INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, status, session_remaining)
+                    VALUES (?, ?, ?, ?, 'active', ?)''',
+           ((student_id, rng.choices(PURPOSES, PURPOSE_WEIGHTS)[0], rng.choice(lab_ids),
+             to_epoch(now - datetime.timedelta(minutes=rng.randint(0, 25))), rng.choice(SESSION_LENGTHS))
+            for student_id in rng.sample(student_ids, args.active)), 'active')
+
+    insert(conn, '''INSERT INTO reservations (student_id, lab_id, purpose, date, start_time, end_time, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+           reservation_rows(rng, days, args.reservations, student_ids, lab_ids, today), 'reservations')
+    insert(conn, 'INSERT INTO feedback (student_id, lab_id, message, date_submitted) VALUES (?, ?, ?, ?)',
+           feedback_rows(rng, days, args.feedback, student_ids, lab_ids), 'feedback')
+    insert(conn, 'INSERT INTO announcements (content, posted_by, date_posted) VALUES (?, ?, ?)',
+           (('Laboratory schedule update #%d' % i, 'CCS Admin', str(rng.choice(days))) for i in range(args.announcements)),
+           'announcements')
+
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    rebuild_rollups(conn)
+    for trigger in stamp_triggers('sit_ins'):
+        conn.execute(trigger)
+    conn.execute("UPDATE cache_versions SET version = version + 1, updated_at = strftime('%s', 'now')")
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    print('%-14s %9s      in %6.1fs' % ('rollups', '', time.perf_counter() - started))
+    print('%s: %.1f MB' % (args.database, os.path.getsize(args.database) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+# Process-local cache for small, rarely changing tables. Every cached value is
+# tagged with a version number from the cache_versions table; triggers bump
+# that number on any write to the source table, so a cheap primary-key lookup
+# tells each gunicorn worker whether its copy is still current. The TTL is a
+# backstop for writes made with the triggers missing.
+
+DEFAULT_TTL = int(os.environ.get('CACHE_TTL', 300))
+
+# Tables whose contents are cached, each with a cache_versions row
+CACHED_TABLES = ('laboratories', 'announcements')
+
+# Tables with a version stamp: the cached ones plus those behind conditional
+# (ETag / Last-Modified) responses
+STAMPED_TABLES = CACHED_TABLES + ('students', 'sit_ins', 'reservations', 'feedback')
+
+
+def version_triggers(table):
+    return [
+        '''CREATE TRIGGER IF NOT EXISTS %(t)s_cache_%(op)s AFTER %(op)s ON %(t)s BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = '%(t)s';
+           END''' % {'t': table, 'op': op}
+        for op in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+# Like version_triggers, also recording when the table last changed
+def stamp_triggers(table):
+    return [
+        '''CREATE TRIGGER IF NOT EXISTS %(t)s_cache_%(op)s AFTER %(op)s ON %(t)s BEGIN
+               UPDATE cache_versions SET version = version + 1, updated_at = strftime('%%s', 'now')
+               WHERE name = '%(t)s';
+           END''' % {'t': table, 'op': op}
+        for op in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+# Combined (versions, last change as epoch seconds) of several tables in one query
+def data_stamps(conn, names):
+    rows = conn.execute('SELECT name, version, updated_at FROM cache_versions WHERE name IN (%s) ORDER BY name'
+                        % ', '.join('?' * len(names)), names).fetchall()
+    return [(row['name'], row['version']) for row in rows], max([row['updated_at'] for row in rows] or [0])
+
+
+def data_version(conn, name):
+    row = conn.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+class VersionedCache:
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Return the cached value for key, calling loader() when the source table
+    # changed since it was stored or the TTL ran out
+    def get(self, conn, name, loader, key=None):
+        key = key or name
+        version = data_version(conn, name)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == version and entry[1] > now:
+            return entry[2]
+
+        value = loader()
+        with self._lock:
+            self._entries[key] = (version, now + self.ttl, value)
+        return value
+
+    # Drop this worker's copies derived from a table; other workers notice the
+    # version bump made by the table's triggers
+    def invalidate(self, name):
+        with self._lock:
+            for key in [key for key in self._entries if key == name or key.startswith(name + ':')]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+app_cache = VersionedCache()
@@ -0,0 +1,99 @@
+import collections
+import hashlib
+import io
+import json
+import os
+import threading
+
+# Server-rendered usage charts for report pages and exports. Images are cached
+# per worker under a hash of the chart, its filters and the version stamps of
+# the tables it reads, so an unchanged dashboard or a repeated export reuses
+# the image; the least recently used entries are evicted beyond
+# CHART_CACHE_SIZE. matplotlib is imported on the first render only, as it
+# costs hundreds of milliseconds and tens of MB.
+
+CHART_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Title and palette of each chart, as static/js/chart.js draws them
+CHARTS = {
+    'purpose': ('Programming Languages Distribution',
+                ['#3366CC', '#DC3912', '#FF9900', '#109618', '#990099',
+                 '#0099C6', '#DD4477', '#66AA00', '#B82E2E', '#316395']),
+    'lab': ('Laboratory Usage Distribution',
+            ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF',
+             '#FF9F40', '#C9CBCF', '#7CFC00', '#FFCC99', '#FFB6C1']),
+}
+
+
+def chart_key(kind, fmt, filters, versions):
+    key = json.dumps([kind, fmt, filters, versions], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Pie chart of (label, count) rows as PNG or SVG bytes. A bare Figure draws
+# through the Agg canvas without pyplot's global figure state.
+def render_chart(kind, rows, fmt):
+    from matplotlib.figure import Figure
+
+    title, colors = CHARTS[kind]
+    rows = [(label, count) for label, count in rows if count]
+    figure = Figure(figsize=(6, 4), dpi=100)
+    axes = figure.add_subplot()
+    axes.set_title(title)
+    if rows:
+        axes.pie([count for label, count in rows], colors=[colors[i % len(colors)] for i in range(len(rows))],
+                 wedgeprops={'edgecolor': 'white', 'linewidth': 1})
+        axes.legend(['%s (%d)' % row for row in rows], loc='center left', bbox_to_anchor=(1, 0.5), fontsize='small')
+    else:
+        axes.text(0.5, 0.5, 'No sit-ins', ha='center', va='center')
+        axes.set_axis_off()
+    axes.set_aspect('equal')
+
+    output = io.BytesIO()
+    figure.savefig(output, format=fmt, bbox_inches='tight', metadata={'Date': None} if fmt == 'svg' else None)
+    return output.getvalue()
+
+
+class ChartCache:
+    def __init__(self):
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # matplotlib is not thread-safe, so renders take turns
+        self._render_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('CHART_CACHE_SIZE', int(os.environ.get('CHART_CACHE_SIZE', 256)))
+        app.extensions['chart_cache'] = self
+        self.size = app.config['CHART_CACHE_SIZE']
+
+    def _lookup(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+            return image
+
+    # Cached image for key, calling render() on a miss
+    def get(self, key, render):
+        image = self._lookup(key)
+        if image is not None:
+            return image
+
+        with self._render_lock:
+            # Another request may have rendered it while this one waited
+            image = self._lookup(key)
+            if image is None:
+                image = render()
+                with self._lock:
+                    self._entries[key] = image
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+chart_cache = ChartCache()
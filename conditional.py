@@ -0,0 +1,82 @@
+import datetime
+import hashlib
+import os
+from functools import wraps
+
+from flask import Response, current_app, make_response, request, session
+
+from cache import data_stamps
+from database import get_db_connection
+
+# Conditional GET for pages and lookups. A response's validator is built from
+# the version stamps of the tables it reads (kept current by triggers), the
+# user it was rendered for and today's date, which defaults several filters.
+# A client presenting a matching ETag, or a Last-Modified date no older than
+# the last change, gets a 304 after one primary-key read of cache_versions:
+# the view, its queries and the rendering are skipped.
+
+# Templates are part of every rendered response; their newest mtime stands in
+# for the deployed code version so a release invalidates old validators
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+CODE_STAMP = str(max(
+    [os.path.getmtime(__file__)] +
+    [os.path.getmtime(os.path.join(dirpath, name))
+     for dirpath, dirnames, filenames in os.walk(os.path.join(_ROOT, 'templates')) for name in filenames]
+))
+
+
+def make_etag(versions):
+    # The asset manifest changes the URLs pages link to after a rebuild
+    assets = sorted(current_app.extensions.get('assets', {}).items())
+    key = repr((versions, session.get('user_id'), session.get('user_role'),
+                datetime.date.today().isoformat(), CODE_STAMP, assets))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag, last_modified):
+    # If-None-Match takes precedence; If-Modified-Since only counts without it
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return request.if_modified_since is not None and request.if_modified_since >= last_modified
+
+
+# Serve GET responses of the view conditionally on the given tables. max_age
+# lets the browser reuse a response without asking for that many seconds;
+# by default it revalidates every time. Views that answer with JSON or images
+# pass renders_flashes=False, as a pending flash only matters to pages.
+def conditional(*tables, max_age=0, renders_flashes=True):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            # A pending flash message is rendered into the next page, which
+            # must not be answered from the browser's cache
+            if renders_flashes and session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            versions, updated_at = data_stamps(get_db_connection(), list(tables))
+            etag = make_etag(versions)
+            # Midnight counts as a change too, for the date-defaulted filters
+            midnight = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+            last_modified = datetime.datetime.fromtimestamp(max(updated_at, midnight), datetime.timezone.utc)
+
+            if not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            if max_age:
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
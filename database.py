@@ -0,0 +1,237 @@
+import os
+import queue
+import sqlite3
+import time
+
+from flask import current_app, g, has_app_context
+
+# Defaults, overridable through app.config or the environment. DATABASE is a
+# SQLite file path or a postgresql:// URL (see postgres.py).
+DEFAULT_DATABASE = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_PATH', 'sitin_system.db')
+DEFAULT_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+DEFAULT_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+DEFAULT_CACHED_STATEMENTS = int(os.environ.get('SQLITE_CACHED_STATEMENTS', 256))
+
+
+# Open a tuned connection: WAL lets readers run alongside the single writer,
+# busy_timeout makes writers wait for the lock instead of failing immediately
+# and synchronous=NORMAL is durable enough in WAL mode while skipping an fsync
+# per commit.
+def open_db_connection(database=None, busy_timeout=None, cached_statements=None):
+    database = database or DEFAULT_DATABASE
+    if is_postgres_url(database):
+        from postgres import connect
+        return connect(database, busy_timeout if busy_timeout is not None else DEFAULT_BUSY_TIMEOUT)
+
+    conn = sqlite3.connect(
+        database,
+        timeout=(busy_timeout if busy_timeout is not None else DEFAULT_BUSY_TIMEOUT) / 1000,
+        cached_statements=cached_statements or DEFAULT_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA busy_timeout = %d' % (busy_timeout if busy_timeout is not None else DEFAULT_BUSY_TIMEOUT))
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+def is_postgres_url(database):
+    return database.startswith(('postgresql://', 'postgres://'))
+
+
+# 'sqlite' or 'postgresql', for the few queries written per backend
+def backend(conn):
+    return getattr(conn, 'backend', 'sqlite')
+
+
+# Open the write transaction of a lab change. SQLite has a single writer, so
+# this is BEGIN IMMEDIATE. PostgreSQL locks rows, so the transaction only
+# waits for writers holding one of the same keys, or for maintenance run
+# under BEGIN IMMEDIATE (see PostgresConnection.begin_keyed).
+def begin_write(conn, keys=()):
+    if backend(conn) == 'postgresql':
+        conn.begin_keyed(keys)
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+# Pool of idle connections shared by the requests served by one worker process
+class ConnectionPool:
+    def __init__(self, database, size, busy_timeout, cached_statements, on_open=None):
+        self.database = database
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.on_open = on_open
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            # A PostgreSQL server may have dropped an idle connection
+            if not getattr(conn, 'closed', False):
+                return conn
+
+        started = time.perf_counter()
+        conn = open_db_connection(self.database, self.busy_timeout, self.cached_statements)
+        if self.on_open is not None:
+            self.on_open(time.perf_counter() - started)
+        return conn
+
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+
+        if self.size <= 0:
+            conn.close()
+            return
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def get_pool(app=None):
+    app = app or current_app
+    pool = app.extensions.get('sqlite_pool')
+
+    # A forked gunicorn worker must not reuse connections opened by its parent
+    if pool is None or pool.pid != os.getpid():
+        pool = ConnectionPool(app.config['DATABASE'],
+                              app.config['SQLITE_POOL_SIZE'],
+                              app.config['SQLITE_BUSY_TIMEOUT'],
+                              app.config['SQLITE_CACHED_STATEMENTS'],
+                              app.extensions.get('sqlite_on_open'))
+        app.extensions['sqlite_pool'] = pool
+
+    return pool
+
+
+# Proxy for a request connection that times each statement and hands it to
+# the observers in app.extensions['sqlite_observers'], called as
+# observer(conn, sql, parameters, seconds). A query is timed until its rows
+# are first fetched, since sqlite does the scanning and sorting there.
+class InstrumentedConnection:
+    def __init__(self, conn, observers):
+        self.wrapped = conn
+        self.observers = observers
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def report(self, sql, parameters, seconds):
+        self.queries += 1
+        self.query_seconds += seconds
+        for observer in self.observers:
+            observer(self, sql, parameters, seconds)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        cursor = self.wrapped.execute(sql, parameters)
+        seconds = time.perf_counter() - started
+        if cursor.description is None:
+            self.report(sql, parameters, seconds)
+            return cursor
+        return TimedCursor(self, cursor, sql, parameters, seconds)
+
+    def executemany(self, sql, parameters):
+        return self._timed(sql, self.wrapped.executemany, sql, parameters)
+
+    def executescript(self, sql):
+        return self._timed(sql, self.wrapped.executescript, sql)
+
+    def commit(self):
+        return self._timed('COMMIT', self.wrapped.commit)
+
+    def _timed(self, sql, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.report(sql, None, time.perf_counter() - started)
+        return result
+
+    def __enter__(self):
+        return self.wrapped.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.wrapped.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+# Cursor of an instrumented query; reports it on the first fetch
+class TimedCursor:
+    def __init__(self, conn, cursor, sql, parameters, seconds):
+        self.conn = conn
+        self.cursor = cursor
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = seconds
+        self.pending = True
+
+    def _fetch(self, fn, *args):
+        if not self.pending:
+            return fn(*args)
+        started = time.perf_counter()
+        result = fn(*args)
+        self.pending = False
+        self.conn.report(self.sql, self.parameters, self.seconds + time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self.cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self.cursor.fetchmany, size or self.cursor.arraysize)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+    # Rows read by iterating are not timed; the CSV export streams this way
+    def __iter__(self):
+        self._fetch(lambda: None)
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+# Request-scoped connection: every call within the same app context shares one
+# connection, which goes back to the pool on teardown. Outside an app context
+# (scripts, init_db) a standalone connection is returned and the caller closes it.
+def get_db_connection():
+    if not has_app_context():
+        return open_db_connection()
+
+    if 'db' not in g:
+        conn = get_pool().acquire()
+        observers = current_app.extensions.get('sqlite_observers')
+        g.db = InstrumentedConnection(conn, observers) if observers else conn
+    return g.db
+
+
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(getattr(conn, 'wrapped', conn))
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', DEFAULT_DATABASE)
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', DEFAULT_BUSY_TIMEOUT)
+    app.config.setdefault('SQLITE_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('SQLITE_CACHED_STATEMENTS', DEFAULT_CACHED_STATEMENTS)
+    app.teardown_appcontext(release_db_connection)
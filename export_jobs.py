@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Background export jobs. Excel/HTML reports are rendered by a thread pool into
+# EXPORT_RESULTS_DIR. Each job keeps its state in a JSON file next to the
+# artifact, so any gunicorn worker can report progress or serve the download,
+# and the job ID is a hash of the filters and the data version, so identical
+# requests share one job while the data is unchanged; a check-in or checkout
+# since gives a new job rather than the stale result.
+
+# Artifact extension and mimetype per export format
+JOB_FORMATS = {
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': ('html', 'text/html'),
+}
+
+# Minimum seconds between progress writes of a running job
+PROGRESS_INTERVAL = 0.5
+
+
+def job_id_for(format_type, filters, data_version=None):
+    key = json.dumps([format_type, sorted(filters.items()), data_version])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+class ExportJobs:
+    def __init__(self, app=None, runner=None):
+        self.runner = runner
+        self.executor = None
+        self.pid = None
+        if app is not None:
+            self.init_app(app, runner)
+
+    # runner(format_type, filters, path, progress) is called inside an app
+    # context and writes the finished artifact to path
+    def init_app(self, app, runner):
+        app.config.setdefault('EXPORT_RESULTS_DIR', os.path.join(app.instance_path, 'exports'))
+        app.config.setdefault('EXPORT_RESULT_TTL', int(os.environ.get('EXPORT_RESULT_TTL', 3600)))
+        app.config.setdefault('EXPORT_WORKERS', int(os.environ.get('EXPORT_WORKERS', 2)))
+        self.runner = runner
+        app.extensions['export_jobs'] = self
+
+    @property
+    def results_dir(self):
+        return current_app.config['EXPORT_RESULTS_DIR']
+
+    @property
+    def ttl(self):
+        return current_app.config['EXPORT_RESULT_TTL']
+
+    def _executor(self):
+        # Thread pools do not survive a fork; each worker process gets its own
+        if self.executor is None or self.pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=current_app.config['EXPORT_WORKERS'],
+                                               thread_name_prefix='export')
+            self.pid = os.getpid()
+        return self.executor
+
+    def _status_path(self, job_id):
+        return os.path.join(self.results_dir, job_id + '.json')
+
+    def artifact_path(self, job):
+        extension = JOB_FORMATS[job['format']][0]
+        return os.path.join(self.results_dir, '%s.%s' % (job['id'], extension))
+
+    def _write(self, job):
+        job['updated_at'] = time.time()
+        path = self._status_path(job['id'])
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+    def status(self, job_id):
+        try:
+            with open(self._status_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _expired(self, job):
+        return time.time() - job['updated_at'] > self.ttl
+
+    # data_version is any JSON value that changes with the exported data
+    def submit(self, format_type, filters, data_version=None):
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.cleanup()
+
+        job_id = job_id_for(format_type, filters, data_version)
+        job = {
+            'id': job_id,
+            'format': format_type,
+            'filters': filters,
+            'status': 'queued',
+            'progress': 0,
+            'error': None,
+            'created_at': time.time(),
+        }
+
+        for _ in range(2):
+            # Creating the status file exclusively claims the job across workers
+            try:
+                fd = os.open(self._status_path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                existing = self.status(job_id)
+                if existing and existing['status'] != 'failed' and not self._expired(existing):
+                    return existing
+                self._remove(job_id)
+                continue
+
+            os.close(fd)
+            self._write(job)
+            self._executor().submit(self._run, current_app._get_current_object(), dict(job))
+            return job
+
+        return self.status(job_id) or job
+
+    def _run(self, app, job):
+        with app.app_context():
+            job['status'] = 'running'
+            self._write(job)
+            last_write = [time.monotonic()]
+
+            def progress(done, total):
+                now = time.monotonic()
+                if now - last_write[0] >= PROGRESS_INTERVAL:
+                    # Rendering the file takes the last 10%
+                    job['progress'] = int(90 * done / total) if total else 90
+                    self._write(job)
+                    last_write[0] = now
+
+            path = self.artifact_path(job)
+            tmp = path + '.tmp'
+            try:
+                self.runner(job['format'], job['filters'], tmp, progress)
+                os.replace(tmp, path)
+            except Exception as e:
+                logger.exception('Export job %s failed', job['id'])
+                job['status'] = 'failed'
+                job['error'] = str(e)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            else:
+                job['status'] = 'done'
+                job['progress'] = 100
+            self._write(job)
+
+    def _remove(self, job_id):
+        for name in os.listdir(self.results_dir):
+            if name.startswith(job_id + '.'):
+                try:
+                    os.remove(os.path.join(self.results_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    # Drop artifacts and job state older than the TTL
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.results_dir):
+            path = os.path.join(self.results_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
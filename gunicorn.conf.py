@@ -0,0 +1,13 @@
+import os
+
+# gunicorn reads this file from the working directory: gunicorn main:app
+#
+# Threaded workers, so a sit-in board holding its Server-Sent Events stream
+# open occupies one thread rather than a whole worker. With the default sync
+# worker every open board would block a worker; /sit-in/events falls back to
+# short polling there.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
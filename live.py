@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from database import open_db_connection
+from timestamps import format_epoch
+
+logger = logging.getLogger(__name__)
+
+# Live sit-in board. Triggers on sit_ins append check-in and checkout rows to
+# sit_in_events; one poller thread per worker watches PRAGMA data_version on its
+# own connection, reads only the new event rows when something was committed
+# and fans them out to every connected Server-Sent Events stream. Clients never
+# query the database themselves.
+
+EVENTS_DDL = [
+    '''CREATE TABLE IF NOT EXISTS sit_in_events (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           sit_in_id INTEGER NOT NULL,
+           lab_id INTEGER NOT NULL,
+           kind TEXT NOT NULL,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+       )''',
+    '''CREATE TRIGGER IF NOT EXISTS sit_in_events_check_in AFTER INSERT ON sit_ins
+       WHEN new.status = 'active' BEGIN
+           INSERT INTO sit_in_events (sit_in_id, lab_id, kind) VALUES (new.id, new.lab_id, 'check_in');
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS sit_in_events_checkout AFTER UPDATE OF status ON sit_ins
+       WHEN old.status = 'active' AND new.status != 'active' BEGIN
+           INSERT INTO sit_in_events (sit_in_id, lab_id, kind) VALUES (new.id, new.lab_id, 'checkout');
+       END''',
+]
+
+# Seconds between data_version checks, and between keep-alive comments
+POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 0.5))
+HEARTBEAT_INTERVAL = 15
+
+# Event rows kept for clients catching up after a reconnect
+EVENT_RETENTION = 10000
+
+# Events buffered per client before a slow client is dropped; the browser
+# reconnects and catches up from its Last-Event-ID
+SUBSCRIBER_BUFFER = 1000
+
+
+def latest_event_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM sit_in_events').fetchone()[0]
+
+
+# Event rows after after_id, with the details the board needs for new rows
+def load_events(conn, after_id, limit=500):
+    rows = conn.execute('''
+        SELECT e.id as event_id, e.kind, e.sit_in_id, e.lab_id,
+               s.student_id, st.name, s.purpose, l.name as lab_name,
+               s.login_time, s.session_remaining
+        FROM sit_in_events e
+        JOIN sit_ins s ON s.id = e.sit_in_id
+        LEFT JOIN students st ON st.id = s.student_id
+        LEFT JOIN laboratories l ON l.id = e.lab_id
+        WHERE e.id > ?
+        ORDER BY e.id
+        LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+    events = []
+    for row in rows:
+        data = {'id': row['sit_in_id'], 'lab_id': row['lab_id']}
+        if row['kind'] == 'check_in':
+            data.update(student_id=row['student_id'], name=row['name'], purpose=row['purpose'],
+                        lab_name=row['lab_name'], login_time=format_epoch(row['login_time']),
+                        session_remaining=row['session_remaining'])
+        events.append((row['event_id'], row['kind'], data))
+    return events
+
+
+def lab_occupancy(conn):
+    rows = conn.execute('''
+        SELECT lab_id, COUNT(*) as count
+        FROM sit_ins
+        WHERE status = 'active'
+        GROUP BY lab_id
+    ''').fetchall()
+    return {str(row['lab_id']): row['count'] for row in rows}
+
+
+def format_event(kind, data, event_id=None):
+    message = ''
+    if event_id is not None:
+        message += 'id: %d\n' % event_id
+    return message + 'event: %s\ndata: %s\n\n' % (kind, json.dumps(data))
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, database):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            # The poller thread does not survive a fork, nor does it outlive
+            # its last subscriber. Its starting point is read here, before the
+            # caller loads its catch-up, so no event falls between the two.
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                conn = open_db_connection(database)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._poll, args=(conn, latest_event_id(conn)),
+                                                name='sit-in-events', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _broadcast(self, messages):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                for message in messages:
+                    subscriber.put_nowait(message)
+            except queue.Full:
+                # Drop the slow client; None tells its stream to end
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def _poll(self, conn, last_id):
+        data_version = None
+        pruned_id = last_id
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+
+                # data_version only moves when another connection commits
+                version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if version != data_version:
+                    data_version = version
+                    events = load_events(conn, last_id)
+                    if events:
+                        last_id = events[-1][0]
+                        messages = [(event_id, format_event(kind, data, event_id)) for event_id, kind, data in events]
+                        messages.append((last_id, format_event('occupancy', lab_occupancy(conn))))
+                        self._broadcast(messages)
+
+                    if last_id - pruned_id >= 1000:
+                        conn.execute('DELETE FROM sit_in_events WHERE id <= ?', (last_id - EVENT_RETENTION,))
+                        conn.commit()
+                        pruned_id = last_id
+
+                time.sleep(POLL_INTERVAL)
+        except Exception:
+            logger.exception('Sit-in event poller stopped')
+        finally:
+            conn.close()
+
+    # Events a client missed since its last event ID, the ID it has then
+    # seen and the current occupancy
+    def _catch_up(self, database, since):
+        conn = open_db_connection(database)
+        try:
+            if since is None:
+                after_id, catch_up = latest_event_id(conn), []
+            else:
+                catch_up = load_events(conn, since)
+                after_id = catch_up[-1][0] if catch_up else since
+            return after_id, catch_up, lab_occupancy(conn)
+        finally:
+            conn.close()
+
+    # Yield SSE messages for one client: the events it missed since its last
+    # event ID and the current occupancy, then live events with keep-alive
+    # comments in between. Ends after max_seconds so a stream does not pin a
+    # worker forever; EventSource reconnects with its Last-Event-ID.
+    def stream(self, database, since, max_seconds):
+        subscriber = self.subscribe(database)
+        deadline = time.monotonic() + max_seconds
+        try:
+            after_id, catch_up, occupancy = self._catch_up(database, since)
+
+            yield 'retry: 3000\n\n'
+            if len(catch_up) >= 500:
+                # Too far behind to replay; the page reloads the board instead
+                yield format_event('reload', {})
+                return
+            for event_id, kind, data in catch_up:
+                yield format_event(kind, data, event_id)
+            yield format_event('occupancy', occupancy)
+
+            while time.monotonic() < deadline:
+                try:
+                    item = subscriber.get(timeout=min(HEARTBEAT_INTERVAL, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+
+                if item is None:
+                    return
+                event_id, message = item
+                # Skip events already sent during catch-up
+                if event_id > after_id:
+                    after_id = event_id
+                    yield message
+                elif message.startswith('event: occupancy'):
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    # Short-polling variant of stream() for servers that handle one request
+    # per worker at a time: send what the client missed and end the response,
+    # asking EventSource to reconnect after retry_seconds. The occupancy
+    # event carries the last event ID, so the next request resumes from it.
+    def poll(self, database, since, retry_seconds):
+        after_id, catch_up, occupancy = self._catch_up(database, since)
+
+        yield 'retry: %d\n\n' % (retry_seconds * 1000)
+        if len(catch_up) >= 500:
+            yield format_event('reload', {})
+            return
+        for event_id, kind, data in catch_up:
+            yield format_event(kind, data, event_id)
+        yield format_event('occupancy', occupancy, after_id)
+
+
+change_feed = ChangeFeed()
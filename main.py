@@ -1,7 +1,9 @@
-from app import app, init_db
+from app import create_app, init_db
+
+app = create_app()
 
 # Initialize database
-init_db()
+init_db(app)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,263 @@
+import functools
+import glob
+import hmac
+import json
+import os
+import re
+import threading
+import time
+
+from flask import Response, current_app, g, request, session
+
+from database import InstrumentedConnection
+
+# Request and SQL instrumentation exposed in Prometheus text format. Each
+# worker process keeps its own histograms and writes them every few seconds
+# to METRICS_DIR/<pid>.json; /metrics merges the files of all workers, so
+# whichever worker answers the scrape reports for the whole server. Files of
+# exited workers are kept so counts never go backwards.
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+CONNECT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+# name: (help, label names, buckets)
+HISTOGRAMS = {
+    'sitin_http_request_duration_seconds': (
+        'Time from request start until the response was fully sent',
+        ('endpoint', 'method', 'status'), REQUEST_BUCKETS),
+    'sitin_http_response_size_bytes': (
+        'Response body size, for responses with a known length',
+        ('endpoint',), SIZE_BUCKETS),
+    'sitin_db_query_duration_seconds': (
+        'Time spent executing SQL statements until their rows are first fetched',
+        ('operation', 'table'), QUERY_BUCKETS),
+    'sitin_db_queries_per_request': (
+        'SQL statements executed while handling one request',
+        ('endpoint',), COUNT_BUCKETS),
+    'sitin_db_time_per_request_seconds': (
+        'Total SQL time of one request',
+        ('endpoint',), REQUEST_BUCKETS),
+    'sitin_db_connection_open_seconds': (
+        'Time to open and configure a new SQLite connection',
+        (), CONNECT_BUCKETS),
+}
+
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._dirty = False
+
+    # Record value in the named histogram; the stored list holds one count per
+    # bucket (not cumulative), then the sum and the total count
+    def observe(self, name, value, labels=()):
+        buckets = HISTOGRAMS[name][2]
+        key = (name, tuple(labels))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            index = len(buckets)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    index = i
+                    break
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return [[name, list(labels), list(entry)] for (name, labels), entry in self._values.items()]
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+
+registry = Registry()
+
+
+# Main table of a statement, for the query histogram labels
+@functools.lru_cache(maxsize=1024)
+def statement_labels(sql):
+    match = re.match(r'\s*(\w+)', sql)
+    operation = match.group(1).upper() if match else 'OTHER'
+    patterns = {
+        'SELECT': r'\bFROM\s+(\w+)',
+        'INSERT': r'\bINTO\s+(\w+)',
+        'UPDATE': r'^\s*UPDATE\s+(?:OR\s+\w+\s+)?(\w+)',
+        'DELETE': r'\bFROM\s+(\w+)',
+        'PRAGMA': r'^\s*PRAGMA\s+(\w+)',
+        'WITH': r'\bFROM\s+(\w+)',
+    }
+    table = re.search(patterns[operation], sql, re.I) if operation in patterns else None
+    return operation, table.group(1).lower() if table else ''
+
+
+def observe_statement(conn, sql, parameters, seconds):
+    registry.observe('sitin_db_query_duration_seconds', seconds, statement_labels(sql))
+
+
+def observe_connection_open(seconds):
+    registry.observe('sitin_db_connection_open_seconds', seconds)
+
+
+def write_snapshot(directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def merged_values(directory):
+    merged = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, entry in entries:
+            if name not in HISTOGRAMS:
+                continue
+            key = (name, tuple(labels))
+            total = merged.setdefault(key, [0] * len(entry))
+            for i, value in enumerate(entry):
+                total[i] += value
+    return merged
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def render(merged, extra_lines=()):
+    lines = []
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for (entry_name, labels), entry in sorted(merged.items()):
+            if entry_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], entry[:-2]):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, format_labels(label_names, labels, [('le', bound)]),
+                                                 cumulative))
+            lines.append('%s_sum%s %.6f' % (name, format_labels(label_names, labels), entry[-2]))
+            lines.append('%s_count%s %d' % (name, format_labels(label_names, labels), entry[-1]))
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    def __init__(self):
+        self.directory = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    # METRICS_DIR holds the per-worker files; METRICS_TOKEN, when set, is the
+    # bearer token scrapers must send (otherwise /metrics answers loopback
+    # clients and signed-in admins only)
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '1') == '1')
+        app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR',
+                                                            os.path.join(app.instance_path, 'metrics')))
+        app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        self.directory = app.config['METRICS_DIR']
+        app.extensions.setdefault('sqlite_observers', []).append(observe_statement)
+        app.extensions['sqlite_on_open'] = observe_connection_open
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    # Extra exposition lines computed at scrape time, e.g. from the database
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        self._ensure_flusher()
+
+    def _after_request(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+
+        endpoint = request.endpoint or 'unmatched'
+        method, status = request.method, str(response.status_code)
+        conn = g.get('db')
+        size = response.content_length if not response.is_streamed else None
+
+        # Streamed bodies (CSV export, event streams) keep querying after this
+        # hook; everything is recorded once the server has sent the last byte
+        def record():
+            registry.observe('sitin_http_request_duration_seconds', time.perf_counter() - started,
+                             (endpoint, method, status))
+            if size is not None:
+                registry.observe('sitin_http_response_size_bytes', size, (endpoint,))
+            if isinstance(conn, InstrumentedConnection) and conn.queries:
+                registry.observe('sitin_db_queries_per_request', conn.queries, (endpoint,))
+                registry.observe('sitin_db_time_per_request_seconds', conn.query_seconds, (endpoint,))
+
+        response.call_on_close(record)
+        return response
+
+    # Threads do not survive a fork; each worker starts its own flusher
+    def _ensure_flusher(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            if registry.dirty:
+                try:
+                    write_snapshot(self.directory)
+                except OSError:
+                    pass
+
+    def _allowed(self):
+        token = current_app.config['METRICS_TOKEN']
+        if token:
+            return hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token)
+        return request.remote_addr in ('127.0.0.1', '::1') or session.get('user_role') == 'admin'
+
+    def metrics_view(self):
+        if not self._allowed():
+            return Response('Forbidden\n', status=403, mimetype='text/plain')
+        write_snapshot(self.directory)
+        extra = []
+        for fn in self._collectors:
+            extra.extend(fn())
+        return Response(render(merged_values(self.directory), extra),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics = Metrics()
@@ -0,0 +1,187 @@
+import logging
+
+from archive import ARCHIVED_ROLLUPS_DDL, ARCHIVED_SEMESTERS_DDL
+from auto_checkout import BACKGROUND_TASKS_DDL
+from cache import CACHED_TABLES, STAMPED_TABLES, stamp_triggers, version_triggers
+from database import backend
+from live import EVENTS_DDL
+from reservations import RESERVATION_INDEXES
+from rollups import ROLLUP_DDL, rebuild_rollups
+from slow_queries import SLOW_QUERIES_DDL, SLOW_QUERY_INDEXES
+from timestamps import EPOCH_CONVERSION
+
+logger = logging.getLogger(__name__)
+
+# Before one-active-session-per-student is enforced, close all but the newest
+# active sit-in of each student, logged out when the newer one started
+def close_duplicate_active_sit_ins(conn):
+    cursor = conn.execute('''
+        UPDATE sit_ins
+        SET status = 'completed',
+            logout_time = (SELECT MIN(n.login_time) FROM sit_ins n
+                           WHERE n.student_id = sit_ins.student_id AND n.status = 'active' AND n.id > sit_ins.id)
+        WHERE status = 'active' AND EXISTS (
+            SELECT 1 FROM sit_ins n
+            WHERE n.student_id = sit_ins.student_id AND n.status = 'active' AND n.id > sit_ins.id
+        )
+    ''')
+    if cursor.rowcount:
+        logger.warning('Closed %d duplicate active sit-ins', cursor.rowcount)
+        rebuild_rollups(conn)
+
+
+# Sit-in times become integer epoch seconds (see timestamps.py) and checkouts
+# store the session length. SQLite converts the values in place; PostgreSQL
+# changes the column types, which rebuilds the indexes on them.
+def store_epoch_seconds(conn):
+    if backend(conn) == 'postgresql':
+        for table, columns in (('sit_ins', ('login_time', 'logout_time')),
+                               ('archived_semesters', ('first_login', 'last_login'))):
+            conn.execute('ALTER TABLE %s %s' % (table, ', '.join(
+                'ALTER COLUMN %s TYPE BIGINT USING CAST(EXTRACT(EPOCH FROM CAST(%s AS timestamp)) AS BIGINT)'
+                % (column, column) for column in columns)))
+        conn.execute('ALTER TABLE sit_ins ADD COLUMN duration_seconds BIGINT')
+        conn.execute('UPDATE sit_ins SET duration_seconds = logout_time - login_time')
+        return
+
+    conn.execute('ALTER TABLE sit_ins ADD COLUMN duration_seconds INTEGER')
+    conn.execute(EPOCH_CONVERSION % {'table': 'sit_ins'})
+    conn.execute('''
+        UPDATE archived_semesters
+        SET first_login = CAST(strftime('%s', first_login) AS INTEGER),
+            last_login = CAST(strftime('%s', last_login) AS INTEGER)
+    ''')
+
+
+# The sweeper's last_run_at moves to epoch seconds as well
+def store_sweep_time_as_epoch(conn):
+    if backend(conn) == 'postgresql':
+        conn.execute('ALTER TABLE background_tasks ALTER COLUMN last_run_at TYPE BIGINT '
+                     'USING CAST(EXTRACT(EPOCH FROM CAST(last_run_at AS timestamp)) AS BIGINT)')
+    else:
+        conn.execute("UPDATE background_tasks SET last_run_at = CAST(strftime('%s', last_run_at) AS INTEGER)")
+
+
+# Schema migrations, applied in order by init_db() and tracked through
+# PRAGMA user_version. Each entry is (version, description, steps) where a step
+# is either an SQL string or a callable taking the connection. Append new
+# versions at the end and never edit one that has already shipped.
+MIGRATIONS = [
+    (1, 'indexes for hot sit-in, reservation and feedback queries', [
+        # Active board and home counts: status = 'active' ordered by login_time
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_status_login ON sit_ins (status, login_time)',
+        # Per-student active check and recent activity lookups
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_student_status ON sit_ins (student_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_student_login ON sit_ins (student_id, login_time)',
+        # Date range reports and per-day charts; covers lab_id/purpose grouping
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_login_lab_purpose ON sit_ins (login_time, lab_id, purpose)',
+        # GROUP BY purpose over all history without a temp B-tree
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_purpose ON sit_ins (purpose)',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_date_start ON reservations (date, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_feedback_lab_date ON feedback (lab_id, date_submitted)',
+        'CREATE INDEX IF NOT EXISTS idx_feedback_date ON feedback (date_submitted)',
+        'CREATE INDEX IF NOT EXISTS idx_announcements_date ON announcements (date_posted)',
+    ]),
+    (2, 'full-text search index over students', [
+        # External-content FTS5 table: the index lives here, the rows stay in
+        # students. Prefix indexes make typeahead queries like "jo*" cheap.
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+               id, name, program,
+               content='students', content_rowid='id',
+               prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN
+               INSERT INTO students_fts (rowid, id, name, program)
+               VALUES (new.id, new.id, new.name, new.program);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN
+               INSERT INTO students_fts (students_fts, rowid, id, name, program)
+               VALUES ('delete', old.id, old.id, old.name, old.program);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE OF id, name, program ON students BEGIN
+               INSERT INTO students_fts (students_fts, rowid, id, name, program)
+               VALUES ('delete', old.id, old.id, old.name, old.program);
+               INSERT INTO students_fts (rowid, id, name, program)
+               VALUES (new.id, new.id, new.name, new.program);
+           END''',
+        "INSERT INTO students_fts (students_fts) VALUES ('rebuild')",
+    ]),
+    (3, 'daily usage rollups per lab and purpose', [
+        ROLLUP_DDL,
+        rebuild_rollups,
+    ]),
+    (4, 'version counters for cached tables', [
+        '''CREATE TABLE IF NOT EXISTS cache_versions (
+               name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )''',
+    ] + [
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('%s', 0)" % table
+        for table in CACHED_TABLES
+    ] + [
+        trigger for table in CACHED_TABLES for trigger in version_triggers(table)
+    ]),
+    (5, 'keyset pagination indexes', [
+        # (login_time) and (date_submitted) end in the implicit rowid, giving
+        # the (timestamp, id) order the report pages walk
+        'CREATE INDEX IF NOT EXISTS idx_sit_ins_login ON sit_ins (login_time)',
+    ]),
+    (6, 'sit-in change feed for the live board', EVENTS_DDL),
+    (7, 'reservation slot indexes for conflict checks', RESERVATION_INDEXES),
+    (8, 'leases and counters for background tasks', BACKGROUND_TASKS_DDL),
+    (9, 'one active sit-in per student', [
+        close_duplicate_active_sit_ins,
+        # Check-in relies on this index: its INSERT ... ON CONFLICT DO NOTHING
+        # is what rejects a second active session, race or not
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sit_ins_one_active ON sit_ins (student_id) WHERE status = 'active'",
+    ]),
+    (10, 'version stamps for conditional responses', [
+        'ALTER TABLE cache_versions ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0',
+        "UPDATE cache_versions SET updated_at = strftime('%s', 'now')",
+    ] + [
+        'DROP TRIGGER IF EXISTS %s_cache_%s' % (table, op)
+        for table in CACHED_TABLES for op in ('INSERT', 'UPDATE', 'DELETE')
+    ] + [
+        "INSERT OR IGNORE INTO cache_versions (name, version, updated_at) VALUES ('%s', 0, strftime('%%s', 'now'))"
+        % table for table in STAMPED_TABLES
+    ] + [
+        trigger for table in STAMPED_TABLES for trigger in stamp_triggers(table)
+    ]),
+    (11, 'slow-query log', [SLOW_QUERIES_DDL] + SLOW_QUERY_INDEXES),
+    (12, 'manifest and saved rollups of archived semesters', [ARCHIVED_SEMESTERS_DDL, ARCHIVED_ROLLUPS_DDL]),
+    # Archive files are converted when next attached (archive.upgrade_archive)
+    (13, 'epoch-second sit-in times and stored durations', [store_epoch_seconds]),
+    (14, 'epoch-second auto-checkout run times', [store_sweep_time_as_epoch]),
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    current = schema_version(conn)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info('Applying schema migration %d: %s', version, description)
+
+        # Each version is applied atomically together with its user_version bump
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('PRAGMA user_version = %d' % version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        current = version
+
+    return current
@@ -0,0 +1,100 @@
+import base64
+import json
+
+from flask import request, url_for
+
+# Keyset pagination. Listings are ordered by a unique key such as
+# (login_time, id); a page continues from the key of the last (or first) row
+# shown, so each page is an index range scan however deep the user goes,
+# unlike OFFSET which reads and discards every earlier row.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def page_size(args):
+    try:
+        size = int(args.get('per_page', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class Page:
+    def __init__(self, rows, total, per_page, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.total = total
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+# Fetch one page of query, which must end in a WHERE clause (without ORDER BY).
+# keys is a list of (column expression, row field) pairs forming a unique sort
+# key; cursors come from the 'after' and 'before' request arguments.
+def paginate(conn, query, params, keys, descending=False, total=None, args=None):
+    args = args if args is not None else request.args
+    per_page = page_size(args)
+    columns = ', '.join(column for column, field in keys)
+
+    after = decode_cursor(args.get('after', ''), len(keys)) if args.get('after') else None
+    before = decode_cursor(args.get('before', ''), len(keys)) if args.get('before') and not after else None
+
+    # Walking backwards flips both the comparison and the sort order
+    backwards = before is not None
+    forward_op, backward_op = ('<', '>') if descending else ('>', '<')
+    order = 'DESC' if descending != backwards else 'ASC'
+
+    params = list(params)
+    if after is not None:
+        query += ' AND (%s) %s (%s)' % (columns, forward_op, ', '.join('?' * len(keys)))
+        params.extend(after)
+    elif before is not None:
+        query += ' AND (%s) %s (%s)' % (columns, backward_op, ', '.join('?' * len(keys)))
+        params.extend(before)
+
+    query += ' ORDER BY ' + ', '.join('%s %s' % (column, order) for column, field in keys)
+    query += ' LIMIT ?'
+    params.append(per_page + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key_of(row):
+        return encode_cursor([row[field] for column, field in keys])
+
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else after is not None
+
+    return Page(rows, total, per_page,
+                next_cursor=key_of(rows[-1]) if rows and has_next else None,
+                prev_cursor=key_of(rows[0]) if rows and has_prev else None)
+
+
+# URL of the current listing with its filters kept and the cursor replaced
+def page_url(after=None, before=None):
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    if after:
+        args['after'] = after
+    if before:
+        args['before'] = before
+    return url_for(request.endpoint, **request.view_args, **args)
@@ -0,0 +1,93 @@
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing off the request thread. scrypt is slow on purpose, so a
+# login storm could otherwise keep every worker busy hashing. Hashes run on a
+# small per-process pool (hashlib releases the GIL, so threaded workers keep
+# serving pages meanwhile); at most PASSWORD_HASH_QUEUE calls may wait for it,
+# and callers beyond that are turned away at once with HasherBusy rather than
+# queueing behind the storm. Stored hashes made with other parameters than
+# PASSWORD_HASH_METHOD are replaced at the next successful login.
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.executor = None
+        self.slots = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    # PASSWORD_HASH_METHOD is a werkzeug method string such as
+    # "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+        app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', 2)))
+        app.config.setdefault('PASSWORD_HASH_QUEUE', int(os.environ.get('PASSWORD_HASH_QUEUE', 16)))
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10)))
+        app.extensions['password_hasher'] = self
+
+    @property
+    def method(self):
+        return current_app.config['PASSWORD_HASH_METHOD']
+
+    def _submit(self, fn, *args):
+        config = current_app.config
+        with self._lock:
+            # Thread pools do not survive a fork; each worker process gets its own
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(max_workers=config['PASSWORD_HASH_WORKERS'],
+                                                   thread_name_prefix='password-hash')
+                self.slots = threading.BoundedSemaphore(config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE'])
+                self.pid = os.getpid()
+            executor, slots = self.executor, self.slots
+
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda future: slots.release())
+
+        try:
+            return future.result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    # Check password against pwhash; returns (matches, new hash or None). The
+    # new hash is set when pwhash was made with outdated parameters.
+    def verify(self, pwhash, password):
+        return self._submit(verify_and_update, pwhash, password, self.method)
+
+
+# The parameters werkzeug writes for method: "scrypt" is stored as
+# "scrypt:32768:8:1", so they are read from a sample hash
+@functools.lru_cache(maxsize=8)
+def stored_method(method):
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash, method):
+    return pwhash.split('$', 1)[0] != stored_method(method)
+
+
+def verify_and_update(pwhash, password, method):
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,507 @@
+import datetime
+import functools
+import re
+import sqlite3
+
+from cache import STAMPED_TABLES
+
+# PostgreSQL backend. open_db_connection() hands out a PostgresConnection when
+# DATABASE is a postgresql:// URL; it mimics the parts of sqlite3.Connection
+# the app uses (execute, executemany, commit, rollback, in_transaction, rows
+# readable by name and position), so routes run unchanged on either backend.
+# Statements are written in SQLite's dialect and translated on the way:
+#
+#   ?                        -> %s (and a literal % -> %%)
+#   "text"                   -> 'text'
+#   LIKE                     -> ILIKE, as SQLite's LIKE ignores ASCII case
+#   strftime('%s', x)        -> epoch seconds of CAST(x AS timestamp)
+#   date(x), datetime(x, m)  -> to_char() of the timestamp plus interval m;
+#                               'unixepoch' reads x as epoch seconds
+#   group_concat(x), ifnull  -> string_agg(), COALESCE
+#   INSERT OR IGNORE         -> INSERT ... ON CONFLICT DO NOTHING
+#   BEGIN IMMEDIATE          -> BEGIN plus a transaction-scoped advisory lock
+#                               over the whole database
+#   PRAGMA user_version      -> the schema_version table
+#   PRAGMA data_version      -> the current snapshot, which moves on commits
+#
+# Like sqlite3, a connection stays in autocommit until a DML statement or an
+# explicit BEGIN opens a transaction. Sit-in times are BIGINT epoch seconds
+# from schema version 13 on; other timestamps are kept as TEXT in SQLite's
+# format with the byte-order "C" collation, so values, comparisons and index
+# order match the SQLite database.
+# The schema below is the SQLite schema as of SCHEMA_VERSION, written for
+# PostgreSQL; later migrations are applied through the translation.
+
+SCHEMA_VERSION = 11
+
+# Key of the advisory lock BEGIN IMMEDIATE takes exclusively, like SQLite's
+# write lock, for migrations and maintenance such as rebuilding rollups. Lab
+# changes opened with database.begin_write() hold it shared, so they run
+# concurrently and only wait for each other on a common key.
+WRITE_LOCK_KEY = 0x5173
+
+UTC_NOW = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+# The students full-text search vector; queries must repeat this expression
+# for the GIN index to be used
+STUDENT_SEARCH_VECTOR = ("setweight(to_tsvector('simple', CAST(id AS text)), 'A') || "
+                         "setweight(to_tsvector('simple', name), 'B') || "
+                         "setweight(to_tsvector('simple', program), 'C')")
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)',
+    'INSERT INTO schema_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM schema_version)',
+    '''CREATE TABLE IF NOT EXISTS users (
+           id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           username TEXT UNIQUE NOT NULL,
+           password TEXT NOT NULL,
+           role TEXT NOT NULL,
+           date_created TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    '''CREATE TABLE IF NOT EXISTS students (
+           id BIGINT PRIMARY KEY,
+           name TEXT NOT NULL,
+           program TEXT NOT NULL,
+           year_level INTEGER,
+           date_registered TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    '''CREATE TABLE IF NOT EXISTS laboratories (
+           id INTEGER PRIMARY KEY,
+           name TEXT NOT NULL,
+           capacity INTEGER NOT NULL,
+           description TEXT
+       )''',
+    '''CREATE TABLE IF NOT EXISTS sit_ins (
+           id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           student_id BIGINT NOT NULL REFERENCES students (id),
+           purpose TEXT NOT NULL,
+           lab_id INTEGER NOT NULL REFERENCES laboratories (id),
+           login_time TEXT COLLATE "C" NOT NULL,
+           logout_time TEXT COLLATE "C",
+           status TEXT DEFAULT 'active',
+           session_remaining INTEGER
+       )''',
+    '''CREATE TABLE IF NOT EXISTS announcements (
+           id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           content TEXT NOT NULL,
+           posted_by TEXT NOT NULL,
+           date_posted TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    '''CREATE TABLE IF NOT EXISTS feedback (
+           id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           student_id BIGINT NOT NULL REFERENCES students (id),
+           lab_id INTEGER NOT NULL REFERENCES laboratories (id),
+           message TEXT NOT NULL,
+           date_submitted TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    '''CREATE TABLE IF NOT EXISTS reservations (
+           id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           student_id BIGINT NOT NULL REFERENCES students (id),
+           lab_id INTEGER NOT NULL REFERENCES laboratories (id),
+           purpose TEXT NOT NULL,
+           date TEXT COLLATE "C" NOT NULL,
+           start_time TEXT COLLATE "C" NOT NULL,
+           end_time TEXT COLLATE "C" NOT NULL,
+           status TEXT DEFAULT 'pending',
+           date_created TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+
+    # Indexes of migrations 1, 5, 7 and 9
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_status_login ON sit_ins (status, login_time)',
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_student_status ON sit_ins (student_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_student_login ON sit_ins (student_id, login_time)',
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_login_lab_purpose ON sit_ins (login_time, lab_id, purpose)',
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_purpose ON sit_ins (purpose)',
+    'CREATE INDEX IF NOT EXISTS idx_sit_ins_login ON sit_ins (login_time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_reservations_date_start ON reservations (date, start_time)',
+    'CREATE INDEX IF NOT EXISTS idx_reservations_lab_slot ON reservations (lab_id, date, start_time, end_time)',
+    'CREATE INDEX IF NOT EXISTS idx_feedback_lab_date ON feedback (lab_id, date_submitted)',
+    'CREATE INDEX IF NOT EXISTS idx_feedback_date ON feedback (date_submitted, id)',
+    'CREATE INDEX IF NOT EXISTS idx_announcements_date ON announcements (date_posted)',
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_sit_ins_one_active ON sit_ins (student_id) WHERE status = 'active'",
+
+    # Full-text search over students, in place of the FTS5 table
+    'CREATE INDEX IF NOT EXISTS idx_students_search ON students USING GIN ((%s))' % STUDENT_SEARCH_VECTOR,
+
+    '''CREATE TABLE IF NOT EXISTS usage_rollups (
+           day TEXT COLLATE "C" NOT NULL,
+           lab_id INTEGER NOT NULL,
+           purpose TEXT NOT NULL,
+           sit_in_count INTEGER NOT NULL DEFAULT 0,
+           completed_count INTEGER NOT NULL DEFAULT 0,
+           total_minutes INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (day, lab_id, purpose)
+       )''',
+
+    '''CREATE TABLE IF NOT EXISTS cache_versions (
+           name TEXT PRIMARY KEY,
+           version BIGINT NOT NULL DEFAULT 0,
+           updated_at BIGINT NOT NULL DEFAULT 0
+       )''',
+] + [
+    "INSERT INTO cache_versions (name, version, updated_at) VALUES ('%s', 0, EXTRACT(EPOCH FROM now())::bigint) "
+    "ON CONFLICT DO NOTHING" % table for table in STAMPED_TABLES
+] + [
+    # One bump per statement rather than per row as in SQLite; statements that
+    # touched no rows leave the stamp alone
+    '''CREATE OR REPLACE FUNCTION bump_cache_version() RETURNS trigger AS $$
+       BEGIN
+           IF EXISTS (SELECT 1 FROM changed) THEN
+               UPDATE cache_versions SET version = version + 1, updated_at = EXTRACT(EPOCH FROM now())::bigint
+               WHERE name = TG_TABLE_NAME;
+           END IF;
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql''',
+] + [
+    'CREATE OR REPLACE TRIGGER %s_cache_%s AFTER %s ON %s REFERENCING %s TABLE AS changed '
+    'FOR EACH STATEMENT EXECUTE FUNCTION bump_cache_version()'
+    % (table, op.lower(), op, table, 'OLD' if op == 'DELETE' else 'NEW')
+    for table in STAMPED_TABLES for op in ('INSERT', 'UPDATE', 'DELETE')
+] + [
+    '''CREATE TABLE IF NOT EXISTS sit_in_events (
+           id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           sit_in_id BIGINT NOT NULL,
+           lab_id INTEGER NOT NULL,
+           kind TEXT NOT NULL,
+           created_at TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    '''CREATE OR REPLACE FUNCTION record_sit_in_event() RETURNS trigger AS $$
+       BEGIN
+           INSERT INTO sit_in_events (sit_in_id, lab_id, kind) VALUES (new.id, new.lab_id, TG_ARGV[0]);
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE TRIGGER sit_in_events_check_in AFTER INSERT ON sit_ins
+       FOR EACH ROW WHEN (new.status = 'active') EXECUTE FUNCTION record_sit_in_event('check_in')''',
+    '''CREATE OR REPLACE TRIGGER sit_in_events_checkout AFTER UPDATE OF status ON sit_ins
+       FOR EACH ROW WHEN (old.status = 'active' AND new.status != 'active')
+       EXECUTE FUNCTION record_sit_in_event('checkout')''',
+
+    '''CREATE TABLE IF NOT EXISTS background_tasks (
+           name TEXT PRIMARY KEY,
+           lease_owner TEXT,
+           lease_expires DOUBLE PRECISION NOT NULL DEFAULT 0,
+           runs INTEGER NOT NULL DEFAULT 0,
+           items_total INTEGER NOT NULL DEFAULT 0,
+           last_items INTEGER NOT NULL DEFAULT 0,
+           last_run_at TEXT COLLATE "C"
+       )''',
+    "INSERT INTO background_tasks (name) VALUES ('auto_checkout') ON CONFLICT DO NOTHING",
+
+    '''CREATE TABLE IF NOT EXISTS slow_queries (
+           id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           fingerprint TEXT NOT NULL,
+           normalized_sql TEXT NOT NULL,
+           param_shapes TEXT NOT NULL,
+           duration_ms NUMERIC NOT NULL,
+           endpoint TEXT,
+           query_plan TEXT,
+           full_scans TEXT NOT NULL DEFAULT '',
+           temp_btrees TEXT NOT NULL DEFAULT '',
+           recorded_at TEXT COLLATE "C" DEFAULT %s
+       )''' % UTC_NOW,
+    'CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint ON slow_queries (fingerprint)',
+    'CREATE INDEX IF NOT EXISTS idx_slow_queries_recorded ON slow_queries (recorded_at)',
+]
+
+
+# Create the tables of a new database, or do nothing if they exist
+def create_schema(conn):
+    cursor = conn.raw.cursor()
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute('SELECT version FROM schema_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+    cursor.execute('BEGIN')
+    cursor.execute('SELECT pg_advisory_xact_lock(%d)' % WRITE_LOCK_KEY)
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.execute('UPDATE schema_version SET version = GREATEST(version, %d)' % SCHEMA_VERSION)
+    cursor.execute('COMMIT')
+
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+PRAGMAS = {
+    'user_version': 'SELECT version FROM schema_version',
+    'data_version': 'SELECT CAST(pg_current_snapshot() AS text)',
+}
+
+STRFTIME_FORMATS = {'%Y': 'YYYY', '%m': 'MM', '%d': 'DD', '%H': 'HH24', '%M': 'MI', '%S': 'SS', '%j': 'DDD'}
+
+
+def string_end(sql, start):
+    quote = sql[start]
+    i = start + 1
+    while True:
+        i = sql.index(quote, i) + 1
+        if i < len(sql) and sql[i] == quote:
+            i += 1
+            continue
+        return i
+
+
+# Arguments of the call whose opening parenthesis is at start, and the index
+# after its closing parenthesis
+def call_arguments(sql, start):
+    args, depth, i, begin = [], 0, start, start + 1
+    while True:
+        c = sql[i]
+        if c in '\'"':
+            i = string_end(sql, i)
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(sql[begin:i].strip())
+                return [arg for arg in args if arg], i + 1
+        elif c == ',' and depth == 1:
+            args.append(sql[begin:i].strip())
+            begin = i + 1
+        i += 1
+
+
+def timestamp(arg, modifiers):
+    if modifiers and modifiers[0].lower() == "'unixepoch'":
+        expr, modifiers = "(to_timestamp(%s) AT TIME ZONE 'UTC')" % arg, modifiers[1:]
+    elif arg.lower() == "'now'":
+        expr = "(now() AT TIME ZONE 'UTC')"
+    else:
+        expr = 'CAST(%s AS timestamp)' % arg
+    for modifier in modifiers:
+        expr = '(%s + CAST(%s AS interval))' % (expr, modifier)
+    return expr
+
+
+def strftime(args):
+    fmt = args[0][1:-1].replace('%%', '%')
+    ts = timestamp(args[1], args[2:])
+    if fmt == '%s':
+        return 'CAST(EXTRACT(EPOCH FROM %s) AS bigint)' % ts
+    pattern = re.sub(r'%[a-zA-Z]', lambda m: STRFTIME_FORMATS.get(m.group(0), m.group(0)), fmt)
+    return "to_char(%s, '%s')" % (ts, pattern)
+
+
+def group_concat(args):
+    distinct = re.match(r'DISTINCT\s+', args[0], re.I)
+    value = args[0][distinct.end():] if distinct else args[0]
+    return 'string_agg(%sCAST(%s AS text), %s)' % ('DISTINCT ' if distinct else '', value,
+                                                    args[1] if len(args) > 1 else "','")
+
+
+FUNCTIONS = {
+    'strftime': strftime,
+    'datetime': lambda args: "to_char(%s, 'YYYY-MM-DD HH24:MI:SS')" % timestamp(args[0], args[1:]),
+    'date': lambda args: "to_char(%s, 'YYYY-MM-DD')" % timestamp(args[0], args[1:]),
+    'group_concat': group_concat,
+    'ifnull': lambda args: 'COALESCE(%s)' % ', '.join(args),
+}
+
+
+def translate_expression(sql):
+    out = []
+    i = 0
+    while i < len(sql):
+        c = sql[i]
+        if c == "'":
+            end = string_end(sql, i)
+            out.append(sql[i:end].replace('%', '%%'))
+            i = end
+        elif c == '"':
+            end = string_end(sql, i)
+            out.append("'%s'" % sql[i + 1:end - 1].replace('""', '"').replace("'", "''").replace('%', '%%'))
+            i = end
+        elif c == '?':
+            out.append('%s')
+            i += 1
+        elif c == '%':
+            out.append('%%')
+            i += 1
+        elif IDENTIFIER.match(sql, i) and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] in '_.')):
+            word = IDENTIFIER.match(sql, i).group(0)
+            after = i + len(word)
+            paren = re.compile(r'\s*\(').match(sql, after)
+            if word.lower() in FUNCTIONS and paren:
+                args, end = call_arguments(sql, paren.end() - 1)
+                out.append(FUNCTIONS[word.lower()]([translate_expression(arg) for arg in args]))
+                i = end
+                continue
+            out.append('ILIKE' if word.upper() == 'LIKE' else word)
+            i = after
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+# (kind, PostgreSQL statement) for a statement in SQLite's dialect
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    sql = sql.strip().rstrip(';').strip()
+    keyword = sql.split(None, 1)[0].upper() if sql else ''
+
+    if keyword == 'PRAGMA':
+        match = re.match(r'PRAGMA\s+(\w+)\s*(?:=\s*(\w+))?$', sql, re.I)
+        name, value = (match.group(1).lower(), match.group(2)) if match else (None, None)
+        if name == 'user_version' and value is not None:
+            return 'dml', 'UPDATE schema_version SET version = %d' % int(value)
+        if name in PRAGMAS and value is None:
+            return 'query', PRAGMAS[name]
+        # journal_mode, busy_timeout, synchronous, optimize... have no counterpart
+        return 'noop', None
+    if keyword in ('BEGIN', 'COMMIT', 'END', 'ROLLBACK') and not re.search(r'\bTO\b', sql, re.I):
+        if keyword == 'BEGIN':
+            return ('begin_immediate' if re.match(r'BEGIN\s+(IMMEDIATE|EXCLUSIVE)', sql, re.I) else 'begin'), None
+        return ('rollback' if keyword == 'ROLLBACK' else 'commit'), None
+
+    statement = translate_expression(sql)
+    if keyword == 'EXPLAIN':
+        return 'query', re.sub(r'^EXPLAIN\s+QUERY\s+PLAN\b', 'EXPLAIN', statement, flags=re.I)
+    if keyword in ('INSERT', 'REPLACE'):
+        ignore = re.match(r'INSERT\s+OR\s+IGNORE\s+', statement, re.I)
+        if ignore:
+            statement = 'INSERT ' + statement[ignore.end():] + ' ON CONFLICT DO NOTHING'
+    if keyword in ('INSERT', 'UPDATE', 'DELETE', 'REPLACE'):
+        return 'dml', statement
+    return 'query', statement
+
+
+# Numeric values (SUM, AVG, ROUND, EXTRACT) come back as int or float like
+# SQLite's, not as Decimal
+def cast_numeric(value, cursor):
+    if value is None:
+        return None
+    return float(value) if '.' in value or 'e' in value.lower() or value.lower() in ('nan', 'infinity') \
+        else int(value)
+
+
+# datetime and date parameters are stored as text, the way sqlite3 adapts them
+def adapt(parameters):
+    if parameters is None:
+        return ()
+    return [value.isoformat(' ') if isinstance(value, datetime.datetime)
+            else value.isoformat() if isinstance(value, datetime.date) else value
+            for value in parameters]
+
+
+class EmptyCursor:
+    description = None
+    rowcount = -1
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size=None):
+        return []
+
+    def __iter__(self):
+        return iter(())
+
+
+class PostgresConnection:
+    backend = 'postgresql'
+
+    def __init__(self, raw, driver):
+        self.raw = raw
+        self.driver = driver
+
+    @property
+    def in_transaction(self):
+        return self.raw.info.transaction_status != 0
+
+    @property
+    def closed(self):
+        return bool(self.raw.closed)
+
+    # Run statement and map driver errors onto sqlite3's exception classes, so
+    # existing handlers work on both backends
+    def _run(self, run, statement, parameters):
+        psycopg2 = self.driver
+        try:
+            run(statement, parameters)
+        except psycopg2.IntegrityError as e:
+            raise sqlite3.IntegrityError(str(e)) from e
+        except psycopg2.OperationalError as e:
+            raise sqlite3.OperationalError(str(e)) from e
+        except psycopg2.Error as e:
+            raise sqlite3.DatabaseError(str(e)) from e
+
+    def _begin(self, kind):
+        cursor = self.raw.cursor()
+        if not self.in_transaction:
+            self._run(cursor.execute, 'BEGIN', None)
+        if kind == 'begin_immediate':
+            self._run(cursor.execute, 'SELECT pg_advisory_xact_lock(%d)' % WRITE_LOCK_KEY, None)
+
+    # Start a transaction holding WRITE_LOCK_KEY shared and a lock on each of
+    # keys (strings such as 'student:1234'), taken in one order so two writers
+    # cannot deadlock
+    def begin_keyed(self, keys):
+        self._begin('begin')
+        cursor = self.raw.cursor()
+        self._run(cursor.execute, 'SELECT pg_advisory_xact_lock_shared(%d)' % WRITE_LOCK_KEY, None)
+        if keys:
+            self._run(cursor.execute, '''
+                SELECT COUNT(pg_advisory_xact_lock(%d, h))
+                FROM (SELECT DISTINCT hashtext(k) AS h FROM unnest(CAST(%%s AS text[])) AS k ORDER BY h) AS locks
+            ''' % WRITE_LOCK_KEY, (sorted(set(keys)),))
+
+    def execute(self, sql, parameters=()):
+        kind, statement = translate(sql)
+        if kind == 'noop':
+            return EmptyCursor()
+        if kind in ('begin', 'begin_immediate'):
+            self._begin(kind)
+            return EmptyCursor()
+        if kind == 'commit':
+            self.commit()
+            return EmptyCursor()
+        if kind == 'rollback':
+            self.rollback()
+            return EmptyCursor()
+        if kind == 'dml':
+            self._begin(kind)
+
+        cursor = self.raw.cursor(cursor_factory=self.driver.extras.DictCursor)
+        self._run(cursor.execute, statement, adapt(parameters))
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        kind, statement = translate(sql)
+        if kind == 'dml':
+            self._begin(kind)
+        cursor = self.raw.cursor()
+        self._run(lambda statement, rows: self.driver.extras.execute_batch(cursor, statement, rows, page_size=500),
+                  statement, [adapt(parameters) for parameters in seq_of_parameters])
+        return cursor
+
+    def commit(self):
+        if self.in_transaction:
+            self.raw.cursor().execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self.raw.cursor().execute('ROLLBACK')
+
+    def close(self):
+        self.raw.close()
+
+
+# Connect to a postgresql:// URL; busy_timeout becomes the lock_timeout, the
+# closest counterpart of SQLite waiting for its write lock
+def connect(url, busy_timeout):
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+
+    raw = psycopg2.connect(url, options='-c lock_timeout=%d' % busy_timeout)
+    raw.autocommit = True
+    numeric = psycopg2.extensions.new_type(psycopg2.extensions.DECIMAL.values, 'SQLITE_NUMERIC', cast_numeric)
+    psycopg2.extensions.register_type(numeric, raw)
+    return PostgresConnection(raw, psycopg2)
@@ -0,0 +1,82 @@
+# Reservation conflict checks. Pending and approved bookings hold a seat; a
+# lab can take as many overlapping bookings as it has seats. Candidates come
+# from the (lab_id, date, start_time, end_time) index: only the bookings of
+# that lab and day that overlap the requested window are read, and a sweep
+# over their start and end points finds the busiest moment.
+
+# Statuses that hold a seat
+HOLDING_STATUSES = ('pending', 'approved')
+
+RESERVATION_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_reservations_lab_slot ON reservations (lab_id, date, start_time, end_time)',
+]
+
+
+def overlapping_reservations(conn, lab_id, date, start_time, end_time):
+    return conn.execute('''
+        SELECT id, student_id, start_time, end_time
+        FROM reservations
+        WHERE lab_id = ? AND date = ? AND start_time < ? AND end_time > ?
+          AND status IN (%s)
+    ''' % ', '.join('?' * len(HOLDING_STATUSES)), (lab_id, date, end_time, start_time) + HOLDING_STATUSES).fetchall()
+
+
+# Largest number of the given bookings in progress at once within
+# [start_time, end_time), and the bookings in progress at that moment
+def peak_overlap(reservations, start_time, end_time):
+    points = []
+    for reservation in reservations:
+        points.append((max(reservation['start_time'], start_time), 1, reservation))
+        points.append((min(reservation['end_time'], end_time), -1, reservation))
+    # Ends sort before starts at the same time: back-to-back slots do not overlap
+    points.sort(key=lambda point: (point[0], point[1]))
+
+    current, peak, at_peak = set(), 0, []
+    for time, change, reservation in points:
+        if change > 0:
+            current.add(reservation['id'])
+            if len(current) > peak:
+                peak = len(current)
+                at_peak = [r for r in reservations if r['id'] in current]
+        else:
+            current.discard(reservation['id'])
+    return peak, at_peak
+
+
+def describe_slots(reservations):
+    slots = {}
+    for reservation in reservations:
+        slot = '%s-%s' % (reservation['start_time'], reservation['end_time'])
+        slots[slot] = slots.get(slot, 0) + 1
+    return ', '.join('%s (%d booked)' % (slot, count) if count > 1 else slot
+                     for slot, count in sorted(slots.items()))
+
+
+# Reasons the booking cannot be taken, empty when it fits. lab is a
+# laboratories row with id, name and capacity.
+def reservation_conflicts(conn, lab, student_id, date, start_time, end_time):
+    if start_time >= end_time:
+        return ['End time must be after start time']
+
+    conflicts = []
+
+    own = conn.execute('''
+        SELECT r.start_time, r.end_time, l.name as lab_name
+        FROM reservations r
+        JOIN laboratories l ON l.id = r.lab_id
+        WHERE r.student_id = ? AND r.date = ? AND r.start_time < ? AND r.end_time > ?
+          AND r.status IN (%s)
+        ORDER BY r.start_time, r.id
+    ''' % ', '.join('?' * len(HOLDING_STATUSES)),
+        (student_id, date, end_time, start_time) + HOLDING_STATUSES).fetchall()
+    for reservation in own:
+        conflicts.append('Student already has a reservation in %s from %s to %s' % (
+            reservation['lab_name'], reservation['start_time'], reservation['end_time']))
+
+    overlapping = overlapping_reservations(conn, lab['id'], date, start_time, end_time)
+    peak, at_peak = peak_overlap(overlapping, start_time, end_time)
+    if peak >= lab['capacity']:
+        conflicts.append('%s is fully booked (%d seats) during %s' % (
+            lab['name'], lab['capacity'], describe_slots(at_peak)))
+
+    return conflicts
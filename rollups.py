@@ -0,0 +1,129 @@
+import click
+from flask.cli import with_appcontext
+
+from database import backend, get_db_connection
+from timestamps import epoch_day
+
+# Daily usage rollups: one row per (day, lab_id, purpose) with sit-in counts and
+# total minutes of completed sessions, so dashboards read a handful of rows
+# instead of aggregating all of sit_ins. The helpers below run inside the
+# caller's transaction; the caller commits together with the sit-in change.
+# Times passed in are epoch seconds (see timestamps.py).
+
+ROLLUP_DDL = '''
+    CREATE TABLE IF NOT EXISTS usage_rollups (
+        day DATE NOT NULL,
+        lab_id INTEGER NOT NULL,
+        purpose TEXT NOT NULL,
+        sit_in_count INTEGER NOT NULL DEFAULT 0,
+        completed_count INTEGER NOT NULL DEFAULT 0,
+        total_minutes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, lab_id, purpose)
+    ) WITHOUT ROWID
+'''
+
+
+def record_check_in(conn, lab_id, purpose, login_time):
+    record_check_ins(conn, [(lab_id, purpose, login_time)])
+
+
+# Count several check-ins at once; sessions are grouped per rollup row so each
+# row is written once
+def record_check_ins(conn, check_ins):
+    counts = {}
+    for lab_id, purpose, login_time in check_ins:
+        key = (epoch_day(login_time), lab_id, purpose)
+        counts[key] = counts.get(key, 0) + 1
+
+    conn.executemany('''
+        INSERT INTO usage_rollups (day, lab_id, purpose, sit_in_count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, lab_id, purpose) DO UPDATE SET sit_in_count = usage_rollups.sit_in_count + excluded.sit_in_count
+    ''', [key + (count,) for key, count in counts.items()])
+
+
+# Count a checkout against the day the session started. Returns False when the
+# sit-in is not active, in which case nothing was recorded.
+def record_checkout(conn, sit_in_id, logout_time):
+    return bool(record_checkouts(conn, [sit_in_id], logout_time))
+
+
+# Count checkouts of several sit-ins; returns the IDs that were active and
+# therefore counted. A logout_time of None counts each session as having run
+# its full session_remaining, as the auto-checkout closes them. PostgreSQL
+# locks the sessions, so a concurrent checkout of one waits and then finds it
+# no longer active; SQLite callers hold the write lock already.
+def record_checkouts(conn, sit_in_ids, logout_time):
+    sessions = conn.execute('''
+        SELECT id, lab_id, purpose, login_time,
+               (COALESCE(?, login_time + session_remaining * 60) - login_time) / 60 as minutes
+        FROM sit_ins
+        WHERE status = 'active' AND id IN (%s)
+    ''' % ', '.join('?' * len(sit_in_ids)) + (' ORDER BY id FOR UPDATE' if backend(conn) == 'postgresql' else ''),
+        [logout_time] + list(sit_in_ids)).fetchall()
+
+    totals = {}
+    for session in sessions:
+        key = (epoch_day(session['login_time']), session['lab_id'], session['purpose'])
+        count, minutes = totals.get(key, (0, 0))
+        totals[key] = (count + 1, minutes + (session['minutes'] or 0))
+
+    conn.executemany('''
+        UPDATE usage_rollups
+        SET completed_count = completed_count + ?, total_minutes = total_minutes + ?
+        WHERE day = ? AND lab_id = ? AND purpose = ?
+    ''', [(count, minutes) + key for key, (count, minutes) in totals.items()])
+
+    return [session['id'] for session in sessions]
+
+
+# Day and minutes of a sit-in in SQL. Migrations before schema version 13 also
+# rebuild rollups, while the times were still text.
+EPOCH_ROLLUP_COLUMNS = ("date(login_time, 'unixepoch')", 'duration_seconds / 60')
+TEXT_ROLLUP_COLUMNS = ('substr(login_time, 1, 10)',
+                       "(strftime('%s', logout_time) - strftime('%s', login_time)) / 60")
+
+
+# Recompute every rollup row from sit_ins, adding the rows of archived
+# semesters (see archive.py) from their saved rollups, which exist from schema
+# version 12 on
+def rebuild_rollups(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    day, minutes = EPOCH_ROLLUP_COLUMNS if version >= 13 else TEXT_ROLLUP_COLUMNS
+    conn.execute('DELETE FROM usage_rollups')
+    conn.execute('''
+        INSERT INTO usage_rollups (day, lab_id, purpose, sit_in_count, completed_count, total_minutes)
+        SELECT %(day)s, lab_id, purpose,
+               COUNT(*),
+               SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END),
+               COALESCE(SUM(CASE WHEN status = 'completed' AND logout_time IS NOT NULL
+                                 THEN %(minutes)s
+                            END), 0)
+        FROM sit_ins
+        GROUP BY %(day)s, lab_id, purpose
+    ''' % {'day': day, 'minutes': minutes})
+    if version >= 12:
+        # The WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+        conn.execute('''
+            INSERT INTO usage_rollups (day, lab_id, purpose, sit_in_count, completed_count, total_minutes)
+            SELECT day, lab_id, purpose, SUM(sit_in_count), SUM(completed_count), SUM(total_minutes)
+            FROM archived_rollups
+            WHERE true
+            GROUP BY day, lab_id, purpose
+            ON CONFLICT (day, lab_id, purpose) DO UPDATE SET
+                sit_in_count = usage_rollups.sit_in_count + excluded.sit_in_count,
+                completed_count = usage_rollups.completed_count + excluded.completed_count,
+                total_minutes = usage_rollups.total_minutes + excluded.total_minutes
+        ''')
+
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Backfill usage_rollups from the full sit-in history."""
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    rebuild_rollups(conn)
+    conn.commit()
+    count = conn.execute('SELECT COUNT(*) FROM usage_rollups').fetchone()[0]
+    click.echo('Rebuilt %d usage rollup rows' % count)
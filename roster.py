@@ -0,0 +1,114 @@
+import csv
+import io
+import itertools
+
+import click
+from flask.cli import with_appcontext
+
+from database import get_db_connection
+
+# Enrollment roster import. The CSV is read row by row and written in chunks,
+# each chunk in its own transaction, so memory stays flat however long the
+# file is and a bad row only costs that row. Expected columns: id, name,
+# program and optionally year_level (student_id is accepted for id).
+
+CHUNK_ROWS = 1000
+
+# Rejected rows reported back in full; beyond this only the count grows
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_roster_row(row):
+    student_id = (row.get('id') or row.get('student_id') or '').strip()
+    name = (row.get('name') or '').strip()
+    program = (row.get('program') or '').strip()
+    year_level = (row.get('year_level') or '').strip()
+
+    if not student_id.isdigit():
+        raise ValueError('id must be a number')
+    if not name or not program:
+        raise ValueError('name and program are required')
+    if year_level and not (year_level.isdigit() and 1 <= int(year_level) <= 5):
+        raise ValueError('year_level must be between 1 and 5')
+
+    return int(student_id), name, program, int(year_level) if year_level else None
+
+
+# Upsert one chunk of parsed rows; returns (inserted, updated, unchanged)
+def upsert_students(conn, rows):
+    # A student listed twice in a chunk keeps the last row, as it would across chunks
+    rows = list({row[0]: row for row in rows}.values())
+
+    conn.execute('BEGIN IMMEDIATE')
+    existing = {row['id']: tuple(row) for row in conn.execute(
+        'SELECT id, name, program, year_level FROM students WHERE id IN (%s)' % ', '.join('?' * len(rows)),
+        [row[0] for row in rows])}
+
+    # Unchanged students are skipped so their search index rows are not rewritten
+    changed = [row for row in rows if existing.get(row[0]) != row]
+    conn.executemany('''
+        INSERT INTO students (id, name, program, year_level)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            program = excluded.program,
+            year_level = excluded.year_level
+    ''', changed)
+    conn.commit()
+
+    inserted = sum(1 for row in changed if row[0] not in existing)
+    return inserted, len(changed) - inserted, len(rows) - len(changed)
+
+
+# Import a roster from a text stream; returns the counts and the first
+# rejected rows with their line numbers
+def import_roster(conn, stream, chunk_rows=CHUNK_ROWS):
+    result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0, 'errors': []}
+
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or not {'name', 'program'} <= set(reader.fieldnames) \
+            or not {'id', 'student_id'} & set(reader.fieldnames):
+        raise ValueError('Roster must have id, name and program columns')
+
+    while True:
+        chunk = []
+        read = 0
+        for row in itertools.islice(reader, chunk_rows):
+            read += 1
+            try:
+                chunk.append(parse_roster_row(row))
+            except ValueError as e:
+                result['rejected'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append({'line': reader.line_num, 'error': str(e)})
+
+        if chunk:
+            inserted, updated, unchanged = upsert_students(conn, chunk)
+            result['inserted'] += inserted
+            result['updated'] += updated
+            result['unchanged'] += unchanged
+        if read < chunk_rows:
+            return result
+
+
+# Text stream over an uploaded file or request body, decoded as it is read
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='', errors='replace')
+
+
+@click.command('import-roster')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-rows', default=CHUNK_ROWS, show_default=True, help='Rows per transaction.')
+@with_appcontext
+def import_roster_command(path, chunk_rows):
+    """Insert or update students from an enrollment roster CSV."""
+    conn = get_db_connection()
+    with open(path, 'rb') as f:
+        try:
+            result = import_roster(conn, text_stream(f), chunk_rows)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for error in result['errors']:
+        click.echo('line %(line)d: %(error)s' % error, err=True)
+    click.echo('Inserted %(inserted)d, updated %(updated)d, unchanged %(unchanged)d, rejected %(rejected)d' % result)
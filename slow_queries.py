@@ -0,0 +1,272 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+
+from database import backend, get_db_connection, open_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Slow-query log. Every statement of a request that takes longer than
+# SLOW_QUERY_MS is recorded with its normalized SQL, the shapes (never the
+# values) of its parameters, the endpoint and its EXPLAIN QUERY PLAN, so the
+# filter combinations of the search and report pages that end up scanning
+# sit_ins or sorting in a temp B-tree can be found. Entries are written by a
+# background thread on its own connection; the request only runs the EXPLAIN.
+
+SLOW_QUERIES_DDL = '''
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT NOT NULL,
+    normalized_sql TEXT NOT NULL,
+    param_shapes TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    endpoint TEXT,
+    query_plan TEXT,
+    full_scans TEXT NOT NULL DEFAULT '',
+    temp_btrees TEXT NOT NULL DEFAULT '',
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+SLOW_QUERY_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint ON slow_queries (fingerprint)',
+    'CREATE INDEX IF NOT EXISTS idx_slow_queries_recorded ON slow_queries (recorded_at)',
+]
+
+# Entries waiting for the writer; beyond this a burst of slow queries is
+# dropped rather than queued
+QUEUE_SIZE = 1000
+
+
+# SQL with literals replaced by ?, IN lists collapsed and whitespace squeezed,
+# so queries built with different filter values compare equal
+def normalize_sql(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+# Type of each parameter; LIKE patterns keep their wildcard positions
+def param_shape(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        if '%' in value:
+            return ('%' if value.startswith('%') else '') + 'text' + ('%' if value.endswith('%') else '')
+        return 'text'
+    return type(value).__name__
+
+
+def param_shapes(parameters):
+    if parameters is None:
+        return []
+    if isinstance(parameters, dict):
+        return ['%s:%s' % (name, param_shape(value)) for name, value in sorted(parameters.items())]
+    return [param_shape(value) for value in parameters]
+
+
+# Statements that have a plan; BEGIN, COMMIT and PRAGMA are logged without one
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+
+# Plan lines of sql: SQLite's detail column, or PostgreSQL's EXPLAIN text. A
+# failed statement aborts a PostgreSQL transaction, so there the EXPLAIN runs
+# inside a savepoint.
+def explain(conn, sql, parameters):
+    match = re.match(r'\s*(\w+)', sql)
+    if not match or match.group(1).upper() not in EXPLAINABLE:
+        return None
+    savepoint = backend(conn) == 'postgresql' and conn.in_transaction
+    if savepoint:
+        conn.execute('SAVEPOINT slow_query_explain')
+    try:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error:
+        if savepoint:
+            conn.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        return None
+    finally:
+        if savepoint:
+            conn.execute('RELEASE SAVEPOINT slow_query_explain')
+    return [row[-1] for row in rows]
+
+
+NOT_ALIASES = {'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'ON', 'USING', 'GROUP',
+               'ORDER', 'LIMIT', 'UNION', 'EXCEPT', 'INTERSECT', 'HAVING', 'WINDOW', 'SET', 'VALUES', 'RETURNING'}
+
+
+# Alias -> table for the FROM and JOIN clauses of sql
+def table_aliases(sql):
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        if alias and alias.upper() not in NOT_ALIASES:
+            aliases[alias] = table
+    return aliases
+
+
+# Tables read in full and the clauses sorted through temp B-trees. SQLite
+# prints "SCAN s" for "sit_ins s" (older versions "SCAN TABLE sit_ins AS s");
+# a scan using an index still reads every entry of it. On PostgreSQL these are
+# "Seq Scan on sit_ins s" and Sort nodes.
+def plan_problems(plan, sql):
+    aliases = table_aliases(sql)
+    scans, btrees = [], []
+    for detail in plan or []:
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+        if match and match.group(1) != 'CONSTANT':
+            scans.append(aliases.get(match.group(1), match.group(1)))
+        match = re.match(r'USE TEMP B-TREE FOR (.+)', detail)
+        if match:
+            btrees.append(match.group(1))
+        match = re.match(r'\s*(?:->\s*)?(?:Parallel )?Seq Scan on (\w+)', detail)
+        if match:
+            scans.append(match.group(1))
+        if re.match(r'\s*(?:->\s*)?(?:Incremental )?Sort\b', detail):
+            btrees.append('SORT')
+    return sorted(set(scans)), sorted(set(btrees))
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self.database = None
+        self.threshold = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # SLOW_QUERY_MS is the threshold in milliseconds (0 logs every statement,
+    # a negative value turns the log off); SLOW_QUERY_KEEP caps the entries kept
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_MS', float(os.environ.get('SLOW_QUERY_MS', 100)))
+        app.config.setdefault('SLOW_QUERY_KEEP', int(os.environ.get('SLOW_QUERY_KEEP', 20000)))
+        app.extensions['slow_query_log'] = self
+        app.cli.add_command(slow_queries_command)
+        self.database = app.config['DATABASE']
+        self.keep = app.config['SLOW_QUERY_KEEP']
+        if app.config['SLOW_QUERY_MS'] < 0:
+            return
+        self.threshold = app.config['SLOW_QUERY_MS'] / 1000
+        app.extensions.setdefault('sqlite_observers', []).append(self.observe)
+
+    def observe(self, conn, sql, parameters, seconds):
+        if seconds < self.threshold or sql == 'COMMIT' or sql.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+
+        # executemany() and executescript() pass no single set of parameters
+        plan = explain(conn.wrapped, sql, parameters) if parameters is not None else None
+        scans, btrees = plan_problems(plan, sql)
+        normalized = normalize_sql(sql)
+        entry = (fingerprint(normalized), normalized, json.dumps(param_shapes(parameters)),
+                 round(seconds * 1000, 3), request.endpoint if has_request_context() else None,
+                 '\n'.join(plan) if plan is not None else None, ','.join(scans), ','.join(btrees))
+        try:
+            self._writer_queue().put_nowait(entry)
+        except queue.Full:
+            pass
+
+    # Threads do not survive a fork, so each worker starts its own writer
+    def _writer_queue(self):
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                name='slow-query-log', daemon=True)
+                self._thread.start()
+            return self._queue
+
+    def _run(self, entries):
+        conn = open_db_connection(self.database)
+        while True:
+            batch = [entries.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(entries.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                write_entries(conn, batch, self.keep)
+            except sqlite3.Error:
+                conn.rollback()
+                logger.exception('Could not write %d slow-query entries', len(batch))
+
+
+def write_entries(conn, entries, keep):
+    conn.executemany('''
+        INSERT INTO slow_queries (fingerprint, normalized_sql, param_shapes, duration_ms, endpoint,
+                                  query_plan, full_scans, temp_btrees)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', entries)
+    conn.execute('DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?', (keep,))
+    conn.commit()
+
+
+# One row per statement shape, worst offenders first: statements that scan
+# sit_ins, then any full scan or temp B-tree, then total time
+def slow_query_summary(conn, since=None, limit=50):
+    return conn.execute('''
+        SELECT fingerprint,
+               MAX(normalized_sql) AS normalized_sql,
+               GROUP_CONCAT(DISTINCT endpoint) AS endpoints,
+               GROUP_CONCAT(DISTINCT param_shapes) AS param_shapes,
+               COUNT(*) AS occurrences,
+               ROUND(AVG(duration_ms), 1) AS avg_ms,
+               ROUND(MAX(duration_ms), 1) AS max_ms,
+               ROUND(SUM(duration_ms), 1) AS total_ms,
+               MAX(full_scans) AS full_scans,
+               MAX(temp_btrees) AS temp_btrees,
+               MAX(query_plan) AS query_plan,
+               MAX(recorded_at) AS last_seen
+        FROM slow_queries
+        WHERE recorded_at >= COALESCE(?, '')
+        GROUP BY fingerprint
+        ORDER BY (',' || MAX(full_scans) || ',') LIKE '%,sit_ins,%' DESC,
+                 (MAX(full_scans) != '' OR MAX(temp_btrees) != '') DESC,
+                 total_ms DESC
+        LIMIT ?
+    ''', (since, limit)).fetchall()
+
+
+slow_query_log = SlowQueryLog()
+
+
+@click.command('slow-queries')
+@click.option('--since', help='only entries recorded on or after this date (YYYY-MM-DD)')
+@click.option('--limit', default=20, show_default=True, help='statement shapes to list')
+@click.option('--plans/--no-plans', default=True, help='print the query plan of each statement')
+@with_appcontext
+def slow_queries_command(since, limit, plans):
+    """Summarize logged slow statements, full scans and temp B-tree sorts first."""
+    rows = slow_query_summary(get_db_connection(), since, limit)
+    if not rows:
+        click.echo('No slow queries logged (threshold %s ms)' % current_app.config['SLOW_QUERY_MS'])
+        return
+
+    for row in rows:
+        problems = ['SCAN %s' % table for table in row['full_scans'].split(',') if table] + \
+                   ['TEMP B-TREE FOR %s' % clause for clause in row['temp_btrees'].split(',') if clause]
+        click.echo('%dx  avg %.1f ms  max %.1f ms  total %.1f ms  [%s]' % (
+            row['occurrences'], row['avg_ms'], row['max_ms'], row['total_ms'], row['endpoints'] or '-'))
+        click.echo('    %s' % row['normalized_sql'])
+        click.echo('    params: %s' % row['param_shapes'])
+        if problems:
+            click.echo('    problems: %s' % ', '.join(problems))
+        if plans and row['query_plan']:
+            for line in row['query_plan'].splitlines():
+                click.echo('      | %s' % line)
+        click.echo('')
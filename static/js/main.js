@@ -23,6 +23,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize export buttons
     initExportButtons();
+    
+    // Apply live check-in and checkout events to the sit-in board
+    initLiveSitIns();
 });
 
 // Modal handling
@@ -275,6 +278,11 @@ function initExportButtons() {
     const exportButtons = document.querySelectorAll('.export-btn');
     
     exportButtons.forEach(button => {
+        // Job-backed exports are started by the page that owns the filters
+        if (button.getAttribute('data-job-url')) {
+            return;
+        }
+        
         button.addEventListener('click', function() {
             const format = this.getAttribute('data-format');
             const baseUrl = this.getAttribute('data-url') || '/export-report';
@@ -290,3 +298,156 @@ function initExportButtons() {
         });
     });
 }
+
+// Background export jobs: submit the filters, poll the job until the file
+// is ready, then download it
+function runExportJob(jobUrl, params, button) {
+    const label = button.innerHTML;
+    button.disabled = true;
+    
+    fetch(jobUrl, { method: 'POST', body: params })
+        .then(response => response.json())
+        .then(job => pollExportJob(job, button, label))
+        .catch(error => {
+            console.error('Error:', error);
+            finishExportJob(button, label);
+        });
+}
+
+function pollExportJob(job, button, label) {
+    if (job.status === 'done') {
+        finishExportJob(button, label);
+        window.location.href = job.download_url;
+        return;
+    }
+    
+    if (job.error || job.status === 'failed') {
+        finishExportJob(button, label);
+        alert('Export failed: ' + (job.error || 'unknown error'));
+        return;
+    }
+    
+    button.textContent = `Exporting... ${job.progress}%`;
+    
+    setTimeout(() => {
+        fetch(job.status_url)
+            .then(response => response.json())
+            .then(next => pollExportJob(next, button, label))
+            .catch(error => {
+                console.error('Error:', error);
+                finishExportJob(button, label);
+            });
+    }, 1000);
+}
+
+function finishExportJob(button, label) {
+    button.disabled = false;
+    button.innerHTML = label;
+    
+    if (window.feather) {
+        feather.replace();
+    }
+}
+
+// Live sit-in board: apply check-in and checkout events streamed by the
+// server to the current sit-in table instead of reloading the page
+function initLiveSitIns() {
+    const table = document.getElementById('current-sitin-table');
+    
+    if (!table || !table.getAttribute('data-events-url') || !window.EventSource) {
+        return;
+    }
+    
+    const url = table.getAttribute('data-events-url') + '?since=' + table.getAttribute('data-last-event-id');
+    const source = new EventSource(url);
+    
+    source.addEventListener('check_in', function(event) {
+        addSitInRow(table, JSON.parse(event.data));
+    });
+    
+    source.addEventListener('checkout', function(event) {
+        removeSitInRow(table, JSON.parse(event.data).id);
+    });
+    
+    source.addEventListener('occupancy', function(event) {
+        showLabOccupancy(JSON.parse(event.data));
+    });
+    
+    source.addEventListener('reload', function() {
+        source.close();
+        window.location.reload();
+    });
+}
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value == null ? '' : String(value);
+    return div.innerHTML;
+}
+
+function addSitInRow(table, sitIn) {
+    if (document.getElementById(`sit-in-${sitIn.id}`)) {
+        return;
+    }
+    
+    const checkoutUrl = `/checkout/${sitIn.id}`;
+    const row = document.createElement('tr');
+    row.id = `sit-in-${sitIn.id}`;
+    row.innerHTML = `
+        <td>${escapeHtml(sitIn.id)}</td>
+        <td>${escapeHtml(sitIn.student_id)}</td>
+        <td>${escapeHtml(sitIn.name)}</td>
+        <td>${escapeHtml(sitIn.purpose)}</td>
+        <td>${escapeHtml(sitIn.lab_id)}</td>
+        <td>${escapeHtml(sitIn.session_remaining)} min</td>
+        <td><span class="badge" style="background-color: #4CAF50; color: white; padding: 5px 10px; border-radius: 4px;">Active</span></td>
+        <td>
+            <a href="${checkoutUrl}" class="btn btn-danger btn-sm checkout-btn" data-href="${checkoutUrl}">
+                <i data-feather="log-out" style="width: 14px; height: 14px;"></i> Logout
+            </a>
+        </td>`;
+    
+    row.querySelector('.checkout-btn').addEventListener('click', function(event) {
+        event.preventDefault();
+        if (confirm('Are you sure you want to check out this student?')) {
+            window.location.href = this.getAttribute('data-href');
+        }
+    });
+    
+    if (window.jQuery && $.fn.DataTable && $.fn.DataTable.isDataTable(table)) {
+        $(table).DataTable().row.add(row).draw(false);
+    } else {
+        table.querySelector('tbody').prepend(row);
+    }
+    
+    if (window.feather) {
+        feather.replace();
+    }
+}
+
+function removeSitInRow(table, sitInId) {
+    const row = document.getElementById(`sit-in-${sitInId}`);
+    
+    if (!row) {
+        return;
+    }
+    
+    if (window.jQuery && $.fn.DataTable && $.fn.DataTable.isDataTable(table)) {
+        $(table).DataTable().row(row).remove().draw(false);
+    } else {
+        row.remove();
+    }
+}
+
+function showLabOccupancy(occupancy) {
+    const element = document.getElementById('lab-occupancy');
+    
+    if (!element) {
+        return;
+    }
+    
+    const labs = Object.keys(occupancy).sort();
+    element.textContent = labs.length
+        ? labs.map(lab => `Lab ${lab}: ${occupancy[lab]}`).join(' | ')
+        : 'No active sit-ins';
+}
@@ -0,0 +1,31 @@
+import pytest
+
+from app import create_app, init_db
+from database import open_db_connection
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'sitin.db'),
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    })
+    init_db(app)
+    return app
+
+
+# A separate connection for setting up and inspecting rows
+@pytest.fixture
+def db(app):
+    conn = open_db_connection(app.config['DATABASE'])
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
@@ -0,0 +1,42 @@
+import datetime
+
+from timestamps import to_epoch
+
+
+def add_completed_sit_in(db, login_time, minutes=60):
+    login = to_epoch(login_time)
+    db.execute('''
+        INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, logout_time, status, duration_seconds)
+        VALUES (1, 'Python', 524, ?, ?, 'completed', ?)
+    ''', (login, login + minutes * 60, minutes * 60))
+
+
+def test_archive_skips_semesters_without_sit_ins(app, db, tmp_path):
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (1, 'Ana Cruz', 'BSIT', 2)")
+    # 2022-2023-1 and 2023-2024-1 hold sit-ins, 2022-2023-2 between them none
+    add_completed_sit_in(db, datetime.datetime(2022, 9, 5, 9, 0))
+    add_completed_sit_in(db, datetime.datetime(2023, 9, 4, 9, 0))
+    db.commit()
+
+    result = app.test_cli_runner().invoke(args=['archive-sit-ins', '--after-days', '1'])
+
+    assert result.exit_code == 0, result.output
+    assert [row[0] for row in db.execute('SELECT semester FROM archived_semesters ORDER BY semester')] == [
+        '2022-2023-1', '2023-2024-1']
+    assert sorted(path.name for path in (tmp_path / 'archive').iterdir()) == [
+        'sit_ins_2022-2023-1.db', 'sit_ins_2023-2024-1.db']
+    assert db.execute('SELECT COUNT(*) FROM sit_ins').fetchone()[0] == 0
+
+
+def test_dry_run_lists_only_semesters_with_sit_ins(app, db):
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (1, 'Ana Cruz', 'BSIT', 2)")
+    add_completed_sit_in(db, datetime.datetime(2022, 9, 5, 9, 0))
+    add_completed_sit_in(db, datetime.datetime(2023, 9, 4, 9, 0))
+    db.commit()
+
+    result = app.test_cli_runner().invoke(args=['archive-sit-ins', '--after-days', '1', '--dry-run'])
+
+    assert result.exit_code == 0, result.output
+    assert '2022-2023-2' not in result.output
+    assert '2022-2023-1: 1 sit-ins' in result.output
+    assert '2023-2024-1: 1 sit-ins' in result.output
@@ -0,0 +1,94 @@
+import datetime
+
+import pytest
+
+from auto_checkout import expire_overdue_sessions, sweeper_metrics
+from timestamps import to_epoch
+
+
+def check_in(client, remaining_session):
+    return client.post('/sit-in', data={'student_id': '2001', 'student_name': 'Ana Cruz', 'purpose': 'Python',
+                                        'lab': '524', 'remaining_session': remaining_session})
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+@pytest.mark.parametrize('remaining_session', ['', 'abc', '0', '-5', '2.5'])
+def test_check_in_rejects_invalid_session_length(admin, db, remaining_session):
+    response = check_in(admin, remaining_session)
+
+    assert response.status_code == 302
+    assert ('error', 'Remaining session must be a positive number of minutes') in flashes(admin)
+    assert db.execute('SELECT COUNT(*) FROM sit_ins').fetchone()[0] == 0
+
+
+def test_check_in_stores_session_length_as_minutes(admin, db):
+    check_in(admin, '45')
+
+    row = db.execute('SELECT status, session_remaining FROM sit_ins WHERE student_id = 2001').fetchone()
+    assert tuple(row) == ('active', 45)
+
+
+def test_batch_check_in_reports_each_item(admin, db):
+    response = admin.post('/api/sit-ins/batch-check-in', json={'check_ins': [
+        {'student_id': 2001, 'purpose': 'Python', 'lab': 524, 'remaining_session': '45'},
+        'not an object',
+        {'student_id': 2002, 'purpose': '  ', 'lab': 524},
+        {'student_id': 2003, 'purpose': 'Java', 'lab': 524, 'remaining_session': ''},
+        {'student_id': 2004, 'purpose': 'Java', 'lab': 999},
+        {'student_id': 2001, 'purpose': 'Java', 'lab': 526},
+    ]})
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['checked_in'] == 1
+    assert [result['status'] for result in body['results']] == ['ok', 'error', 'error', 'error', 'error', 'error']
+    assert [result.get('error') for result in body['results'][1:]] == [
+        'Each check-in must be an object',
+        'student_id, purpose and lab are required',
+        'remaining_session must be a positive number of minutes',
+        'Unknown laboratory',
+        'Student appears twice in this batch',
+    ]
+    assert tuple(db.execute('SELECT student_id, session_remaining FROM sit_ins').fetchone()) == (2001, 45)
+
+
+def test_sweep_closes_only_overdue_sessions(app, db):
+    login = datetime.datetime(2026, 3, 2, 9, 0)
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2001, 'Ana Cruz', 'BSIT', 2)")
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2002, 'Ben Reyes', 'BSCS', 1)")
+    db.executemany('''
+        INSERT INTO sit_ins (student_id, purpose, lab_id, login_time, status, session_remaining)
+        VALUES (?, 'Python', 524, ?, 'active', ?)
+    ''', [(2001, to_epoch(login), 30), (2002, to_epoch(login), 90)])
+    db.commit()
+
+    now = login + datetime.timedelta(minutes=60)
+    assert expire_overdue_sessions(db, now) == 1
+
+    rows = db.execute('SELECT student_id, status, logout_time, duration_seconds FROM sit_ins ORDER BY student_id')
+    assert [tuple(row) for row in rows] == [
+        (2001, 'completed', to_epoch(login) + 30 * 60, 30 * 60),
+        (2002, 'active', None, None),
+    ]
+    assert db.execute('SELECT last_run_at FROM background_tasks').fetchone()[0] == to_epoch(now)
+    assert sweeper_metrics(db)['last_run_at'] == '2026-03-02 10:00:00'
+
+
+def test_batch_check_in_registers_new_students_only(admin, db):
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2001, 'Ana Cruz', 'BSIT', 2)")
+    db.commit()
+
+    response = admin.post('/api/sit-ins/batch-check-in', json={'check_ins': [
+        {'student_id': 2001, 'student_name': 'Renamed', 'purpose': 'Python', 'lab': 524},
+        {'student_id': 2002, 'student_name': 'Ben Reyes', 'purpose': 'Java', 'lab': 524},
+    ]})
+
+    assert response.get_json()['checked_in'] == 2
+    assert [tuple(row) for row in db.execute('SELECT id, name, program, year_level FROM students ORDER BY id')] == [
+        (2001, 'Ana Cruz', 'BSIT', 2),
+        (2002, 'Ben Reyes', 'Java', 1),
+    ]
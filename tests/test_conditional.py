@@ -0,0 +1,23 @@
+def set_pending_flash(client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Student successfully checked in')]
+
+
+def test_lookup_revalidates_while_a_flash_is_pending(admin):
+    first = admin.get('/api/search-students?query=ana')
+    set_pending_flash(admin)
+
+    response = admin.get('/api/search-students?query=ana', headers={'If-None-Match': first.headers['ETag']})
+
+    assert response.status_code == 304
+
+
+def test_page_is_rendered_while_a_flash_is_pending(admin):
+    first = admin.get('/view-sit-in')
+    set_pending_flash(admin)
+
+    response = admin.get('/view-sit-in', headers={'If-None-Match': first.headers['ETag']})
+
+    assert response.status_code == 200
+    assert b'Student successfully checked in' in response.data
+    assert 'ETag' not in response.headers
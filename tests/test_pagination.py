@@ -0,0 +1,44 @@
+from pagination import decode_cursor, encode_cursor, page_size, paginate
+
+
+def test_cursor_round_trips_its_key():
+    cursor = encode_cursor([1760000000, 42])
+
+    assert '=' not in cursor
+    assert decode_cursor(cursor, 2) == [1760000000, 42]
+
+
+def test_malformed_cursors_are_ignored():
+    assert decode_cursor('not a cursor!', 2) is None
+    assert decode_cursor(encode_cursor({'id': 1}), 1) is None
+    assert decode_cursor(encode_cursor([1, 2, 3]), 2) is None
+
+
+def test_page_size_is_clamped():
+    assert page_size({}) == 50
+    assert page_size({'per_page': 'ten'}) == 50
+    assert page_size({'per_page': '0'}) == 1
+    assert page_size({'per_page': '1000'}) == 200
+
+
+# Sit-ins sharing a login time, so the id has to break ties
+def test_pages_walk_forward_and_back_without_gaps(db):
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2001, 'Ana Cruz', 'BSIT', 2)")
+    db.executemany('''
+        INSERT INTO sit_ins (id, student_id, purpose, lab_id, login_time, status)
+        VALUES (?, 2001, 'Python', 524, ?, 'completed')
+    ''', [(id, 1767261600 + (id // 2) * 60) for id in range(1, 8)])
+    db.commit()
+    query, keys = 'SELECT id, login_time FROM sit_ins WHERE 1 = 1', [('login_time', 'login_time'), ('id', 'id')]
+
+    pages, args = [], {'per_page': '3'}
+    while True:
+        page = paginate(db, query, [], keys, descending=True, args=args)
+        pages.append([row['id'] for row in page.rows])
+        if not page.next_cursor:
+            break
+        args = {'per_page': '3', 'after': page.next_cursor}
+
+    assert pages == [[7, 6, 5], [4, 3, 2], [1]]
+    back = paginate(db, query, [], keys, descending=True, args={'per_page': '3', 'before': page.prev_cursor})
+    assert [row['id'] for row in back.rows] == [4, 3, 2]
@@ -0,0 +1,33 @@
+from reservations import describe_slots, peak_overlap
+
+
+def booking(id, start_time, end_time):
+    return {'id': id, 'start_time': start_time, 'end_time': end_time}
+
+
+def test_peak_overlap_counts_bookings_in_progress_at_once():
+    bookings = [booking(1, '08:00', '10:00'), booking(2, '09:00', '11:00'), booking(3, '09:30', '10:30'),
+                booking(4, '10:30', '12:00')]
+
+    peak, at_peak = peak_overlap(bookings, '08:00', '12:00')
+
+    assert peak == 3
+    assert [b['id'] for b in at_peak] == [1, 2, 3]
+
+
+def test_back_to_back_bookings_do_not_overlap():
+    bookings = [booking(1, '08:00', '09:00'), booking(2, '09:00', '10:00')]
+
+    assert peak_overlap(bookings, '08:00', '10:00')[0] == 1
+
+
+def test_bookings_reaching_past_the_window_are_clipped_to_it():
+    bookings = [booking(1, '08:00', '09:30'), booking(2, '09:45', '11:00')]
+
+    assert peak_overlap(bookings, '09:00', '10:00') == (1, [bookings[0]])
+
+
+def test_describe_slots_groups_identical_slots():
+    bookings = [booking(1, '09:00', '10:00'), booking(2, '09:00', '10:00'), booking(3, '08:00', '09:30')]
+
+    assert describe_slots(bookings) == '08:00-09:30, 09:00-10:00 (2 booked)'
@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from roster import import_roster, parse_roster_row
+
+
+def test_parse_roster_row_accepts_student_id_and_blank_year():
+    assert parse_roster_row({'student_id': ' 2001 ', 'name': 'Ana Cruz', 'program': 'BSIT', 'year_level': ''}) == (
+        2001, 'Ana Cruz', 'BSIT', None)
+
+
+@pytest.mark.parametrize('row, error', [
+    ({'id': 'x1', 'name': 'Ana Cruz', 'program': 'BSIT'}, 'id must be a number'),
+    ({'id': '2001', 'name': ' ', 'program': 'BSIT'}, 'name and program are required'),
+    ({'id': '2001', 'name': 'Ana Cruz', 'program': 'BSIT', 'year_level': '6'}, 'year_level must be between 1 and 5'),
+])
+def test_parse_roster_row_rejects(row, error):
+    with pytest.raises(ValueError, match=error):
+        parse_roster_row(row)
+
+
+def test_import_roster_counts_and_reports_by_line(db):
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2001, 'Ana Cruz', 'BSIT', 2)")
+    db.execute("INSERT INTO students (id, name, program, year_level) VALUES (2002, 'Ben Reyes', 'BSCS', 1)")
+    db.commit()
+    roster = io.StringIO('id,name,program,year_level\n'
+                         '2001,Ana Cruz,BSIT,2\n'
+                         '2002,Ben Reyes,BSIT,2\n'
+                         'abc,Bad Row,BSIT,1\n'
+                         '2003,Cara Diaz,BSCS,\n')
+
+    result = import_roster(db, roster, chunk_rows=2)
+
+    assert result == {'inserted': 1, 'updated': 1, 'unchanged': 1, 'rejected': 1,
+                      'errors': [{'line': 4, 'error': 'id must be a number'}]}
+    assert [tuple(row) for row in db.execute('SELECT id, program, year_level FROM students ORDER BY id')] == [
+        (2001, 'BSIT', 2), (2002, 'BSIT', 2), (2003, 'BSCS', None)]
+
+
+def test_import_roster_needs_id_name_and_program_columns(db):
+    with pytest.raises(ValueError, match='Roster must have id, name and program columns'):
+        import_roster(db, io.StringIO('name,program\nAna Cruz,BSIT\n'))
@@ -0,0 +1,40 @@
+import calendar
+import datetime
+import time
+
+# sit_ins.login_time and logout_time hold whole seconds since 1970-01-01 00:00
+# of the local wall clock: datetime.now() read as if it were UTC, the same
+# naive local time the columns held as text before schema version 13. Range
+# filters and durations are integer comparisons and subtractions, and
+# SQLite's date(x, 'unixepoch') gives the local day.
+
+# Converts a sit_ins table from text times in place and fills in
+# duration_seconds; SET expressions all read the old values. TIMESTAMP columns
+# have numeric affinity, so indexes and triggers stay as they are.
+EPOCH_CONVERSION = '''
+    UPDATE %(table)s
+    SET login_time = CAST(strftime('%%s', login_time) AS INTEGER),
+        logout_time = CAST(strftime('%%s', logout_time) AS INTEGER),
+        duration_seconds = strftime('%%s', logout_time) - strftime('%%s', login_time)
+'''
+
+
+def to_epoch(value):
+    return calendar.timegm(value.timetuple())
+
+
+def now_epoch():
+    return to_epoch(datetime.datetime.now())
+
+
+def from_epoch(seconds):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+
+
+# Also registered as the 'timestamp' template filter
+def format_epoch(seconds, fmt='%Y-%m-%d %H:%M:%S'):
+    return '' if seconds is None else time.strftime(fmt, time.gmtime(seconds))
+
+
+def epoch_day(seconds):
+    return time.strftime('%Y-%m-%d', time.gmtime(seconds))